@@ -1,33 +1,80 @@
 #!/usr/bin/env python3
 
+import base64
+import hmac
+import json
 import logging
 import logging.config
-from io import BytesIO
-from typing import Dict, Optional
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qsl
 
-import sentry_sdk
 from flask import Flask, abort, redirect, request
 from flask_cors import CORS
-from PIL import ImageFile, JpegImagePlugin
-from sentry_sdk.integrations.flask import FlaskIntegration
+from PIL import Image
 from werkzeug import Response
 
-from its.errors import ITSClientError, NotFoundError
-from its.loader import loader
-from its.normalize import NormalizationError, normalize
-from its.optimize import optimize
-from its.pipeline import process_transforms
+from its.client_hints import clamped_width, hinted_query, rendered_hint_headers
+from its.deadline import Deadline, get_deadline, set_deadline
+from its.derivative_store import get_derivative_store
+from its.errors import (
+    ITSClientError,
+    ITSRenderTimeoutError,
+    NotFoundError,
+    OriginUnavailableError,
+)
+from its.info import is_header_only, source_info
+from its.loader import get_image_loader, loader
+from its.peers import (
+    FORWARDED_HEADER,
+    NODE_HEADER,
+    broadcast,
+    forward,
+    peer_for,
+    peering,
+    self_address,
+)
+from its.placeholder import placeholder_query, source_placeholder
+from its.purge import check_purge_log, purge, purge_tag, sync_purges
+from its.pyramid import Pyramid
+from its.render import prepare, prepare_pyramid, render_renditions
+from its.render_cache import (
+    RENDER_CACHE,
+    Rendition,
+    cache_rendition,
+    canonical_query,
+    render_key,
+)
+from its.render_pool import get_render_pool, start_render_pool
 from its.settings import MIME_TYPES
-
-from .settings import CORS_ORIGINS, NAMESPACES, SENTRY_DSN, LOGGING
-from .util import get_redirect_location
-
-# https://stackoverflow.com/questions/12984426/python-pil-ioerror-image-file-truncated-with-big-images
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
-# workaround for https://github.com/python-pillow/Pillow/issues/1138
-# without this hack, pillow misidenfifies some jpeg files as "mpo" files
-JpegImagePlugin._getmp = lambda x: None  # noqa
+from its.source_cache import (
+    SOURCE_CACHE,
+    cache_pyramid,
+    get_pyramid,
+    is_origin_error,
+    is_popular,
+    stale_if_error,
+)
+from its.streaming import TeeStream, iter_buffer, iter_encoded, peek_image_size
+
+from .settings import (
+    ADMIN_TOKEN,
+    BATCH_MAX_RENDITIONS,
+    CORS_ORIGINS,
+    DEGRADED_MAX_AGE,
+    NAMESPACES,
+    RENDER_PROCESSES,
+    RENDER_TIMEOUT,
+    REQUEST_BUDGET,
+    SENTRY_DSN,
+    LOGGING,
+)
+from .util import (
+    get_redirect_location,
+    is_not_modified,
+    response_etag,
+    validator_headers,
+)
 
 APP = Flask(__name__)
 
@@ -41,6 +88,9 @@ logging.config.dictConfig(LOGGING)
 
 LOGGER = logging.getLogger(__name__)
 
+# our images are cacheable for one year
+CACHE_CONTROL = "max-age=31536000"
+
 
 def before_send(event, hint):
     if "log_record" in hint:
@@ -55,10 +105,54 @@ def before_send(event, hint):
 
 
 if SENTRY_DSN:
+    # sentry is slow to import, only pay for it when errors are reported
+    import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
+
     sentry_sdk.init(
         SENTRY_DSN, before_send=before_send, integrations=[FlaskIntegration()]
     )
 
+# start the render processes now, before the worker takes any requests
+if RENDER_PROCESSES:
+    start_render_pool(RENDER_PROCESSES)
+
+check_purge_log()
+
+
+@APP.before_request
+def start_deadline() -> None:
+    set_deadline(Deadline(REQUEST_BUDGET or None))
+
+
+@APP.before_request
+def apply_purges() -> None:
+    sync_purges()
+
+
+@APP.after_request
+def add_node_header(response: Response) -> Response:
+    # responses forwarded from a peer keep the name of the peer
+    if peering() and NODE_HEADER not in response.headers:
+        response.headers[NODE_HEADER] = self_address()
+    return response
+
+
+@APP.teardown_request
+def clear_deadline(exception: Optional[BaseException] = None) -> None:
+    set_deadline(None)
+
+
+def degraded_headers() -> Dict[str, str]:
+    """
+    Renders that cut corners to meet their deadline are only cached briefly,
+    so the full quality version replaces them soon.
+    """
+    return {
+        "Cache-Control": "max-age={age}".format(age=DEGRADED_MAX_AGE),
+        "X-ITS-Degraded": "1",
+    }
+
 
 def _normalize_query(query: Dict[str, str]) -> Dict[str, str]:
     fit_synonyms = {"crop", "focalcrop"}
@@ -73,6 +167,29 @@ def _normalize_query(query: Dict[str, str]) -> Dict[str, str]:
     return query
 
 
+def metadata_query(query: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """
+    The parameters of ?info and ?placeholder requests, which describe a source
+    as JSON instead of rendering it, or None if the query is a render.
+    """
+    if "info" in query:
+        # the info of a source doesn't depend on any transforms
+        is_header_only(query["info"])
+        return {"info": query["info"]}
+    if "placeholder" in query:
+        return placeholder_query(query)
+    return None
+
+
+def describe_source(
+    namespace: str, filename: str, validator: Optional[str], query: Dict[str, str]
+) -> Dict[str, Any]:
+    if "info" in query:
+        header_only = is_header_only(query["info"])
+        return source_info(namespace, filename, validator, header_only)
+    return source_placeholder(namespace, filename, validator, query)
+
+
 def process_request(namespace: str, query: Dict[str, str], filename: str) -> Response:
     query = _normalize_query(query)
 
@@ -81,56 +198,292 @@ def process_request(namespace: str, query: Dict[str, str], filename: str) -> Res
             400, "{namespace} is not a configured namespace".format(namespace=namespace)
         )
 
+    metadata = metadata_query(query)
     namespace_config = NAMESPACES[namespace]
     if namespace_config.get("redirect"):
+        if metadata is not None:
+            raise ITSClientError("{ns} only redirects".format(ns=namespace))
         location = get_redirect_location(namespace, query, filename)
         return redirect(location=location, code=301)
 
+    peer = peer_for(namespace, filename, request.headers)
+    if peer is not None:
+        forwarded = forward(peer, request.full_path, request.headers)
+        if forwarded is not None:
+            return Response(
+                response=forwarded.body,
+                status=forwarded.status,
+                headers=forwarded.headers,
+            )
+
+    hints_headers = {}  # type: Dict[str, str]
+    if metadata is not None:
+        query = metadata
+    else:
+        query, hints_headers = hinted_query(namespace, query, request.headers)
+
+    validators = get_image_loader(namespace).get_validators(namespace, filename)
+    if validators:
+        etag, last_modified = response_etag(validators[0], query), validators[1]
+        if is_not_modified(
+            etag,
+            last_modified,
+            request.headers.get("If-None-Match"),
+            request.headers.get("If-Modified-Since"),
+        ):
+            headers = {"Cache-Control": CACHE_CONTROL}
+            headers.update(validator_headers(etag, last_modified))
+            # a 304 updates the headers the client cached, whose width it can't tell
+            headers.update(rendered_hint_headers(hints_headers, query, None))
+            return Response(status=304, headers=headers)
+
+    if metadata is not None:
+        try:
+            data = describe_source(
+                namespace, filename, validators and validators[0], query
+            )
+        except NotFoundError:
+            abort(404)
+        headers = {"Cache-Control": CACHE_CONTROL}
+        if validators:
+            headers.update(validator_headers(etag, last_modified))
+        return Response(
+            response=json.dumps(data), headers=headers, mimetype="application/json"
+        )
+
+    key = render_key(namespace, filename, query, validators and validators[0])
+    rendition = RENDER_CACHE.get(key)
+    store = get_derivative_store()
+    stored = store.read(key) if rendition is None and store is not None else None
+    if rendition is not None:
+        body = iter_buffer(rendition.body)  # type: Iterable[bytes]
+        length = len(rendition.body)  # type: Optional[int]
+        mime_type, degraded = rendition.mime_type, rendition.degraded
+    elif stored is not None:
+        body, length = stored, stored.length
+        mime_type, degraded = stored.mime_type, False
+        if RENDER_CACHE.max_size:
+            body = TeeStream(
+                stored,
+                lambda data: cache_rendition(key, Rendition(data, mime_type)),
+            )
+    else:
+        try:
+            image = load_source(namespace, filename, validators and validators[0])
+        except NotFoundError:
+            abort(404)
+
+        body, length, mime_type = render_response(
+            image, query, namespace, filename, key
+        )
+        degraded = get_deadline().degraded
+
+    if clamped_width(hints_headers, query) is not None:
+        size, body = peek_image_size(body)
+        hints_headers = rendered_hint_headers(hints_headers, query, size and size[0])
+
+    # NOTE this would be the right place to do clever things like:
+    # allow developers to deactivate caching locally
+    if degraded:
+        resp_headers = degraded_headers()
+    else:
+        resp_headers = {"Cache-Control": CACHE_CONTROL}
+        if validators:
+            resp_headers.update(validator_headers(etag, last_modified))
+    resp_headers.update(hints_headers)
+    if length is not None:
+        resp_headers["Content-Length"] = str(length)
+
+    return Response(
+        response=body,
+        headers=resp_headers,
+        mimetype=mime_type,
+        direct_passthrough=True,
+    )
+
+
+def load_source(namespace: str, filename: str, validator: Optional[str]):
+    """
+    Returns the cached pyramid of a source, or the source as its loader returns
+    it, keeping the pyramids of popular sources in the source cache. Workers
+    that render in a process pool don't use pyramids. Expired pyramids are
+    served while the origin of their source fails.
+    """
+    use_pyramids = SOURCE_CACHE.max_size and not get_render_pool()
+    if use_pyramids:
+        pyramid = get_pyramid(namespace, filename, validator)
+        if pyramid is not None:
+            return pyramid
+
     try:
         image = loader(namespace, filename)
-    except NotFoundError:
-        abort(404)
-
+    except Exception as error:
+        pyramid = (
+            stale_if_error(namespace, filename, validator)
+            if use_pyramids and is_origin_error(error)
+            else None
+        )
+        if pyramid is None:
+            raise
+        LOGGER.warning("serving stale %s/%s: %s", namespace, filename, error)
+        return pyramid
+    if (
+        use_pyramids
+        and isinstance(image, Image.Image)
+        and is_popular(namespace, filename, validator)
+    ):
+        return cache_pyramid(image, namespace, filename, validator)
+    return image
+
+
+def keep_rendition(key: str, rendition: Rendition) -> None:
+    """
+    Writes a fresh rendition to the render cache and, unless it is degraded,
+    behind the response to the derivative store.
+    """
+    if RENDER_CACHE.max_size:
+        cache_rendition(key, rendition)
+    store = get_derivative_store()
+    if store is not None and not rendition.degraded:
+        store.write_behind(key, rendition)
+
+
+def render_response(
+    image, query: Dict[str, str], namespace: str, filename: str, key: str
+) -> Tuple[Iterable[bytes], Optional[int], str]:
+    """
+    Returns the body, its length if known and the mime type of a response
+    with a freshly loaded source or its cached pyramid. Renditions are kept
+    with keep_rendition.
+    """
     # PIL doesn't support SVG and ITS doesn't change them in any way,
-    # so loader returns a ByesIO object so the images will still be returned to the browser.
-    # This BytesIO object is returned from each loader class's get_fileobj() function.
-    if isinstance(image, BytesIO):
-        output = image
-        mime_type = MIME_TYPES["SVG"]
+    # so loader returns a stream of the source so the images will still be returned
+    # to the browser. The stream is returned from each loader's get_stream() function.
+    if not isinstance(image, (Image.Image, Pyramid)):
+        return image, image.length, MIME_TYPES["SVG"]
+
+    pool = get_render_pool()
+    # render processes are killed when the request runs out of time, requests
+    # that already did are rendered degraded here without taking a process
+    timeout = min(RENDER_TIMEOUT, get_deadline().remaining())
+    if isinstance(image, Pyramid):
+        result, mime_type, options = prepare_pyramid(image, query)
+    elif pool is not None and timeout > 0:
+        output, mime_type = pool.render(image, query, namespace, filename, timeout)
+        if RENDER_CACHE.max_size or get_derivative_store() is not None:
+            keep_rendition(
+                key,
+                Rendition(output.getvalue(), mime_type, get_deadline().degraded),
+            )
+        buffer = output.getbuffer()
+        return iter_buffer(buffer), len(buffer), mime_type
     else:
-        try:
-            image = normalize(image)
-        except NormalizationError as err:
-            LOGGER.warning("failed to normalize %s/%s: %s", namespace, filename, err)
-        image.info["filename"] = filename
-        result = process_transforms(image, query)
+        result, mime_type, options = prepare(image, query, namespace, filename)
+
+    # encode while the response is being sent
+    body = iter_encoded(result, options)
+    if RENDER_CACHE.max_size or get_derivative_store() is not None:
+        deadline = get_deadline()
+        body = TeeStream(
+            body,
+            lambda data: keep_rendition(
+                key, Rendition(data, mime_type, deadline.degraded)
+            ),
+        )
+    return body, None, mime_type
+
+
+def _parse_rendition(rendition) -> Dict[str, str]:
+    query = {}  # type: Dict[str, str]
+    if isinstance(rendition, str):
+        # like request.args.to_dict(), keep the first value of repeated arguments
+        for key, value in parse_qsl(rendition.lstrip("?"), keep_blank_values=True):
+            query.setdefault(key, value)
+    elif isinstance(rendition, dict):
+        query = {str(key): str(value) for key, value in rendition.items()}
+    else:
+        raise ITSClientError("renditions are query strings or objects")
+    return _normalize_query(query)
+
+
+def process_batch_request(
+    namespace: str, filename: str, payload: Dict[str, Any]
+) -> Response:
+    queries = [_parse_rendition(rendition) for rendition in payload["renditions"]]
+    if not queries or len(queries) > BATCH_MAX_RENDITIONS:
+        raise ITSClientError(
+            "batch requests take 1 to {max} renditions".format(max=BATCH_MAX_RENDITIONS)
+        )
 
-        # image conversion and compression
-        # cache result
-        result = optimize(result, query)
+    if namespace not in NAMESPACES:
+        abort(
+            400, "{namespace} is not a configured namespace".format(namespace=namespace)
+        )
+    if NAMESPACES[namespace].get("redirect"):
+        raise ITSClientError("{namespace} only redirects".format(namespace=namespace))
 
-        if result.format is None:
-            result.format = image.format
+    try:
+        image = loader(namespace, filename)
+    except NotFoundError:
+        abort(404)
+    if not isinstance(image, Image.Image):
+        raise ITSClientError("{fn} is passed through as is".format(fn=filename))
 
-        mime_type = MIME_TYPES[result.format.upper()]
+    renditions = render_renditions(image, queries, namespace, filename)
+    degraded = get_deadline().degraded
 
-        output = BytesIO()
+    if payload.get("cache"):
+        validators = get_image_loader(namespace).get_validators(namespace, filename)
+        for query, (output, mime_type, _) in zip(queries, renditions):
+            key = render_key(namespace, filename, query, validators and validators[0])
+            keep_rendition(key, Rendition(output.getvalue(), mime_type, degraded))
 
-        if result.format.upper() in ("JPEG", "JPG"):
-            result.save(
-                output, format=result.format.upper(), progressive=True, optimize=True
+    urls = [
+        "/{ns}/{fn}?{query}".format(
+            ns=namespace, fn=filename, query=canonical_query(query)
+        )
+        for query in queries
+    ]
+    headers = degraded_headers() if degraded else {"Cache-Control": "no-store"}
+
+    best = request.accept_mimetypes.best_match(["application/json", "multipart/mixed"])
+    if best == "multipart/mixed":
+        boundary = uuid.uuid4().hex
+        parts = []
+        for url, (output, mime_type, _) in zip(urls, renditions):
+            body = output.getbuffer()
+            parts.append(
+                "--{boundary}\r\nContent-Type: {mime}\r\nContent-Location: {url}\r\n"
+                "Content-Length: {length}\r\n\r\n".format(
+                    boundary=boundary, mime=mime_type, url=url, length=len(body)
+                ).encode("latin-1")
             )
-        else:
-            result.save(output, format=result.format.upper())
+            parts.extend((body, b"\r\n"))
+        parts.append("--{boundary}--\r\n".format(boundary=boundary).encode())
+        return Response(
+            response=b"".join(parts),
+            headers=headers,
+            mimetype="multipart/mixed; boundary={boundary}".format(boundary=boundary),
+        )
 
-    # our images are cacheable for one year
-    # NOTE this would be the right place to do clever things like:
-    # allow developers to deactivate caching locally
-    # include validation tokens (etags)
-    resp_headers = {"Cache-Control": "max-age=31536000"}
+    manifest = []
+    for url, query, (output, mime_type, size) in zip(urls, queries, renditions):
+        entry = {
+            "url": url,
+            "query": query,
+            "mime_type": mime_type,
+            "width": size[0],
+            "height": size[1],
+            "size": len(output.getbuffer()),
+        }  # type: Dict[str, Any]
+        if payload.get("data", True):
+            entry["data"] = base64.b64encode(output.getbuffer()).decode("ascii")
+        manifest.append(entry)
 
     return Response(
-        response=output.getvalue(), headers=resp_headers, mimetype=mime_type
+        response=json.dumps({"renditions": manifest}),
+        headers=headers,
+        mimetype="application/json",
     )
 
 
@@ -172,6 +525,86 @@ def transform_image(namespace: str, filename: str) -> Response:
     return result
 
 
+@APP.route("/<namespace>/<path:filename>", methods=["POST"])
+def transform_image_batch(namespace: str, filename: str) -> Response:
+    """
+    Renders several transform queries of one source, e.g.
+
+        POST /namespace/image.jpg
+        {"renditions": ["crop=640x360&format=webp", {"resize": "320x"}], "cache": true}
+
+    Responds with a JSON manifest, or multipart/mixed if the client accepts it.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("renditions"), list):
+        raise ITSClientError("batch requests need a JSON list of renditions")
+    return process_batch_request(namespace, filename, payload)
+
+
+def check_admin_token() -> None:
+    if not ADMIN_TOKEN:
+        abort(404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization, "Bearer " + ADMIN_TOKEN):
+        abort(403)
+
+
+@APP.route("/admin/pyramids/<namespace>/<path:filename>", methods=["POST"])
+def build_pyramid(namespace: str, filename: str) -> Response:
+    """
+    Decodes a source into the source cache ahead of its renditions,
+    with all of its pyramid levels.
+    """
+    check_admin_token()
+    if not SOURCE_CACHE.max_size:
+        raise ITSClientError("the source cache is disabled")
+    if namespace not in NAMESPACES or NAMESPACES[namespace].get("redirect"):
+        abort(404)
+
+    validators = get_image_loader(namespace).get_validators(namespace, filename)
+    try:
+        image = loader(namespace, filename)
+    except NotFoundError:
+        abort(404)
+    if not isinstance(image, Image.Image):
+        raise ITSClientError("{fn} is passed through as is".format(fn=filename))
+
+    pyramid = cache_pyramid(
+        image, namespace, filename, validators and validators[0], eager=True
+    )
+    return Response(
+        response=json.dumps(
+            {
+                "levels": [list(level.size) for level in pyramid.levels],
+                "bytes": pyramid.nbytes(),
+            }
+        ),
+        mimetype="application/json",
+    )
+
+
+@APP.route("/admin/purge/<namespace>/", methods=["POST"], defaults={"filename": ""})
+@APP.route("/admin/purge/<namespace>/<path:filename>", methods=["POST"])
+def purge_source(namespace: str, filename: str) -> Response:
+    """
+    Purges everything derived from a source from every cache, or from all the
+    sources of a folder if the path ends with a slash, on this node and its peers.
+
+    The other workers of this node only purge their memory through ITS_PURGE_LOG.
+    Without it they keep serving what was purged until it expires, which is
+    logged when the application starts.
+    """
+    check_admin_token()
+    tag = purge_tag(namespace, filename)
+    # peers share the derivative store, only the first node purges it
+    forwarded = request.headers.get(FORWARDED_HEADER)
+    result = {"purged": purge(tag, shared=not forwarded)}  # type: Dict[str, Any]
+    peers = broadcast(request.path, request.headers)
+    if peers:
+        result["peers"] = peers
+    return Response(response=json.dumps(result), mimetype="application/json")
+
+
 # Old ITS Support
 @APP.route("/<namespace>/<path:filename>.crop.<int:width>x<int:height>.<ext>")
 def crop(namespace: str, filename: str, width: int, height: int, ext: str) -> Response:
@@ -254,5 +687,19 @@ def handle_transform_error(error: ITSClientError) -> Response:
     return Response(error.message, status=error.status_code)
 
 
+@APP.errorhandler(ITSRenderTimeoutError)
+def handle_render_timeout(error: ITSRenderTimeoutError) -> Response:
+    return Response(error.message, status=error.status_code)
+
+
+@APP.errorhandler(OriginUnavailableError)
+def handle_origin_unavailable(error: OriginUnavailableError) -> Response:
+    return Response(
+        error.message,
+        status=error.status_code,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
 if __name__ == "__main__":
     APP.run(debug=True)
@@ -0,0 +1,545 @@
+"""
+ASGI entry point, an alternative to its.wsgi that serves the same routes from an
+asyncio event loop. Sources are fetched asynchronously so a single worker can
+wait on hundreds of origin requests, while decoding, transforming and encoding
+run in a bounded thread or process pool (see ITS_ASGI_RENDER_POOL).
+
+Only GET and HEAD requests are served asynchronously. The POST routes (batches,
+pyramid builds and purges) are passed to the flask views in the default executor.
+
+    uvicorn its.asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import logging
+import sys
+from io import BytesIO
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl
+
+from PIL import Image
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+
+from .application import (
+    APP,
+    CACHE_CONTROL,
+    _normalize_query,
+    degraded_headers,
+    describe_source,
+    keep_rendition,
+    metadata_query,
+    process_old_request,
+)
+from .client_hints import clamped_width, hinted_query, rendered_hint_headers
+from .deadline import Deadline, run_with_deadline
+from .derivative_store import get_derivative_store
+from .errors import ITSClientError, NotFoundError, OriginUnavailableError
+from .loader import async_loader, get_image_loader
+from .loaders.http import close_async_sessions
+from .loaders.s3_loader import close_async_clients
+from .peers import NODE_HEADER, async_forward, peer_for, peering, self_address
+from .purge import sync_purges
+from .pyramid import Pyramid
+from .render import render, render_bytes, render_pyramid, source_bytes
+from .render_cache import RENDER_CACHE, Rendition, cache_rendition, render_key
+from .settings import (
+    ASGI_RENDER_POOL,
+    ASGI_RENDER_WORKERS,
+    CORS_ORIGINS,
+    MIME_TYPES,
+    NAMESPACES,
+    REQUEST_BUDGET,
+)
+from .source_cache import (
+    SOURCE_CACHE,
+    cache_pyramid,
+    get_pyramid,
+    is_origin_error,
+    is_popular,
+    stale_if_error,
+)
+from .streaming import SourceStream, TeeStream, peek_image_size
+from .util import (
+    get_redirect_location,
+    is_not_modified,
+    response_etag,
+    validator_headers,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# flask endpoint -> (transform, overlay) for the old ITS url scheme
+LEGACY_ROUTES = {
+    "crop": ("fit", None),
+    "focalcrop": ("fit", None),
+    "fit": ("fit", None),
+    "resize": ("resize", None),
+    "resize_passport": ("resize", "passport"),
+    "fit_passport": ("fit", "passport"),
+}
+
+_RENDER_EXECUTOR = None  # type: Optional[Executor]
+
+
+class Response:
+    """
+    A response whose body is either bytes or a stream of chunks, e.g. read from
+    the derivative store, that is sent as it is read.
+    """
+
+    def __init__(
+        self,
+        body: Union[bytes, SourceStream],
+        status: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        mimetype: str = "text/plain",
+    ) -> None:
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.headers["Content-Type"] = mimetype
+        length = len(body) if isinstance(body, bytes) else body.length
+        if length is not None:
+            self.headers["Content-Length"] = str(length)
+
+
+def get_render_executor() -> Executor:
+    global _RENDER_EXECUTOR  # pylint: disable=global-statement
+    if _RENDER_EXECUTOR is None:
+        if ASGI_RENDER_POOL == "process":
+            _RENDER_EXECUTOR = ProcessPoolExecutor(max_workers=ASGI_RENDER_WORKERS)
+        else:
+            _RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_RENDER_WORKERS)
+    return _RENDER_EXECUTOR
+
+
+def route(
+    path: str, args: Dict[str, str], host: str, scheme: str
+) -> Tuple[str, str, Dict[str, str]]:
+    """
+    Matches a path against the flask url map and returns the namespace,
+    filename and transform query the matching flask view would use.
+    """
+    adapter = APP.url_map.bind(host, url_scheme=scheme)
+    endpoint, values = adapter.match(path, method="GET")
+
+    if endpoint in LEGACY_ROUTES:
+        transform, overlay = LEGACY_ROUTES[endpoint]
+        query = process_old_request(
+            transform,
+            values.get("width"),
+            values.get("height"),
+            values.get("ext"),
+            values.get("x_coordinate"),
+            values.get("y_coordinate"),
+        )
+        if overlay:
+            query["overlay"] = overlay
+    else:
+        query = args
+
+    return values["namespace"], values["filename"], query
+
+
+async def render_async(
+    image, query, namespace, filename, deadline: Deadline
+) -> Tuple[bytes, str]:
+    loop = asyncio.get_event_loop()
+    executor = get_render_executor()
+    if isinstance(image, Pyramid):
+        output, mime_type = await loop.run_in_executor(
+            executor, run_with_deadline, deadline, render_pyramid, image, query
+        )
+        return output.getvalue(), mime_type
+
+    if isinstance(executor, ProcessPoolExecutor):
+        body, mime_type, degraded = await loop.run_in_executor(
+            executor,
+            render_bytes,
+            source_bytes(image),
+            query,
+            namespace,
+            filename,
+            deadline.remaining(),
+        )
+        deadline.degraded = deadline.degraded or degraded
+        return body, mime_type
+
+    output, mime_type = await loop.run_in_executor(
+        executor, run_with_deadline, deadline, render, image, query, namespace, filename
+    )
+    return output.getvalue(), mime_type
+
+
+async def load_source(
+    namespace: str, filename: str, validator: Optional[str], host: str
+):
+    """
+    Same as its.application.load_source, pyramids are only used by thread pools.
+    """
+    executor = get_render_executor()
+    use_pyramids = SOURCE_CACHE.max_size and isinstance(executor, ThreadPoolExecutor)
+    if use_pyramids:
+        pyramid = get_pyramid(namespace, filename, validator)
+        if pyramid is not None:
+            return pyramid
+
+    try:
+        image = await async_loader(namespace, filename, host=host)
+    except Exception as error:
+        pyramid = (
+            stale_if_error(namespace, filename, validator)
+            if use_pyramids and is_origin_error(error)
+            else None
+        )
+        if pyramid is None:
+            raise
+        LOGGER.warning("serving stale %s/%s: %s", namespace, filename, error)
+        return pyramid
+    if (
+        use_pyramids
+        and isinstance(image, Image.Image)
+        and is_popular(namespace, filename, validator)
+    ):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor, cache_pyramid, image, namespace, filename, validator
+        )
+    return image
+
+
+async def process_request(  # pylint: disable=too-many-arguments
+    namespace: str,
+    query: Dict[str, str],
+    filename: str,
+    host: str,
+    scheme: str,
+    headers: Optional[Dict[str, str]] = None,
+    target: Optional[str] = None,
+) -> Response:
+    deadline = Deadline(REQUEST_BUDGET or None)
+    query = _normalize_query(query)
+
+    if namespace not in NAMESPACES:
+        return Response(
+            "{namespace} is not a configured namespace".format(
+                namespace=namespace
+            ).encode(),
+            status=400,
+        )
+
+    metadata = metadata_query(query)
+    namespace_config = NAMESPACES[namespace]
+    if namespace_config.get("redirect"):
+        if metadata is not None:
+            raise ITSClientError("{ns} only redirects".format(ns=namespace))
+        location = get_redirect_location(
+            namespace, query, filename, scheme=scheme, host=host
+        )
+        return Response(b"", status=301, headers={"Location": location})
+
+    headers = headers or {}
+    peer = peer_for(namespace, filename, headers) if target else None
+    if target and peer is not None:
+        forwarded = await async_forward(peer, target, headers)
+        if forwarded is not None:
+            return Response(
+                forwarded.body,
+                status=forwarded.status,
+                headers=forwarded.headers,
+                mimetype=forwarded.headers.pop("Content-Type", "text/plain"),
+            )
+
+    hints_headers = {}  # type: Dict[str, str]
+    if metadata is not None:
+        query = metadata
+    else:
+        query, hints_headers = hinted_query(namespace, query, headers)
+
+    validators = await get_image_loader(namespace).async_get_validators(
+        namespace, filename
+    )
+    if validators:
+        etag, last_modified = response_etag(validators[0], query), validators[1]
+        if is_not_modified(
+            etag,
+            last_modified,
+            headers.get("if-none-match"),
+            headers.get("if-modified-since"),
+        ):
+            not_modified_headers = {"Cache-Control": CACHE_CONTROL}
+            not_modified_headers.update(validator_headers(etag, last_modified))
+            not_modified_headers.update(
+                rendered_hint_headers(hints_headers, query, None)
+            )
+            return Response(b"", status=304, headers=not_modified_headers)
+
+    if metadata is not None:
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(
+            None,
+            describe_source,
+            namespace,
+            filename,
+            validators and validators[0],
+            query,
+        )
+        data_headers = {"Cache-Control": CACHE_CONTROL}
+        if validators:
+            data_headers.update(validator_headers(etag, last_modified))
+        return Response(
+            json.dumps(data).encode(), headers=data_headers, mimetype="application/json"
+        )
+
+    key = render_key(namespace, filename, query, validators and validators[0])
+    rendition = RENDER_CACHE.get(key)
+    store = get_derivative_store()
+    stored = None
+    if rendition is None and store is not None:
+        loop = asyncio.get_event_loop()
+        stored = await loop.run_in_executor(None, store.read, key)
+    if rendition is not None:
+        body, mime_type = rendition.body, rendition.mime_type
+        deadline.degraded = rendition.degraded
+    elif stored is not None:
+        body, mime_type = stored, stored.mime_type
+        if RENDER_CACHE.max_size:
+            body = SourceStream(
+                TeeStream(
+                    stored,
+                    lambda data: cache_rendition(key, Rendition(data, mime_type)),
+                ),
+                stored.length,
+            )
+    else:
+        image = await load_source(
+            namespace, filename, validators and validators[0], host
+        )
+
+        if not isinstance(image, (Image.Image, Pyramid)):
+            body, mime_type = image, MIME_TYPES["SVG"]
+        else:
+            body, mime_type = await render_async(
+                image, query, namespace, filename, deadline
+            )
+            keep_rendition(key, Rendition(body, mime_type, deadline.degraded))
+
+    if clamped_width(hints_headers, query) is not None:
+        if isinstance(body, bytes):
+            size = peek_image_size([body])[0]
+        else:
+            loop = asyncio.get_event_loop()
+            size, peeked = await loop.run_in_executor(None, peek_image_size, body)
+            body = SourceStream(peeked, body.length)
+        hints_headers = rendered_hint_headers(hints_headers, query, size and size[0])
+
+    if deadline.degraded:
+        response_headers = degraded_headers()
+    else:
+        response_headers = {"Cache-Control": CACHE_CONTROL}
+        if validators:
+            response_headers.update(validator_headers(etag, last_modified))
+    response_headers.update(hints_headers)
+
+    return Response(body, headers=response_headers, mimetype=mime_type)
+
+
+async def handle(scope) -> Response:
+    sync_purges()
+    headers = {
+        key.decode("latin-1").lower(): value.decode("latin-1")
+        for key, value in scope["headers"]
+    }
+    host = headers.get("host", "localhost")
+    scheme = scope.get("scheme", "http")
+
+    # like request.args.to_dict(), keep the first value of repeated arguments
+    args = {}  # type: Dict[str, str]
+    for key, value in parse_qsl(
+        scope["query_string"].decode("latin-1"), keep_blank_values=True
+    ):
+        args.setdefault(key, value)
+
+    try:
+        namespace, filename, query = route(scope["path"], args, host, scheme)
+        target = "{path}?{query}".format(
+            path=scope["path"], query=scope["query_string"].decode("latin-1")
+        )
+        return await process_request(
+            namespace, query, filename, host, scheme, headers, target
+        )
+    except RequestRedirect as redirect:
+        return Response(b"", status=308, headers={"Location": redirect.new_url})
+    except (NotFound, NotFoundError):
+        return Response(b"Not Found", status=404)
+    except MethodNotAllowed:
+        return Response(b"Method Not Allowed", status=405)
+    except ITSClientError as error:
+        return Response(error.message.encode(), status=error.status_code)
+    except OriginUnavailableError as error:
+        return Response(
+            error.message.encode(),
+            status=error.status_code,
+            headers={"Retry-After": str(error.retry_after)},
+        )
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.exception("failed to handle %s", scope["path"])
+        return Response(b"Internal Server Error", status=500)
+
+
+def cors_headers(scope) -> List[Tuple[bytes, bytes]]:
+    for key, value in scope["headers"]:
+        if key.lower() == b"origin" and value.decode("latin-1") in CORS_ORIGINS:
+            return [(b"access-control-allow-origin", value), (b"vary", b"Origin")]
+    return []
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_sessions()
+            await close_async_clients()
+            if _RENDER_EXECUTOR is not None:
+                _RENDER_EXECUTOR.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+        await serve_wsgi(scope, receive, send)
+        return
+
+    if scope["method"] == "OPTIONS":
+        response = Response(b"", headers={"Allow": "GET, HEAD, POST, OPTIONS"})
+    else:
+        response = await handle(scope)
+
+    # responses forwarded from a peer keep the name of the peer
+    if peering() and NODE_HEADER not in response.headers:
+        response.headers[NODE_HEADER] = self_address()
+    headers = [
+        (key.lower().encode("latin-1"), value.encode("latin-1"))
+        for key, value in response.headers.items()
+    ]
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": headers + cors_headers(scope),
+        }
+    )
+    if isinstance(response.body, bytes):
+        body = response.body if scope["method"] == "GET" else b""
+        await send({"type": "http.response.body", "body": body})
+    else:
+        await send_stream(send, response.body, scope["method"] == "GET")
+
+
+async def send_stream(send, stream: SourceStream, send_body: bool = True) -> None:
+    """
+    Sends a stream chunk by chunk, like the WSGI server does. Chunks are read
+    in the default executor, reading them may block on a file or a socket.
+    """
+    loop = asyncio.get_event_loop()
+    chunks = iter(stream)
+    try:
+        while send_body:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    await send({"type": "http.response.body", "body": b""})
+
+
+def wsgi_environ(scope, body: bytes) -> Dict:
+    host, _, port = dict(scope["headers"]).get(b"host", b"localhost").partition(b":")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": host.decode("latin-1"),
+        "SERVER_PORT": port.decode("latin-1")
+        or ("443" if scope.get("scheme") == "https" else "80"),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for key, value in scope["headers"]:
+        name = key.decode("latin-1").upper().replace("-", "_")
+        if name == "CONTENT_TYPE":
+            environ[name] = value.decode("latin-1")
+        elif name != "CONTENT_LENGTH":
+            name = "HTTP_" + name
+            value = value.decode("latin-1")
+            environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+
+def call_wsgi(environ: Dict) -> Tuple[int, List[Tuple[str, str]], bytes]:
+    started = []  # type: List
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    chunks = APP(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    return started[0], started[1], body
+
+
+async def serve_wsgi(scope, receive, send) -> None:
+    """
+    Serves a request with the flask app in the default executor, for the POST
+    routes that only exist as flask views. Their responses are small JSON or
+    multipart documents, sent in one piece.
+    """
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    loop = asyncio.get_event_loop()
+    status, headers, body = await loop.run_in_executor(
+        None, call_wsgi, wsgi_environ(scope, body)
+    )
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (key.lower().encode("latin-1"), value.encode("latin-1"))
+                for key, value in headers
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,202 @@
+"""
+Thread-safe in-memory caches shared by every request thread of a worker.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from PIL import Image
+
+from .metrics import METRICS
+
+
+def image_nbytes(img: Image.Image) -> int:
+    """
+    Approximate number of bytes held by a decoded image.
+    """
+    return img.width * img.height * len(img.getbands())
+
+
+def source_tags(namespace: str, filename: str) -> Tuple[str, ...]:
+    """
+    Tags of cache entries derived from a source: the source, as namespace/path,
+    and every folder it is in, so a folder can be purged like a single source.
+
+        >>> source_tags("tests", "images/a.jpg")
+        ('tests/', 'tests/images/', 'tests/images/a.jpg')
+    """
+    source = "{ns}/{fn}".format(ns=namespace, fn=filename)
+    parts = source.split("/")
+    folders = tuple("/".join(parts[:i]) + "/" for i in range(1, len(parts)))
+    return folders + (source,)
+
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the total size of its entries.
+
+    Entries are measured with `sizeof` (one unit per entry by default) and can
+    expire after an optional time-to-live, and then be kept a while longer for
+    get_stale. Entries can be tagged, and purged by tag in time proportional to
+    the number of entries with the tag. A single lock guards the cache so it
+    can be shared by all threads of a worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.RLock()
+        self._key_locks = {}  # type: Dict[Hashable, threading.Lock]
+        self._tags = {}  # type: Dict[Hashable, Tuple[str, ...]]
+        self._tagged = {}  # type: Dict[str, Set[Hashable]]
+        # monotonic time until which expired entries are kept
+        self._stale = {}  # type: Dict[Hashable, float]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                METRICS.incr("cache.{}.miss".format(self.name))
+                return default
+
+            value, _, expires = entry
+            now = time.monotonic()
+            if expires is not None and expires <= now:
+                if self._stale.get(key, 0) <= now:
+                    self._remove(key)
+                METRICS.incr("cache.{}.miss".format(self.name))
+                return default
+
+            self._entries.move_to_end(key)
+            METRICS.incr("cache.{}.hit".format(self.name))
+            return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        tags: Iterable[str] = (),
+        stale: float = 0,
+    ) -> None:
+        size = self.sizeof(value)
+        if size > self.max_size:
+            # never let a single entry flush the whole cache
+            return
+
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires)
+            self.size += size
+            if expires is not None and stale > 0:
+                self._stale[key] = expires + stale
+            tags = tuple(tags)
+            if tags:
+                self._tags[key] = tags
+                for tag in tags:
+                    self._tagged.setdefault(tag, set()).add(key)
+            while self.size > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                METRICS.incr("cache.{}.evict".format(self.name))
+            METRICS.gauge("cache.{}.size".format(self.name), self.size)
+
+    def get_or_set(
+        self,
+        key: Hashable,
+        factory: Callable[[], Any],
+        ttl: Optional[float] = None,
+        tags: Iterable[str] = (),
+        stale: float = 0,
+    ) -> Any:
+        """
+        Returns the cached value for `key`, calling `factory` to build it on a miss.
+
+        Concurrent misses for the same key wait for a single call to `factory`.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                self.set(key, value, ttl=ttl, tags=tags, stale=stale)
+
+        with self._lock:
+            self._key_locks.pop(key, None)
+
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Returns the value of `key` even if it expired, as long as it is kept for
+        the `stale` seconds it was set with, and how many seconds ago it expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, expires = entry
+            now = time.monotonic()
+            if expires is None or expires > now:
+                return value, 0.0
+            if self._stale.get(key, 0) <= now:
+                self._remove(key)
+                return None
+            return value, now - expires
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def purge(self, tag: str) -> int:
+        """
+        Removes the entries tagged with `tag`, and returns how many there were.
+        """
+        with self._lock:
+            keys = self._tagged.pop(tag, set())
+            for key in keys:
+                self._remove(key)
+            if keys:
+                METRICS.gauge("cache.{}.size".format(self.name), self.size)
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._tagged.clear()
+            self._stale.clear()
+            self.size = 0
+
+    def _remove(self, key: Hashable) -> Tuple[Any, int, Optional[float]]:
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+        self._stale.pop(key, None)
+        for tag in self._tags.pop(key, ()):
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+        return entry
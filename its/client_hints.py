@@ -0,0 +1,194 @@
+"""
+Responsive sizing from the DPR, Width and Viewport-Width client hints, for
+namespaces that opt in with ITS_CLIENT_HINTS or a "client_hints" key. Widths
+are snapped up to a ladder of ITS_CLIENT_HINTS_WIDTHS, so caches only ever
+see a bounded number of sizes of an image.
+"""
+
+from math import floor
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
+
+from .settings import CLIENT_HINTS, CLIENT_HINTS_WIDTHS, NAMESPACES
+from .util import DELIMITERS
+
+# the standard names of the hints first, the legacy ones browsers still send
+DPR_HEADERS = ("Sec-CH-DPR", "DPR")
+WIDTH_HEADERS = ("Sec-CH-Width", "Width")
+VIEWPORT_WIDTH_HEADERS = ("Sec-CH-Viewport-Width", "Viewport-Width")
+HINT_HEADERS = DPR_HEADERS + WIDTH_HEADERS + VIEWPORT_WIDTH_HEADERS
+
+# devices report anything from 0.5 to over 4, higher densities aren't visible
+MIN_DPR = 0.5
+MAX_DPR = 4.0
+
+
+class Hints(NamedTuple):
+    dpr: float = 1.0
+    # physical pixels the image is displayed at
+    width: Optional[int] = None
+    # layout (css) pixels of the viewport
+    viewport_width: Optional[int] = None
+
+
+def uses_client_hints(namespace: str) -> bool:
+    return bool(NAMESPACES.get(namespace, {}).get("client_hints", CLIENT_HINTS))
+
+
+def _header(headers: Mapping[str, str], names: Tuple[str, ...]) -> Optional[float]:
+    for name in names:
+        value = headers.get(name) or headers.get(name.lower())
+        if value:
+            try:
+                number = float(value)
+            except ValueError:
+                continue
+            if number > 0:
+                return number
+    return None
+
+
+def parse_hints(headers: Mapping[str, str]) -> Optional[Hints]:
+    """
+    Hints of a request, or None if it has none, e.g. when the browser doesn't
+    support them or hasn't seen Accept-CH yet.
+    """
+    dpr = _header(headers, DPR_HEADERS)
+    width = _header(headers, WIDTH_HEADERS)
+    viewport_width = _header(headers, VIEWPORT_WIDTH_HEADERS)
+    if dpr is None and width is None and viewport_width is None:
+        return None
+    return Hints(
+        min(max(dpr or 1.0, MIN_DPR), MAX_DPR),
+        int(width) if width else None,
+        int(viewport_width) if viewport_width else None,
+    )
+
+
+def snap_width(width: float) -> int:
+    """
+    Smallest width of the ladder that is at least `width`, or the largest one.
+    """
+    for bucket in CLIENT_HINTS_WIDTHS:
+        if bucket >= width:
+            return bucket
+    return CLIENT_HINTS_WIDTHS[-1]
+
+
+def apply_hints(
+    query: Dict[str, str], hints: Hints
+) -> Tuple[Dict[str, str], Optional[float]]:
+    """
+    Rescales the resize or fit of a query to the width the client displays
+    the image at, snapped to the ladder. Returns the query and the
+    Content-DPR of the response, or None if the hints didn't change it.
+
+    Explicit widths are layout widths: they are multiplied by the DPR and
+    capped by the Width hint. Queries without a resize or fit are resized to
+    the Width or Viewport-Width hint, without scaling images up.
+    """
+    slug = "fit" if "fit" in query else "resize" if "resize" in query else None
+    if slug is None:
+        if hints.width:
+            wanted = float(hints.width)
+        elif hints.viewport_width:
+            wanted = hints.viewport_width * hints.dpr
+        else:
+            return query, None
+        width = snap_width(wanted)
+        query = dict(query, resize="{width}x,no-scale-up".format(width=width))
+        return query, round(hints.dpr * width / wanted, 3)
+
+    parameters = DELIMITERS.split(query[slug])
+    try:
+        layout_width = int(parameters[0])
+        layout_height = int(parameters[1]) if parameters[1:2] != [""] else None
+    except (ValueError, IndexError):
+        # let the transform report it, or leave height-only resizes as they are
+        return query, None
+    if layout_width <= 0:
+        return query, None
+
+    wanted = layout_width * hints.dpr
+    if hints.width:
+        wanted = min(wanted, hints.width)
+    width = snap_width(wanted)
+    scale = width / layout_width
+    parameters[0] = str(width)
+    if layout_height is not None:
+        parameters[1] = str(max(floor(layout_height * scale), 1))
+    query = dict(query)
+    query[slug] = "x".join(parameters[:2]) + "".join(
+        "," + parameter for parameter in parameters[2:]
+    )
+    return query, round(scale, 3)
+
+
+def hint_headers(content_dpr: Optional[float]) -> Dict[str, str]:
+    """
+    Headers of responses of namespaces that use client hints, whether or not
+    the client sent any, so caches key renditions on the hints.
+    """
+    headers = {
+        "Accept-CH": ", ".join(HINT_HEADERS),
+        "Vary": ", ".join(HINT_HEADERS),
+    }
+    if content_dpr is not None:
+        headers["Content-DPR"] = "{:g}".format(content_dpr)
+    return headers
+
+
+def clamped_width(headers: Mapping[str, str], query: Dict[str, str]) -> Optional[int]:
+    """
+    Width a hinted resize with no-scale-up asked for, which its rendition falls
+    short of when the source is narrower, or None if the Content-DPR of the
+    hint headers holds whatever the source.
+    """
+    if "Content-DPR" not in headers:
+        return None
+    parameters = DELIMITERS.split(query.get("resize", ""))
+    if "no-scale-up" not in parameters[2:]:
+        return None
+    try:
+        return int(parameters[0])
+    except ValueError:
+        return None
+
+
+def rendered_hint_headers(
+    headers: Dict[str, str], query: Dict[str, str], width: Optional[int]
+) -> Dict[str, str]:
+    """
+    Hint headers of a rendition that came out `width` pixels wide, or of
+    unknown width. The Content-DPR of a rendition clamped to the width of its
+    source is scaled to the width it was rendered at, so browsers lay it out
+    at the intended size. It is left out if that can't be told: the width is
+    unknown, or the resize was bound by a height as well.
+    """
+    requested = clamped_width(headers, query)
+    if requested is None or width == requested:
+        return headers
+
+    headers = dict(headers)
+    content_dpr = float(headers.pop("Content-DPR"))
+    if width is not None and DELIMITERS.split(query["resize"])[1] == "":
+        headers["Content-DPR"] = "{:g}".format(
+            round(content_dpr * width / requested, 3)
+        )
+    return headers
+
+
+def hinted_query(
+    namespace: str, query: Dict[str, str], headers: Mapping[str, str]
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    The query of a render sized to the client hints in the request headers if
+    the namespace uses them, and the headers to add to its response. Requests
+    without hints render as they always did.
+    """
+    if not uses_client_hints(namespace):
+        return query, {}
+    hints = parse_hints(headers)
+    if hints is None:
+        return query, hint_headers(None)
+    query, content_dpr = apply_hints(query, hints)
+    return query, hint_headers(content_dpr)
@@ -0,0 +1,96 @@
+"""
+Per-request time budget that lets the pipeline trade quality for speed.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from PIL import Image
+
+from .metrics import METRICS
+from .settings import DEGRADE_REMAINING
+
+_LOCAL = threading.local()
+
+
+class Deadline:
+    """
+    The time a request has left. Pipeline stages ask `should_degrade` before
+    picking an expensive strategy; once any of them chose a cheaper one the
+    render is marked as degraded.
+    """
+
+    def __init__(self, budget: Optional[float] = None) -> None:
+        self.expires = time.monotonic() + budget if budget is not None else None
+        self.degraded = False
+
+    def remaining(self) -> float:
+        if self.expires is None:
+            return float("inf")
+        return self.expires - time.monotonic()
+
+    def should_degrade(self) -> bool:
+        if self.remaining() >= DEGRADE_REMAINING:
+            return False
+        if not self.degraded:
+            METRICS.incr("render.degraded")
+        self.degraded = True
+        return True
+
+
+def get_deadline() -> Deadline:
+    """
+    Deadline of the request handled by the current thread.
+    """
+    deadline = getattr(_LOCAL, "deadline", None)
+    if deadline is None:
+        # outside of a request there is no time limit
+        return Deadline()
+    return deadline
+
+
+def set_deadline(deadline: Optional[Deadline]) -> None:
+    _LOCAL.deadline = deadline
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline) -> Iterator[Deadline]:
+    previous = getattr(_LOCAL, "deadline", None)
+    set_deadline(deadline)
+    try:
+        yield deadline
+    finally:
+        set_deadline(previous)
+
+
+def run_with_deadline(deadline: Deadline, func: Callable, *args):
+    """
+    Calls func on behalf of a request from another thread, e.g. an executor.
+    """
+    with deadline_scope(deadline):
+        return func(*args)
+
+
+# resampling filters from the cheapest to the most expensive
+FILTER_COSTS = [
+    Image.NEAREST,
+    Image.BOX,
+    Image.BILINEAR,
+    Image.HAMMING,
+    Image.BICUBIC,
+    Image.LANCZOS,
+]
+
+
+def resample_filter(preferred: int = Image.LANCZOS) -> int:
+    """
+    Resampling filter for resizes, bilinear when the request is running late.
+    Filters that are no more expensive than bilinear don't degrade the render.
+    """
+    if FILTER_COSTS.index(preferred) <= FILTER_COSTS.index(Image.BILINEAR):
+        return preferred
+    if get_deadline().should_degrade():
+        return Image.BILINEAR
+    return preferred
@@ -0,0 +1,294 @@
+"""
+Persistent store of rendered images, shared by every worker and surviving
+restarts. Renditions are written behind the response by a small pool of
+background threads and read back as streams. They are grouped by the path of
+their source, so the renditions of a source or a folder can be purged without
+listing the whole store.
+
+    ITS_DERIVATIVE_STORE=file:///var/cache/its
+    ITS_DERIVATIVE_STORE=s3://bucket/prefix
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import quote, urlparse
+
+from .errors import ConfigError
+from .loaders.file_system import MappedFile
+from .metrics import METRICS
+from .render_cache import Rendition
+from .settings import (
+    DERIVATIVE_STORE,
+    DERIVATIVE_STORE_PENDING,
+    DERIVATIVE_STORE_WRITERS,
+    LOADER_TIMEOUT,
+)
+from .streaming import STREAM_CHUNK_BYTES, SourceStream, iter_buffer
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _quote(part: str) -> str:
+    # "#" is always quoted, so it can mark the folders of sources
+    if not part.strip("."):
+        return part.replace(".", "%2E") or "%"
+    return quote(part, safe="")
+
+
+def tag_prefix(tag: str) -> str:
+    """
+    Relative prefix of the renditions with a tag of source_tags: the quoted path
+    of a folder, or of a source followed by "#", so that a source and a folder
+    with the same name never share renditions.
+    """
+    parts = "/".join(_quote(part) for part in tag.rstrip("/").split("/"))
+    return parts + ("/" if tag.endswith("/") else "#/")
+
+
+class StoredRendition(SourceStream):
+    def __init__(self, chunks, length: Optional[int], mime_type: str) -> None:
+        super().__init__(chunks, length)
+        self.mime_type = mime_type
+
+
+class DerivativeStore:
+    """
+    Base class of derivative stores. Subclasses implement `get`, `put` and
+    `purge`.
+    """
+
+    def __init__(
+        self,
+        writers: int = DERIVATIVE_STORE_WRITERS,
+        pending: int = DERIVATIVE_STORE_PENDING,
+    ) -> None:
+        self._writers = writers
+        self._executor = ThreadPoolExecutor(max_workers=writers)
+        self._pending = threading.BoundedSemaphore(pending)
+
+    @staticmethod
+    def name(key: str) -> str:
+        """
+        Relative name of a rendition: the prefix of its source, then a hash of
+        the render key, as they contain query strings.
+        """
+        source = key.partition("?")[0]
+        return tag_prefix(source) + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[StoredRendition]:
+        raise NotImplementedError
+
+    def put(self, key: str, rendition: Rendition) -> None:
+        raise NotImplementedError
+
+    def purge(self, tag: str) -> int:
+        """
+        Deletes the renditions with a tag of source_tags, and returns how many
+        there were.
+        """
+        raise NotImplementedError
+
+    def read(self, key: str) -> Optional[StoredRendition]:
+        """
+        Like get, but a failing store is only logged and counted as a miss so
+        the rendition is rendered again.
+        """
+        try:
+            stored = self.get(key)
+        except Exception:  # pylint: disable=broad-except
+            METRICS.incr("derivative_store.read_error")
+            LOGGER.exception("failed to read rendition %s", key)
+            return None
+        METRICS.incr(
+            "derivative_store.miss" if stored is None else "derivative_store.hit"
+        )
+        return stored
+
+    def write_behind(self, key: str, rendition: Rendition) -> bool:
+        """
+        Queues a write without waiting for it. Writes are dropped while the
+        store is falling behind, the next render of the key will try again.
+        """
+        if not self._pending.acquire(blocking=False):
+            METRICS.incr("derivative_store.dropped")
+            return False
+
+        future = self._executor.submit(self._write, key, rendition)
+        future.add_done_callback(lambda _: self._pending.release())
+        return True
+
+    def _write(self, key: str, rendition: Rendition) -> None:
+        try:
+            self.put(key, rendition)
+        except Exception:  # pylint: disable=broad-except
+            METRICS.incr("derivative_store.write_error")
+            LOGGER.exception("failed to store rendition %s", key)
+        else:
+            METRICS.incr("derivative_store.write")
+
+    def flush(self) -> None:
+        """
+        Waits for the queued writes.
+        """
+        executor, self._executor = (
+            self._executor,
+            ThreadPoolExecutor(max_workers=self._writers),
+        )
+        executor.shutdown(wait=True)
+
+
+class FileSystemDerivativeStore(DerivativeStore):
+    """
+    Stores every rendition in a file made of its mime type, a newline and the
+    encoded image, under a directory that can be shared by all workers.
+    """
+
+    def __init__(self, root: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *self.name(key).split("/"))
+
+    def get(self, key: str) -> Optional[StoredRendition]:
+        try:
+            stored = MappedFile(self.path(key))
+        except (FileNotFoundError, ValueError):
+            return None
+
+        buffer = stored.getbuffer()
+        header_end = buffer[:256].tobytes().find(b"\n")
+        if header_end < 0:
+            return None
+        mime_type = buffer[:header_end].tobytes().decode("ascii")
+        body = buffer[header_end + 1 :]
+        return StoredRendition(iter_buffer(body), len(body), mime_type)
+
+    def put(self, key: str, rendition: Rendition) -> None:
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so readers never see a partial file
+        descriptor, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as tmp_file:
+                tmp_file.write(rendition.mime_type.encode("ascii") + b"\n")
+                tmp_file.write(rendition.body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def purge(self, tag: str) -> int:
+        directory = os.path.join(self.root, *tag_prefix(tag).split("/"))
+        count = sum(len(files) for _, _, files in os.walk(directory))
+        shutil.rmtree(directory, ignore_errors=True)
+        return count
+
+
+class S3DerivativeStore(DerivativeStore):
+    """
+    Stores every rendition as an object under a bucket prefix.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                # pylint: disable=import-outside-toplevel
+                import boto3
+                from botocore.config import Config
+
+                self._client = boto3.session.Session().client(
+                    "s3",
+                    config=Config(
+                        connect_timeout=LOADER_TIMEOUT, read_timeout=LOADER_TIMEOUT
+                    ),
+                )
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        return "/".join(filter(None, (self.prefix, self.name(key))))
+
+    def get(self, key: str) -> Optional[StoredRendition]:
+        from botocore.exceptions import (  # pylint: disable=import-outside-toplevel
+            ClientError,
+        )
+
+        try:
+            response = self.get_client().get_object(
+                Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+
+        def chunks():
+            body = response["Body"]
+            try:
+                yield from body.iter_chunks(STREAM_CHUNK_BYTES)
+            finally:
+                body.close()
+
+        return StoredRendition(
+            chunks(), response["ContentLength"], response["ContentType"]
+        )
+
+    def put(self, key: str, rendition: Rendition) -> None:
+        self.get_client().put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            Body=rendition.body,
+            ContentType=rendition.mime_type,
+        )
+
+    def purge(self, tag: str) -> int:
+        client = self.get_client()
+        prefix = "/".join(filter(None, (self.prefix, tag_prefix(tag))))
+        count = 0
+        pages = client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=prefix
+        )
+        for page in pages:
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", ())]
+            if objects:
+                # a page holds at most 1000 keys, as many as one delete takes
+                client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+                count += len(objects)
+        return count
+
+
+def create_derivative_store(location: str) -> Optional[DerivativeStore]:
+    if not location:
+        return None
+
+    url = urlparse(location)
+    if url.scheme == "file":
+        return FileSystemDerivativeStore(url.path)
+    if url.scheme == "s3":
+        return S3DerivativeStore(url.netloc, url.path)
+    raise ConfigError(
+        "ITS_DERIVATIVE_STORE must be a file:// or s3:// url, not %s" % location
+    )
+
+
+DERIVATIVE_STORE_INSTANCE = create_derivative_store(DERIVATIVE_STORE)
+
+
+def get_derivative_store() -> Optional[DerivativeStore]:
+    return DERIVATIVE_STORE_INSTANCE
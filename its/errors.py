@@ -1,11 +1,9 @@
 from typing import Any, Dict, Optional
 
-from enforce import runtime_validation
+from .typecheck import runtime_validation
 
-from .settings import ENFORCE_TYPE_CHECKS
 
-
-@runtime_validation(enabled=ENFORCE_TYPE_CHECKS)
+@runtime_validation
 class ITSError(Exception):
     """
     Base error class for ITS.
@@ -58,6 +56,26 @@ class ITSInvalidImageFileError(ITSLoaderError):
     pass
 
 
+class SourceTooLargeError(ITSLoaderError):
+    """
+    Raised while downloading a source that is larger than its namespace allows.
+    """
+
+
+class OriginUnavailableError(ITSLoaderError):
+    """
+    Raised without fetching when the circuit breaker of an origin is open or
+    too many fetches from it are in flight.
+    """
+
+    status_code: int = 503
+    message: str = "OriginUnavailableError: "
+
+    def __init__(self, error: str, retry_after: int = 1) -> None:
+        super().__init__(error)
+        self.retry_after = retry_after
+
+
 class ITSTransformError(ITSError):
     """
     General class for errors occuring while applying transforms.
@@ -79,3 +97,12 @@ class NotFoundError(ITSError):
 class ITSClientError(ITSError):
     status_code: int = 400
     message: str = "ITSClientError: "
+
+
+class ITSRenderTimeoutError(ITSError):
+    """
+    Raised when a render process misses its deadline and is killed.
+    """
+
+    status_code: int = 503
+    message: str = "ITSRenderTimeoutError: "
@@ -0,0 +1,188 @@
+"""
+Focal points of sources: looked up in an index maintained by editors, or
+found where a small proxy of the source has the most edges and local contrast.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from PIL import Image, ImageChops, ImageFilter
+
+from .cache import LRUCache, source_tags
+from .deadline import get_deadline
+from .errors import ConfigError
+from .metrics import METRICS
+from .settings import (
+    AUTO_FOCUS_MIN_REMAINING,
+    AUTO_FOCUS_TTL,
+    FOCAL_POINT_INDEX,
+    FOCAL_POINT_INDEX_TTL,
+    LOADER_TIMEOUT,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# longest side of the proxy saliency is measured on
+PROXY_SIZE = 64
+
+CENTER = (50, 50)
+
+# focal points of recent sources, every crop size of a source uses the same one
+FOCAL_POINTS = LRUCache("focal_point", 4096)
+
+# squaring favours the most salient region over texture spread everywhere
+_SQUARE = [value * value // 255 for value in range(256)]
+
+
+def _proxy(img: Image.Image) -> Image.Image:
+    """
+    Small grayscale proxy of a decoded image. It is sampled from at most
+    (4 * PROXY_SIZE)² pixels, so it takes about as long for any source size.
+    """
+    scale = PROXY_SIZE / max(img.size)
+    if scale < 1:
+        size = (max(round(img.width * scale), 1), max(round(img.height * scale), 1))
+        if scale < 1 / 4:
+            # sample large sources down first, box filtering all of them is slow
+            img = img.resize((size[0] * 4, size[1] * 4), Image.NEAREST)
+        img = img.resize(size, Image.BOX)
+    return img.convert("L")
+
+
+def saliency(gray: Image.Image) -> Image.Image:
+    """
+    Saliency map of a small grayscale image: its edges plus its contrast to
+    the local mean.
+    """
+    width, height = gray.size
+    # kernel filters copy the outermost pixels, they aren't edges
+    edges = Image.new("L", gray.size)
+    if width > 2 and height > 2:
+        interior = (1, 1, width - 1, height - 1)
+        edges.paste(gray.filter(ImageFilter.FIND_EDGES).crop(interior), interior)
+    contrast = ImageChops.difference(gray, gray.filter(ImageFilter.BoxBlur(4)))
+    return ImageChops.add(edges, contrast, scale=2).point(_SQUARE)
+
+
+def centroid(weights: Image.Image) -> Tuple[int, int]:
+    """
+    Center of mass of a weight map, in percentages of its width and height.
+    """
+    width, height = weights.size
+    # box resampling to a single row and column averages the columns and rows
+    columns = list(weights.resize((width, 1), Image.BOX).getdata())
+    rows = list(weights.resize((1, height), Image.BOX).getdata())
+    if not sum(columns) or not sum(rows):
+        return CENTER
+
+    x = sum((i + 0.5) * value for i, value in enumerate(columns)) / sum(columns)
+    y = sum((i + 0.5) * value for i, value in enumerate(rows)) / sum(rows)
+    return round(100 * x / width), round(100 * y / height)
+
+
+def auto_focal_point(img: Image.Image, key: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Focal point of an image in percentages, memoized by source `key`, its
+    namespace/path.
+    The center is used, and not memoized, if the request has less than
+    ITS_AUTO_FOCUS_MIN_REMAINING seconds left. The search isn't stopped once
+    it started, it works on a proxy of the same size for any source.
+    """
+    if key is not None:
+        focal_point = FOCAL_POINTS.get(key)
+        if focal_point is not None:
+            return focal_point
+
+    if get_deadline().remaining() < AUTO_FOCUS_MIN_REMAINING:
+        # the next crop of the source may have the time to look for it
+        METRICS.incr("focal_point.late")
+        return CENTER
+
+    focal_point = centroid(saliency(_proxy(img)))
+    if key is not None:
+        namespace, _, filename = key.partition("/")
+        FOCAL_POINTS.set(
+            key,
+            focal_point,
+            ttl=AUTO_FOCUS_TTL,
+            tags=source_tags(namespace, filename),
+        )
+    return focal_point
+
+
+class FocalPointIndex:
+    """
+    JSON object mapping "namespace/path/to/image.jpg" to [x, y] focal points in
+    percentages, in a local file or an S3 object. It is loaded on the first
+    lookup and reloaded once it is older than `ttl` seconds; the previous
+    index is kept while the new one can't be loaded.
+    """
+
+    def __init__(self, location: str, ttl: float = FOCAL_POINT_INDEX_TTL) -> None:
+        url = urlparse(location)
+        if url.scheme not in ("file", "s3"):
+            raise ConfigError(
+                "ITS_FOCAL_POINT_INDEX must be a file:// or s3:// url, not %s"
+                % location
+            )
+        self.url = url
+        self.ttl = ttl
+        self._points = {}  # type: Dict[str, Tuple[int, int]]
+        self._expires = None  # type: Optional[float]
+        self._lock = threading.Lock()
+
+    def read(self) -> bytes:
+        if self.url.scheme == "file":
+            with open(self.url.path, "rb") as index_file:
+                return index_file.read()
+
+        # pylint: disable=import-outside-toplevel
+        import boto3
+        from botocore.config import Config
+
+        client = boto3.session.Session().client(
+            "s3",
+            config=Config(connect_timeout=LOADER_TIMEOUT, read_timeout=LOADER_TIMEOUT),
+        )
+        response = client.get_object(
+            Bucket=self.url.netloc, Key=self.url.path.lstrip("/")
+        )
+        return response["Body"].read()
+
+    def load(self) -> Dict[str, Tuple[int, int]]:
+        return {
+            str(key): (int(point[0]), int(point[1]))
+            for key, point in json.loads(self.read().decode("utf-8")).items()
+        }
+
+    def points(self) -> Dict[str, Tuple[int, int]]:
+        if self._expires is not None and self._expires > time.monotonic():
+            return self._points
+
+        with self._lock:
+            # another thread may have reloaded it while this one waited
+            if self._expires is None or self._expires <= time.monotonic():
+                try:
+                    self._points = self.load()
+                    METRICS.incr("focal_point.index_load")
+                except Exception:  # pylint: disable=broad-except
+                    METRICS.incr("focal_point.index_error")
+                    LOGGER.exception("failed to load focal point index %s", self.url)
+                self._expires = time.monotonic() + self.ttl
+        return self._points
+
+    def get(self, namespace: str, filename: str) -> Optional[Tuple[int, int]]:
+        return self.points().get("{ns}/{fn}".format(ns=namespace, fn=filename))
+
+
+FOCAL_POINTS_INDEX = FocalPointIndex(FOCAL_POINT_INDEX) if FOCAL_POINT_INDEX else None
+
+
+def indexed_focal_point(namespace: str, filename: str) -> Optional[Tuple[int, int]]:
+    if FOCAL_POINTS_INDEX is None:
+        return None
+    return FOCAL_POINTS_INDEX.get(namespace, filename)
@@ -0,0 +1,140 @@
+"""
+Metadata of sources for laying pages out without downloading them: the
+dimensions and format from the image header, and the focal point and a
+dominant color from a tiny draft decode. Header only info (?info=header)
+is read from the first bytes of sources whose loader can fetch a range.
+"""
+
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from .cache import LRUCache, source_tags
+from .errors import ITSClientError
+from .focal_point import PROXY_SIZE, auto_focal_point, indexed_focal_point
+from .loader import load_header, loader
+from .normalize import NormalizationError, normalize
+from .settings import INFO_HEADER_BYTES, INFO_TTL, MIME_TYPES
+from .transformations.fit import filename_focal_point
+
+# info of recent sources, by source identity
+INFO_CACHE = LRUCache("info", 4096)
+
+# colors the thumbnail is quantized to before counting them
+DOMINANT_COLORS = 8
+
+ALPHA_MODES = ("RGBA", "LA", "PA", "RGBa", "La")
+
+
+def has_alpha(image: Image.Image) -> bool:
+    return image.mode in ALPHA_MODES or "transparency" in image.info
+
+
+def thumbnail(image: Image.Image) -> Image.Image:
+    """
+    RGB(A) version of a source at most PROXY_SIZE pixels wide and high,
+    JPEGs are only decoded at 1/8 scale.
+    """
+    alpha = has_alpha(image)
+    if image.format == "JPEG":
+        image.draft(image.mode, (PROXY_SIZE, PROXY_SIZE))
+    try:
+        image = normalize(image)
+    except NormalizationError:
+        pass
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if alpha else "RGB")
+    image.thumbnail((PROXY_SIZE, PROXY_SIZE), Image.BOX)
+    return image
+
+
+def dominant_color(image: Image.Image) -> Optional[str]:
+    """
+    Most common color of a small RGB(A) image once it is quantized to a few
+    colors, as #rrggbb. Mostly transparent pixels don't count.
+    """
+    quantized = image.convert("RGB").quantize(DOMINANT_COLORS)
+    indexes = quantized.getdata()
+    if image.mode == "RGBA":
+        alphas = image.getchannel("A").getdata()
+        counts = Counter(i for i, alpha in zip(indexes, alphas) if alpha >= 128)
+    else:
+        counts = Counter(indexes)
+    if not counts:
+        return None
+
+    index = counts.most_common(1)[0][0]
+    palette = quantized.getpalette()
+    return "#{:02x}{:02x}{:02x}".format(*palette[index * 3 : index * 3 + 3])
+
+
+def known_focal_point(namespace: str, filename: str) -> Optional[Tuple[int, int]]:
+    """
+    Focal point set in the index or the filename, like crops use them.
+    """
+    focal_point = indexed_focal_point(namespace, filename)
+    if focal_point is not None:
+        return focal_point
+    try:
+        x, y = [int(value) for value in filename_focal_point(filename) or ()]
+    except ValueError:
+        return None
+    return x, y
+
+
+def is_header_only(value: str) -> bool:
+    """
+    Whether the value of an info parameter asks for the header fields only.
+    """
+    if value not in ("", "header"):
+        raise ITSClientError("info takes no value, or header")
+    return value == "header"
+
+
+def _source_info(namespace: str, filename: str, header_only: bool) -> Dict[str, Any]:
+    if header_only:
+        image = load_header(namespace, filename, INFO_HEADER_BYTES)
+    else:
+        # opened lazily, nothing but the header is parsed until the draft decode
+        image = loader(namespace, filename)
+        if not isinstance(image, Image.Image):
+            raise ITSClientError("{fn} is passed through as is".format(fn=filename))
+
+    info = {
+        "width": image.width,
+        "height": image.height,
+        "format": image.format,
+        "mime_type": MIME_TYPES[image.format.upper()],
+        "mode": image.mode,
+        "icc_profile": "icc_profile" in image.info,
+        "alpha": has_alpha(image),
+    }  # type: Dict[str, Any]
+    if header_only:
+        return info
+
+    small = thumbnail(image)
+    focal_point = known_focal_point(namespace, filename)
+    if focal_point is None:
+        key = "{ns}/{fn}".format(ns=namespace, fn=filename)
+        focal_point = auto_focal_point(small, key)
+    info["focal_point"] = list(focal_point)
+    info["dominant_color"] = dominant_color(small)
+    return info
+
+
+def source_info(
+    namespace: str, filename: str, validator: Optional[str], header_only: bool = False
+) -> Dict[str, Any]:
+    """
+    Dimensions, format, mode, ICC profile and alpha presence, and unless
+    `header_only` the focal point in percentages and dominant color of a source.
+    Cached until the source changes, or for ITS_INFO_TTL seconds if it has no
+    validator.
+    """
+    return INFO_CACHE.get_or_set(
+        (namespace, filename, validator, header_only),
+        lambda: _source_info(namespace, filename, header_only),
+        ttl=None if validator else INFO_TTL,
+        tags=source_tags(namespace, filename),
+    )
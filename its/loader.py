@@ -3,61 +3,72 @@ Script to validate images being submitted for transformation.
 """
 
 import logging
+from contextlib import contextmanager
+from typing import Optional, Tuple
 
-from flask import request
+from flask import has_request_context, request
+from PIL import Image, ImageFile, JpegImagePlugin
 from PIL.Image import DecompressionBombError
 
 from .errors import (
     ConfigError,
     ITSClientError,
     ITSInvalidImageFileError,
-    ITSLoaderError,
+    SourceTooLargeError,
 )
 from .loaders import BaseLoader
+from .loaders.registry import bind_namespaces, build_registry
 from .settings import NAMESPACES
+from .util import validate_image_type
 
 LOGGER = logging.getLogger(__name__)
 
+# set here rather than in the application, so render processes, which only
+# import the render pipeline, open sources the same way
 
-def loader(namespace, filename):
+# https://stackoverflow.com/questions/12984426/python-pil-ioerror-image-file-truncated-with-big-images
+ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-    """
-    Loads image using the IMAGE_LOADER specified in settings.
-    """
-    loader_classes = BaseLoader.__subclasses__()
+# workaround for https://github.com/python-pillow/Pillow/issues/1138
+# without this hack, pillow misidenfifies some jpeg files as "mpo" files
+JpegImagePlugin._getmp = lambda x: None  # noqa
 
-    if namespace not in NAMESPACES:
-        raise ConfigError("No Backend for namespace '%s'." % namespace)
-
-    loader_parameters = NAMESPACES[namespace]
-    loader_slug = loader_parameters["loader"]
 
-    matching_loaders = [
-        loader for loader in loader_classes if loader.slug == loader_slug
-    ]
+# built once per worker, so a misconfigured namespace or loader plugin fails
+# at boot instead of on every request
+LOADERS = build_registry()
+NAMESPACE_LOADERS = bind_namespaces(NAMESPACES, LOADERS)
 
-    if not matching_loaders:
-        raise ITSLoaderError("No Image Loader with slug '%s' found." % loader_slug)
 
-    if len(matching_loaders) > 1:
-        raise ConfigError("Two or more Image Loaders have slug '%s'." % loader_slug)
+def get_image_loader(namespace: str) -> BaseLoader:
+    """
+    Returns the loader instance bound to a namespace.
+    """
+    try:
+        return NAMESPACE_LOADERS[namespace]
+    except KeyError:
+        raise ConfigError("No Backend for namespace '%s'." % namespace)
 
-    image_loader = matching_loaders[0]
 
+def _self_reference(
+    image_loader: BaseLoader, filename: str, host: Optional[str]
+) -> Optional[Tuple[str, str]]:
     # handle self-referential http backend use.
     # if we get a request like /my_http_backend/image.example.com/test/image.jpg,
     # we want to serve as if we got `/test/image.jpg`
     path_segments = filename.split("/")
-    if image_loader.slug == "http" and path_segments[0] == request.host:
-        namespace = path_segments[1]
-        filename = "/".join(path_segments[2:])
-        return loader(namespace, filename)
+    if image_loader.slug == "http" and path_segments[0] == host:
+        return path_segments[1], "/".join(path_segments[2:])
+    return None
 
-    if filename.endswith(".svg"):
-        return image_loader.get_fileobj(namespace, filename)
 
+@contextmanager
+def image_errors(namespace, filename):
+    """
+    Turns errors raised while opening a source image into client errors.
+    """
     try:
-        image = image_loader.load_image(namespace, filename)
+        yield
     except OSError as error:
         LOGGER.error(error)
         raise ITSClientError(
@@ -67,11 +78,87 @@ def loader(namespace, filename):
         raise ITSClientError(
             "{ns}/{fn} is not a supported file type".format(ns=namespace, fn=filename)
         )
-    except DecompressionBombError:
+    except (DecompressionBombError, SourceTooLargeError):
         raise ITSClientError(
             "{ns}/{fn}  is too large. Please use a smaller one".format(
                 ns=namespace, fn=filename
             )
         )
 
+
+def loader(namespace, filename, host: Optional[str] = None):
+    """
+    Loads image using the IMAGE_LOADER specified in settings.
+    """
+    image_loader = get_image_loader(namespace)
+
+    if host is None and has_request_context():
+        host = request.host
+
+    self_reference = _self_reference(image_loader, filename, host)
+    if self_reference:
+        return loader(*self_reference, host=host)
+
+    # svg sources are passed through, streamed from the origin
+    if filename.endswith(".svg"):
+        return image_loader.get_stream(namespace, filename)
+
+    with image_errors(namespace, filename):
+        image = image_loader.load_image(namespace, filename)
+
+    return image
+
+
+def load_header(
+    namespace, filename, size: int, host: Optional[str] = None
+) -> Image.Image:
+    """
+    Opens a source from its first `size` bytes, where its loader can fetch a
+    range of it, to read its header. The image can't be decoded unless its
+    loader fetched all of it.
+    """
+    image_loader = get_image_loader(namespace)
+
+    if host is None and has_request_context():
+        host = request.host
+
+    self_reference = _self_reference(image_loader, filename, host)
+    if self_reference:
+        return load_header(*self_reference, size, host=host)
+
+    if filename.endswith(".svg"):
+        raise ITSClientError("{fn} is passed through as is".format(fn=filename))
+
+    with image_errors(namespace, filename):
+        file_obj, complete = image_loader.get_header(namespace, filename, size)
+        try:
+            image = Image.open(file_obj)
+        except OSError:
+            if complete:
+                raise
+            # the header doesn't fit, e.g. a large ICC profile or a WebP
+            return image_loader.load_image(namespace, filename)
+        validate_image_type(image)
+
+    return image
+
+
+async def async_loader(namespace, filename, host: Optional[str] = None):
+    """
+    Same as loader, but waits on the origin without blocking the event loop.
+    Only the image header is parsed, decoding is left to the render executor.
+    """
+    image_loader = get_image_loader(namespace)
+
+    self_reference = _self_reference(image_loader, filename, host)
+    if self_reference:
+        return await async_loader(*self_reference, host=host)
+
+    # svg sources aren't images the loaders can check, they're passed through
+    if filename.endswith(".svg"):
+        return await image_loader.async_get_stream(namespace, filename)
+
+    with image_errors(namespace, filename):
+        image = await image_loader.async_load_image(namespace, filename)
+
     return image
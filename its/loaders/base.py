@@ -1,17 +1,130 @@
-from typing import Union
+import asyncio
+from functools import partial
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from ..errors import ITSInvalidImageFileError, SourceTooLargeError
+from ..settings import MIME_TYPES, SOURCE_MAX_BYTES
+from ..streaming import STREAM_CHUNK_BYTES, SourceStream, iter_buffer
+
+# bytes of a source its format is recognized from, Pillow looks at as many
+SIGNATURE_BYTES = 16
+
+# bytes of a source downloaded before its header is parsed for its size, the
+# amount doubles until the header fits, up to SNIFF_MAX_BYTES
+SNIFF_BYTES = 16 * 1024
+SNIFF_MAX_BYTES = 1024 * 1024
+
+
+def is_whole_range(content_range: Optional[str], length: int, size: int) -> bool:
+    """
+    Whether `length` bytes fetched for a range of `size` bytes, with a
+    Content-Range of "bytes 0-N/TOTAL", are the whole source.
+    """
+    total = (content_range or "").rpartition("/")[2]
+    if total.isdigit():
+        return int(total) <= length
+    return length < size
+
+
+def supported_formats() -> List[str]:
+    """
+    The Pillow formats of the sources ITS can transform.
+    """
+    Image.init()
+    return [name for name in MIME_TYPES if name in Image.OPEN]
+
+
+class SourceReader:
+    """
+    Collects the body of a source as it is downloaded, and stops the download
+    as soon as the source turns out not to be a supported image, to have too
+    many pixels (Image.MAX_IMAGE_PIXELS), or to be larger than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int, length: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._body = BytesIO()
+        self._recognized = False
+        self._sniffed = False
+        self._sniff_at = SNIFF_BYTES
+        if length is not None:
+            self._check_size(length)
+
+    def _check_size(self, size: int) -> None:
+        if self.max_bytes and size > self.max_bytes:
+            raise SourceTooLargeError(
+                "source is larger than {max} bytes".format(max=self.max_bytes)
+            )
+
+    def _recognize(self) -> None:
+        signature = self._body.getvalue()[:SIGNATURE_BYTES]
+        for name in supported_formats():
+            accept = Image.OPEN[name][1]
+            if accept is None or accept(signature):
+                self._recognized = True
+                return
+        raise ITSInvalidImageFileError("invalid image file")
+
+    def _sniff(self) -> None:
+        try:
+            # raises a DecompressionBombError for too many pixels
+            Image.open(BytesIO(self._body.getvalue()))
+        except (OSError, EOFError, SyntaxError):
+            # the header doesn't fit yet
+            self._sniff_at *= 2
+            self._sniffed = self._sniff_at > SNIFF_MAX_BYTES
+        else:
+            self._sniffed = True
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self._check_size(self.size)
+        self._body.write(chunk)
+        if not self._recognized and self.size >= SIGNATURE_BYTES:
+            self._recognize()
+        if not self._sniffed and self.size >= self._sniff_at:
+            self._sniff()
+
+    def finish(self) -> BytesIO:
+        """
+        Returns the whole source, once every chunk was fed.
+        """
+        if not self._recognized:
+            self._recognize()
+        self._body.seek(0)
+        return self._body
 
 
 class BaseLoader:
     """
     Generic file loader class
+
+    One instance is bound to every namespace that uses the loader when the
+    application starts, so a loader can keep per-namespace state (connection
+    pools, caches, timeouts) read from the namespace configuration.
+    Loaders that don't need any state can keep using static methods.
     """
 
     slug: Union[None, str] = None
     parameter_name: Union[None, str] = None
 
-    def __init__(self, arg):
+    def __init__(
+        self, namespace: Optional[str] = None, config: Optional[Dict[str, Any]] = None
+    ) -> None:
         super(BaseLoader, self).__init__()
-        self.arg = arg
+        self.namespace = namespace
+        self.config = config or {}
+        self.max_bytes = int(self.config.get("max_bytes", SOURCE_MAX_BYTES))
+
+    def validate_config(self) -> None:
+        """
+        Raises a ConfigError if the namespace configuration can't be used
+        by this loader. Called once when the namespace is bound.
+        """
 
     @staticmethod
     def load_image(namespace, filename):
@@ -27,3 +140,67 @@ class BaseLoader:
         returns a file-like or bytes-like object.
         """
         raise NotImplementedError
+
+    def get_stream(self, namespace, filename) -> SourceStream:
+        """
+        Returns the source as a stream of chunks, to pass it through as is.
+        Loaders that can read the origin incrementally should override it.
+        """
+        file_obj = self.get_fileobj(namespace, filename)
+        if hasattr(file_obj, "getbuffer"):
+            buffer = file_obj.getbuffer()
+            return SourceStream(iter_buffer(buffer), len(buffer))
+        return SourceStream(iter(partial(file_obj.read, STREAM_CHUNK_BYTES), b""))
+
+    def get_header(self, namespace, filename, size: int) -> Tuple[Any, bool]:
+        """
+        Returns a file-like object with at least the first `size` bytes of a
+        source, enough to parse its header, and whether it holds all of it.
+        Loaders that can fetch a range of the origin should override it.
+        """
+        return self.get_fileobj(namespace, filename), True
+
+    @staticmethod
+    def get_validators(namespace, filename) -> Optional[Tuple[str, float]]:
+        """
+        Returns a validator token and the modification timestamp of a source
+        image, for conditional requests, or None if the loader can't tell
+        without fetching the image.
+        """
+        return None
+
+    async def async_load_image(self, namespace, filename):
+        """
+        Awaitable version of load_image.
+        Loaders without an async client run load_image in the default executor.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.load_image, namespace, filename)
+
+    async def async_get_fileobj(self, namespace, filename):
+        """
+        Awaitable version of get_fileobj.
+        Loaders without an async client run get_fileobj in the default executor.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get_fileobj, namespace, filename)
+
+    async def async_get_stream(self, namespace, filename) -> SourceStream:
+        """
+        Awaitable version of get_stream. Only waiting for the origin to answer
+        happens in the default executor, the chunks are read as they're sent.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get_stream, namespace, filename)
+
+    async def async_get_validators(
+        self, namespace, filename
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Awaitable version of get_validators.
+        Loaders without an async client run get_validators in the default executor.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, self.get_validators, namespace, filename
+        )
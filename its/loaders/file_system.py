@@ -1,24 +1,96 @@
-from io import BytesIO
+import mmap
+from io import SEEK_CUR, SEEK_END, SEEK_SET, BytesIO
 from pathlib import Path, PosixPath
-from typing import Union
+from typing import Optional, Tuple, Union
 
-from enforce import runtime_validation
 from PIL import Image
 from PIL.JpegImagePlugin import JpegImageFile
 from PIL.PngImagePlugin import PngImageFile
 
 from ..errors import NotFoundError
-from ..settings import ENFORCE_TYPE_CHECKS
+from ..settings import FILE_SYSTEM_ROOT, NAMESPACES
+from ..typecheck import runtime_validation
 from ..util import validate_image_type
 from .base import BaseLoader
 
 
+class MappedFile:
+    """
+    Read-only file object over a memory-mapped file.
+
+    Pillow reads the source straight from the page cache, and getbuffer()
+    hands out zero-copy views (e.g. to the render pool's shared memory).
+    The mapping is released when the file object is garbage collected.
+    """
+
+    def __init__(self, path: Union[Path, str]) -> None:
+        # the mapping stays valid after the descriptor is closed
+        with open(str(path), "rb") as file_obj:
+            self._map = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._position = 0
+        self.name = str(path)
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        data = self._view[self._position : end].tobytes()
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._position : self._position + len(buffer)]
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if whence == SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_END:
+            offset += len(self._view)
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def getvalue(self) -> bytes:
+        return self._view.tobytes()
+
+    def close(self) -> None:
+        # views handed out by getbuffer keep the mapping alive until released
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
 class FileSystemLoader(BaseLoader):
 
     slug = "file_system"
     parameter_name = "folders"
 
-    @runtime_validation(enabled=ENFORCE_TYPE_CHECKS)
+    @staticmethod
+    def get_path(namespace: str, filename: str) -> Path:
+        """
+        Path of a source image. Namespaces are folders under the namespace's
+        "root", or ITS_FILE_SYSTEM_ROOT.
+        """
+        root = Path(NAMESPACES.get(namespace, {}).get("root", FILE_SYSTEM_ROOT))
+        image_path = (root / namespace / filename).resolve()
+        # don't let ../ in a filename escape the root
+        if root.resolve() not in image_path.parents:
+            raise NotFoundError("File Not Found at %s" % Path(namespace, filename))
+        return image_path
+
+    @runtime_validation
     @staticmethod
     def load_image(
         namespace: str, filename: Union[PosixPath, str]
@@ -28,7 +100,6 @@ class FileSystemLoader(BaseLoader):
         """
         if isinstance(filename, PosixPath):
             filename = str(filename)
-        # Path to the great grandparent directory of this file
         try:
             image_bytes = FileSystemLoader.get_fileobj(namespace, filename)
             image = Image.open(image_bytes)
@@ -40,13 +111,39 @@ class FileSystemLoader(BaseLoader):
 
         return image
 
-    @runtime_validation(enabled=ENFORCE_TYPE_CHECKS)
+    @runtime_validation
     @staticmethod
-    def get_fileobj(namespace: str, filename: str) -> BytesIO:
+    def get_fileobj(namespace: str, filename: str) -> Union[MappedFile, BytesIO]:
         """
         Given a namespace (or directory name) and a filename,
         returns a file-like or bytes-like object.
         """
-        api_root = Path(__file__).parents[1]
-        image_path = Path(api_root / namespace / filename)
-        return BytesIO(open(image_path, "rb").read())
+        image_path = FileSystemLoader.get_path(namespace, filename)
+
+        # mapped files that are truncated while they are read crash the
+        # worker (SIGBUS), namespaces on volatile mounts can opt out
+        if NAMESPACES.get(namespace, {}).get("mmap", True):
+            try:
+                return MappedFile(image_path)
+            except ValueError:  # empty files can't be mapped
+                pass
+
+        with open(str(image_path), "rb") as file_obj:
+            return BytesIO(file_obj.read())
+
+    def get_header(self, namespace, filename, size):
+        # mapped files are only read as far as the header goes anyway
+        try:
+            return FileSystemLoader.get_fileobj(namespace, filename), True
+        except FileNotFoundError:
+            raise NotFoundError(
+                "File Not Found at %s" % (Path(namespace + "/" + filename))
+            )
+
+    @staticmethod
+    def get_validators(namespace: str, filename: str) -> Optional[Tuple[str, float]]:
+        try:
+            stat = FileSystemLoader.get_path(namespace, str(filename)).stat()
+        except (OSError, NotFoundError):
+            return None
+        return "{:x}-{:x}".format(stat.st_mtime_ns, stat.st_size), stat.st_mtime
@@ -1,12 +1,70 @@
+import asyncio
+import importlib.util
+import threading
+from contextlib import contextmanager
 from io import BytesIO
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import requests
 from PIL import Image
 
-from ..errors import ITSLoaderError, NotFoundError
-from ..settings import NAMESPACES
+from ..errors import ConfigError, ITSLoaderError, NotFoundError
+from ..metrics import METRICS
+from ..origins import Fetch, get_origin
+from ..settings import ASGI_MAX_FETCHES, LOADER_TIMEOUT, NAMESPACES
+from ..streaming import STREAM_CHUNK_BYTES, SourceStream
 from ..util import validate_image_type
-from .base import BaseLoader
+from .base import BaseLoader, SourceReader, is_whole_range
+
+# aiohttp is only imported by the first async fetch, wsgi workers never need it.
+# async fetches fall back to requests in the default executor without it.
+HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+
+# errors of origins that can't be reached or don't answer in time
+ORIGIN_ERRORS = (requests.RequestException, asyncio.TimeoutError)  # type: Tuple
+
+# aiohttp sessions are bound to the event loop that created them
+_ASYNC_SESSIONS = {}  # type: Dict[Any, Any]
+
+
+def get_async_session():
+    loop = asyncio.get_event_loop()
+    session = _ASYNC_SESSIONS.get(loop)
+    if session is None or session.closed:
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASGI_MAX_FETCHES)
+        )
+        _ASYNC_SESSIONS[loop] = session
+    return session
+
+
+async def close_async_sessions():
+    loop = asyncio.get_event_loop()
+    session = _ASYNC_SESSIONS.pop(loop, None)
+    if session is not None:
+        await session.close()
+
+
+@contextmanager
+def origin_fetch(
+    url: str, errors: Tuple = ORIGIN_ERRORS, limited: bool = True
+) -> Iterator[Fetch]:
+    """
+    Guards a fetch with the circuit breaker and, if `limited`, the in-flight
+    limit of its origin, and turns transport errors into loader errors, which
+    are not mistaken for sources that aren't images.
+    """
+    with get_origin(url).fetch(limited) as fetch:
+        try:
+            yield fetch
+        except errors as error:
+            # e.g. the body timed out after the status arrived
+            fetch.status = None
+            raise ITSLoaderError(
+                "{url} failed: {error}".format(url=url, error=error), status_code=502
+            )
 
 
 class HTTPLoader(BaseLoader):
@@ -14,12 +72,32 @@ class HTTPLoader(BaseLoader):
     slug = "http"
     parameter_name = "prefixes"
 
+    def __init__(
+        self, namespace: Optional[str] = None, config: Optional[Dict[str, Any]] = None
+    ) -> None:
+        super().__init__(namespace, config)
+        self.timeout = float(self.config.get("timeout", LOADER_TIMEOUT))
+        # requests sessions are not guaranteed to be thread-safe, so every
+        # worker thread keeps its own keep-alive connection pool per namespace
+        self._local = threading.local()
+
+    def validate_config(self) -> None:
+        if not isinstance(self.config.get(self.parameter_name), list):
+            raise ConfigError(
+                "Namespace '{ns}' needs a list of {param}.".format(
+                    ns=self.namespace, param=self.parameter_name
+                )
+            )
+
+    def get_session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
     @staticmethod
-    def get_fileobj(namespace, filename):
-        """
-        Given a namespace (or directory name) and a filename,
-        returns a file-like or bytes-like object.
-        """
+    def get_url(namespace, filename):
         prefixes = set(
             filename.rsplit("/", 1)[0].split("/")
         )  # everything before the final slash
@@ -30,35 +108,160 @@ class HTTPLoader(BaseLoader):
             raise NotFoundError("Namespace {} is not configured.".format(namespace))
 
         if filename.startswith("http"):
-            url = filename
-        else:
-            url = "https://{}".format(filename)
-        response = requests.get(url)
+            return filename
+        return "https://{}".format(filename)
 
-        if response.status_code in [403, 404]:
+    @staticmethod
+    def content_length(headers) -> Optional[int]:
+        # no length for compressed bodies, they are read decoded
+        length = headers.get("Content-Length")
+        if length is None or headers.get("Content-Encoding"):
+            return None
+        return int(length)
+
+    @staticmethod
+    def check_status(status_code, namespace, filename):
+        if status_code in [403, 404]:
             raise NotFoundError(
                 "404 from http backend for {namespace}/{filename}".format(
                     namespace=namespace, filename=filename
                 )
             )
-        if response.status_code != 200:
+        if status_code != 200:
             raise ITSLoaderError(
                 "{code} from http backend for {namespace}/{filename}".format(
-                    code=response.status_code, namespace=namespace, filename=filename
+                    code=status_code, namespace=namespace, filename=filename
                 ),
                 status_code=500,
             )
 
-        # create an empty bytes object to store the image bytes in
-        return BytesIO(response.content)
+    def get_fileobj(self, namespace, filename):
+        """
+        Given a namespace (or directory name) and a filename,
+        returns a file-like or bytes-like object.
+        """
+        url = HTTPLoader.get_url(namespace, filename)
+        with origin_fetch(url) as fetch:
+            # streamed, so sources that can't be used are dropped early
+            response = self.get_session().get(url, timeout=self.timeout, stream=True)
+            fetch.status = response.status_code
+            METRICS.incr("loader.http.fetch")
+            try:
+                HTTPLoader.check_status(response.status_code, namespace, filename)
+                reader = SourceReader(
+                    self.max_bytes, HTTPLoader.content_length(response.headers)
+                )
+                for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                    reader.feed(chunk)
+            finally:
+                response.close()
+
+        return reader.finish()
+
+    def get_header(self, namespace, filename, size):
+        url = HTTPLoader.get_url(namespace, filename)
+        with origin_fetch(url) as fetch:
+            # streamed, so origins that ignore the range don't send all of it
+            response = self.get_session().get(
+                url,
+                timeout=self.timeout,
+                headers={"Range": "bytes=0-{last}".format(last=size - 1)},
+                stream=True,
+            )
+            fetch.status = response.status_code
+            METRICS.incr("loader.http.header_fetch")
+            try:
+                # empty sources can't satisfy a range
+                if response.status_code == 416:
+                    return BytesIO(), True
+                partial = response.status_code == 206
+                if not partial:
+                    # origins that don't support ranges send all of it
+                    HTTPLoader.check_status(response.status_code, namespace, filename)
+                reader = SourceReader(
+                    self.max_bytes, HTTPLoader.content_length(response.headers)
+                )
+                for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                    reader.feed(chunk)
+                    if partial and reader.size >= size:
+                        break
+            finally:
+                response.close()
+
+        if partial:
+            complete = is_whole_range(
+                response.headers.get("Content-Range"), reader.size, size
+            )
+            return reader.finish(), complete
+        return reader.finish(), True
 
-    @staticmethod
-    def load_image(namespace, filename):
+    def get_stream(self, namespace, filename):
+        url = HTTPLoader.get_url(namespace, filename)
+        # the body is passed through as it arrives, only waiting for the
+        # response counts against the breaker
+        with origin_fetch(url) as fetch:
+            response = self.get_session().get(url, timeout=self.timeout, stream=True)
+            fetch.status = response.status_code
+        METRICS.incr("loader.http.fetch")
+
+        try:
+            HTTPLoader.check_status(response.status_code, namespace, filename)
+        except Exception:
+            response.close()
+            raise
+
+        def chunks():
+            with response:
+                yield from response.iter_content(STREAM_CHUNK_BYTES)
+
+        return SourceStream(chunks(), HTTPLoader.content_length(response.headers))
+
+    def load_image(self, namespace, filename):
         """
         Loads image from http.
         """
         try:
-            file_obj = HTTPLoader.get_fileobj(namespace, filename)
+            file_obj = self.get_fileobj(namespace, filename)
+            img = Image.open(file_obj)
+
+        except NotFoundError as error:
+            raise NotFoundError("An error occurred: '%s'" % str(error))
+
+        validate_image_type(img)
+
+        return img
+
+    async def async_get_fileobj(self, namespace, filename):
+        if not HAS_AIOHTTP:
+            return await super().async_get_fileobj(namespace, filename)
+
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        url = HTTPLoader.get_url(namespace, filename)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        # waiting for a slot would block the event loop, async fetches wait on
+        # the connection pool of the session instead
+        with origin_fetch(
+            url, ORIGIN_ERRORS + (aiohttp.ClientError,), limited=False
+        ) as fetch:
+            async with get_async_session().get(url, timeout=timeout) as response:
+                METRICS.incr("loader.http.fetch")
+                fetch.status = response.status
+                HTTPLoader.check_status(response.status, namespace, filename)
+                reader = SourceReader(
+                    self.max_bytes, HTTPLoader.content_length(response.headers)
+                )
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_BYTES):
+                    reader.feed(chunk)
+
+        return reader.finish()
+
+    async def async_load_image(self, namespace, filename):
+        if not HAS_AIOHTTP:
+            return await super().async_load_image(namespace, filename)
+
+        try:
+            file_obj = await self.async_get_fileobj(namespace, filename)
             img = Image.open(file_obj)
 
         except NotFoundError as error:
@@ -0,0 +1,90 @@
+"""
+Registry of image loaders, built once when the application starts.
+
+Loaders are the subclasses of BaseLoader imported by then, plus the classes
+that installed packages advertise in the "its.loaders" entry point group:
+
+    setup(..., entry_points={"its.loaders": ["gcs = its_gcs:GCSLoader"]})
+"""
+
+import logging
+import sys
+from typing import Any, Dict, Iterator, Type
+
+from ..errors import ConfigError
+from ..resampling import namespace_resampling
+from .base import BaseLoader
+
+if sys.version_info >= (3, 10):
+    from importlib import metadata
+else:
+    import importlib_metadata as metadata
+
+LOGGER = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "its.loaders"
+
+
+def iter_entry_points() -> Iterator[Any]:
+    yield from metadata.entry_points(group=ENTRY_POINT_GROUP)
+
+
+def _subclasses(cls: Type[BaseLoader]) -> Iterator[Type[BaseLoader]]:
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
+def build_registry() -> Dict[str, Type[BaseLoader]]:
+    """
+    Maps loader slugs to loader classes.
+    """
+    for entry_point in iter_entry_points():
+        loader_class = entry_point.load()
+        if not (
+            isinstance(loader_class, type) and issubclass(loader_class, BaseLoader)
+        ):
+            raise ConfigError(
+                "Entry point '%s' is not an image loader." % entry_point.name
+            )
+        LOGGER.debug("loaded image loader plugin %s", entry_point.name)
+
+    registry = {}  # type: Dict[str, Type[BaseLoader]]
+    for loader_class in _subclasses(BaseLoader):
+        if loader_class.slug is None:
+            continue
+        if loader_class.slug in registry:
+            raise ConfigError(
+                "Two or more Image Loaders have slug '%s'." % loader_class.slug
+            )
+        registry[loader_class.slug] = loader_class
+
+    return registry
+
+
+def bind_namespaces(
+    namespaces: Dict[str, Dict[str, Any]], registry: Dict[str, Type[BaseLoader]]
+) -> Dict[str, BaseLoader]:
+    """
+    Creates a configured loader instance for every namespace that loads images.
+    Raises a ConfigError for a namespace whose configuration can't be used.
+    """
+    bound = {}
+    for namespace, config in namespaces.items():
+        if config.get("redirect"):
+            continue
+
+        loader_slug = config.get("loader")
+        if loader_slug not in registry:
+            raise ConfigError(
+                "No Image Loader with slug '%s' found for namespace '%s'."
+                % (loader_slug, namespace)
+            )
+
+        image_loader = registry[loader_slug](namespace, config)
+        image_loader.validate_config()
+        # namespace settings of the render pipeline fail at boot as well
+        namespace_resampling(namespace, config)
+        bound[namespace] = image_loader
+
+    return bound
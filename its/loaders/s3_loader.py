@@ -1,68 +1,231 @@
+import asyncio
+import importlib.util
 import logging
+import threading
 from io import BytesIO
+from typing import Any, Dict, Optional
 
-import boto3
-from botocore.exceptions import ClientError
 from PIL import Image
 
-from ..errors import NotFoundError
-from ..settings import NAMESPACES
+from ..errors import ConfigError, NotFoundError
+from ..metrics import METRICS
+from ..settings import LOADER_TIMEOUT, NAMESPACES
+from ..streaming import STREAM_CHUNK_BYTES, SourceStream
 from ..util import validate_image_type
-from .base import BaseLoader
+from .base import BaseLoader, SourceReader, is_whole_range
 
 LOGGER = logging.getLogger(__name__)
 
+# boto3 and aiobotocore take a long time to import and most namespaces never
+# read from s3, so they are only imported by the first s3 fetch.
+# async fetches fall back to boto3 in the default executor without aiobotocore.
+HAS_AIOBOTOCORE = importlib.util.find_spec("aiobotocore") is not None
+
+
+def client_error():
+    from botocore.exceptions import (  # pylint: disable=import-outside-toplevel
+        ClientError,
+    )
+
+    return ClientError
+
+
+# aiobotocore clients are bound to the event loop that created them
+_ASYNC_CLIENTS = {}  # type: Dict[Any, Any]
+
+
+async def get_async_client():
+    loop = asyncio.get_event_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        from aiobotocore.session import (  # pylint: disable=import-outside-toplevel
+            get_session,
+        )
+
+        client_context = get_session().create_client("s3")
+        client = await client_context.__aenter__()
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+async def close_async_clients():
+    loop = asyncio.get_event_loop()
+    client = _ASYNC_CLIENTS.pop(loop, None)
+    if client is not None:
+        await client.close()
+
 
 class S3Loader(BaseLoader):
 
     slug = "s3"
     parameter_name = "bucket"
 
+    def __init__(
+        self, namespace: Optional[str] = None, config: Optional[Dict[str, Any]] = None
+    ) -> None:
+        super().__init__(namespace, config)
+        self.timeout = float(self.config.get("timeout", LOADER_TIMEOUT))
+        # boto3 clients are thread-safe (sessions and resources are not), so
+        # the namespace's client is created lazily and shared by all threads
+        self._client_lock = threading.Lock()
+        self._client = None
+
+    def validate_config(self) -> None:
+        if not self.config.get(self.parameter_name):
+            raise ConfigError(
+                "Namespace '{ns}' needs a {param}.".format(
+                    ns=self.namespace, param=self.parameter_name
+                )
+            )
+
+    def get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                # pylint: disable=import-outside-toplevel
+                import boto3
+                from botocore.config import Config
+
+                self._client = boto3.session.Session().client(
+                    "s3",
+                    region_name=self.config.get("region"),
+                    config=Config(
+                        connect_timeout=self.timeout, read_timeout=self.timeout
+                    ),
+                )
+        return self._client
+
     @staticmethod
-    def get_fileobj(namespace, filename):
+    def get_location(namespace, filename):
+        config = NAMESPACES[namespace]
+        path = config.get("path", namespace).strip("/")
+        key = "{path}/{filename}".format(path=path, filename=filename).strip("/")
+        return config[S3Loader.parameter_name], key
+
+    def get_fileobj(self, namespace, filename):
         """
         Given a namespace (or directory name) and a filename,
         returns a file-like or bytes-like object.
         """
-        # get the s3 resource
-        s3_resource = boto3.resource("s3")
+        bucket_name, key = S3Loader.get_location(namespace, filename)
 
-        config = NAMESPACES[namespace]
-        path = config.get("path", namespace).strip("/")
-        key = "{path}/{filename}".format(path=path, filename=filename).strip("/")
-        bucket_name = config[S3Loader.parameter_name]
-        s3_object = s3_resource.Object(bucket_name=bucket_name, key=key)
+        # streamed, so objects that can't be used are dropped early
+        response = self.get_client().get_object(Bucket=bucket_name, Key=key)
+        METRICS.incr("loader.s3.fetch")
+        body = response["Body"]
+        try:
+            reader = SourceReader(self.max_bytes, response.get("ContentLength"))
+            for chunk in body.iter_chunks(STREAM_CHUNK_BYTES):
+                reader.feed(chunk)
+        finally:
+            body.close()
 
-        # create an empty bytes object to store the image bytes in
-        file_obj = BytesIO()
-        s3_object.download_fileobj(file_obj)
+        return reader.finish()
 
-        return file_obj
+    def get_stream(self, namespace, filename):
+        bucket_name, key = S3Loader.get_location(namespace, filename)
+        try:
+            response = self.get_client().get_object(Bucket=bucket_name, Key=key)
+        except client_error() as error:
+            S3Loader.raise_for_client_error(error, namespace)
+        METRICS.incr("loader.s3.fetch")
+
+        def chunks():
+            body = response["Body"]
+            try:
+                yield from body.iter_chunks(STREAM_CHUNK_BYTES)
+            finally:
+                body.close()
+
+        return SourceStream(chunks(), response["ContentLength"])
+
+    def get_header(self, namespace, filename, size):
+        bucket_name, key = S3Loader.get_location(namespace, filename)
+        try:
+            response = self.get_client().get_object(
+                Bucket=bucket_name,
+                Key=key,
+                Range="bytes=0-{last}".format(last=size - 1),
+            )
+        except client_error() as error:
+            # empty objects can't satisfy a range
+            if error.response["Error"]["Code"] == "InvalidRange":
+                return BytesIO(), True
+            S3Loader.raise_for_client_error(error, namespace)
+        METRICS.incr("loader.s3.header_fetch")
+
+        body = response["Body"]
+        try:
+            reader = SourceReader(self.max_bytes, response.get("ContentLength"))
+            for chunk in body.iter_chunks(STREAM_CHUNK_BYTES):
+                reader.feed(chunk)
+                if reader.size >= size:
+                    break
+        finally:
+            body.close()
+        complete = is_whole_range(response.get("ContentRange"), reader.size, size)
+        return reader.finish(), complete
 
     @staticmethod
-    def load_image(namespace, filename):
+    def raise_for_client_error(error, namespace):
+        error_code = error.response["Error"]["Code"]
+
+        # head_object reports missing keys as 404,
+        # get_object reports them as NoSuchKey
+        if error_code in ("404", "NoSuchKey"):
+            raise NotFoundError("An error occurred: '%s'" % str(error))
+
+        # S3 can return 403 errors if the application lacks ListBucket
+        # permissions for the relevant s3 bucket
+        # https://stackoverflow.com/questions/19037664/how-do-i-have-an-s3-bucket-return-404-instead-of-403-for-a-key-that-does-not-e
+        if error_code in ("403", "AccessDenied"):
+            LOGGER.warning(
+                "403 from s3 bucket %s, the application probably lacks ListBucket permissions",
+                NAMESPACES[namespace][S3Loader.parameter_name],
+            )
+            raise NotFoundError("An error occurred: '%s'" % str(error))
+
+        raise error
+
+    def load_image(self, namespace, filename):
         """
         Loads image from AWS S3 bucket.
         """
         try:
-            file_obj = S3Loader.get_fileobj(namespace, filename)
-        except ClientError as error:
-            error_code = error.response["Error"]["Code"]
-
-            if error_code == "404":
-                raise NotFoundError("An error occurred: '%s'" % str(error))
-
-            # S3 can return 403 errors if the application lacks ListBucket
-            # permissions for the relevant s3 bucket
-            # https://stackoverflow.com/questions/19037664/how-do-i-have-an-s3-bucket-return-404-instead-of-403-for-a-key-that-does-not-e
-            if error_code == "403":
-                LOGGER.warning(
-                    "403 from s3 bucket %s, the application probably lacks ListBucket permissions",
-                    NAMESPACES[namespace][S3Loader.parameter_name],
-                )
-                raise NotFoundError("An error occurred: '%s'" % str(error))
+            file_obj = self.get_fileobj(namespace, filename)
+        except client_error() as error:
+            S3Loader.raise_for_client_error(error, namespace)
+
+        image = Image.open(file_obj)
 
-            raise error
+        validate_image_type(image)
+
+        return image
+
+    async def async_get_fileobj(self, namespace, filename):
+        if not HAS_AIOBOTOCORE:
+            return await super().async_get_fileobj(namespace, filename)
+
+        bucket_name, key = S3Loader.get_location(namespace, filename)
+        client = await get_async_client()
+        response = await client.get_object(Bucket=bucket_name, Key=key)
+        METRICS.incr("loader.s3.fetch")
+        async with response["Body"] as body:
+            reader = SourceReader(self.max_bytes, response.get("ContentLength"))
+            chunk = await body.read(STREAM_CHUNK_BYTES)
+            while chunk:
+                reader.feed(chunk)
+                chunk = await body.read(STREAM_CHUNK_BYTES)
+
+        return reader.finish()
+
+    async def async_load_image(self, namespace, filename):
+        if not HAS_AIOBOTOCORE:
+            return await super().async_load_image(namespace, filename)
+
+        try:
+            file_obj = await self.async_get_fileobj(namespace, filename)
+        except client_error() as error:
+            S3Loader.raise_for_client_error(error, namespace)
 
         image = Image.open(file_obj)
 
@@ -0,0 +1,57 @@
+"""
+Process-wide counters and gauges that can be updated from any request thread.
+"""
+import logging
+import threading
+from typing import Dict
+
+LOGGER = logging.getLogger(__name__)
+
+METRIC_PREFIX = "Custom/ITS/"
+
+
+def _record_custom_metric(name: str, value: float) -> None:
+    # report to new relic when the agent is running this process
+    try:
+        from newrelic.agent import record_custom_metric
+    except ImportError:
+        return
+
+    try:
+        record_custom_metric(METRIC_PREFIX + name, value)
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.debug("failed to record metric %s", name, exc_info=True)
+
+
+class Metrics:
+    """
+    Thread-safe registry of named counters and gauges.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = {}  # type: Dict[str, float]
+        self._gauges = {}  # type: Dict[str, float]
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+        _record_custom_metric(name, value)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            values = dict(self._counters)
+            values.update(self._gauges)
+        return values
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+METRICS = Metrics()
@@ -11,6 +11,7 @@ from PIL.PngImagePlugin import PngImageFile
 
 from its.settings import DEFAULT_JPEG_QUALITY, PNGQUANT_PATH
 
+from .deadline import get_deadline
 from .errors import ITSClientError, ITSTransformError
 
 ImageFile.MAXBLOCK = 2 ** 20  # for JPG progressive saving
@@ -90,8 +91,13 @@ def optimize(img: Image.Image, query: Dict[str, str]) -> Image.Image:
         else:
             raise ITSClientError("ITS Client Error: Format must be jpeg, png or webp")
 
-        # only optimize pngs if quality param is provided
-        if img.format == "PNG" and quality is not None:
+        # only optimize pngs if quality param is provided,
+        # and there is time left for pngquant
+        if (
+            img.format == "PNG"
+            and quality is not None
+            and not get_deadline().should_degrade()
+        ):
             img = optimize_png(img, tmp_file, quality)
 
     return img
@@ -123,7 +129,13 @@ def optimize_jpg(
     elif quality > 95:
         quality = 95  # 95 is the recommended upper limit on quality for JPEGs in PIL
 
-    img.save(tmp_file.name, "JPEG", quality=quality, optimize=True, progressive=True)
+    if get_deadline().should_degrade():
+        # huffman optimization and progressive scans cost more than the bytes they save
+        img.save(tmp_file.name, "JPEG", quality=quality)
+    else:
+        img.save(
+            tmp_file.name, "JPEG", quality=quality, optimize=True, progressive=True
+        )
 
     return Image.open(tmp_file.name)
 
@@ -0,0 +1,227 @@
+"""
+Circuit breakers and concurrency limits for the origins of http sources.
+
+Every origin host gets a breaker per worker. It counts the fetches of the
+last ORIGIN_BREAKER_WINDOW seconds, and opens once enough of them failed
+(connection errors, timeouts, 5xx, or headers slower than
+ORIGIN_SLOW_SECONDS to arrive). While it is open, fetches from the origin fail at once
+with a 503 instead of tying up a request thread until they time out, and
+cached sources are served instead where possible. After
+ORIGIN_BREAKER_OPEN_SECONDS a single trial fetch is let through, which
+closes the breaker again or keeps it open.
+
+Independently, at most ORIGIN_MAX_FETCHES fetches from an origin are in
+flight at once, so a slow origin can't take every thread of a worker. Further
+fetches wait up to ORIGIN_QUEUE_SECONDS for one of them to finish before they
+fail with a 503. Async fetches aren't limited per origin, they wait on the
+connection pool of the event loop instead.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .errors import OriginUnavailableError
+from .metrics import METRICS
+from .settings import (
+    ORIGIN_BREAKER_ERROR_RATE,
+    ORIGIN_BREAKER_MIN_FETCHES,
+    ORIGIN_BREAKER_OPEN_SECONDS,
+    ORIGIN_BREAKER_WINDOW,
+    ORIGIN_MAX_FETCHES,
+    ORIGIN_QUEUE_SECONDS,
+    ORIGIN_SLOW_SECONDS,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# values of the origin.<host>.breaker gauge
+STATE_GAUGES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class Fetch:
+    """
+    A fetch in flight, whose status the caller sets once the origin answers.
+    Setting it the first time records how long the origin took to answer,
+    whatever time the body then takes to download.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.answered_after = None  # type: Optional[float]
+        self._status = None  # type: Optional[int]
+
+    @property
+    def status(self) -> Optional[int]:
+        return self._status
+
+    @status.setter
+    def status(self, status: Optional[int]) -> None:
+        if self.answered_after is None:
+            self.answered_after = time.monotonic() - self.started
+        self._status = status
+
+
+class Origin:
+    """
+    Circuit breaker and in-flight limit of one origin host.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        max_fetches: int = ORIGIN_MAX_FETCHES,
+        queue_seconds: float = ORIGIN_QUEUE_SECONDS,
+        window: float = ORIGIN_BREAKER_WINDOW,
+        min_fetches: int = ORIGIN_BREAKER_MIN_FETCHES,
+        error_rate: float = ORIGIN_BREAKER_ERROR_RATE,
+        slow: float = ORIGIN_SLOW_SECONDS,
+        open_seconds: float = ORIGIN_BREAKER_OPEN_SECONDS,
+    ) -> None:
+        self.host = host
+        self.max_fetches = max_fetches
+        self.queue_seconds = queue_seconds
+        self.window = window
+        self.min_fetches = min_fetches
+        self.error_rate = error_rate
+        self.slow = slow
+        self.open_seconds = open_seconds
+
+        self.state = CLOSED
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._slots = (
+            threading.BoundedSemaphore(max_fetches) if max_fetches else None
+        )  # type: Optional[threading.BoundedSemaphore]
+        # (monotonic time, failed) of the fetches in the window
+        self._outcomes = deque()  # type: Deque[Tuple[float, bool]]
+        self._failures = 0
+        self._opened = 0.0
+        self._trial = False
+
+    def _metric(self, name: str) -> str:
+        return "origin.{host}.{name}".format(host=self.host, name=name)
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        LOGGER.warning("breaker of %s is %s", self.host, state.replace("_", "-"))
+        self.state = state
+        METRICS.gauge(self._metric("breaker"), STATE_GAUGES[state])
+        if state == OPEN:
+            self._opened = time.monotonic()
+            METRICS.incr(self._metric("opened"))
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _reject(self, reason: str) -> OriginUnavailableError:
+        METRICS.incr(self._metric("rejected"))
+        return OriginUnavailableError(
+            "{host} is {reason}".format(host=self.host, reason=reason),
+            retry_after=self.retry_after(),
+        )
+
+    def retry_after(self) -> int:
+        if self.state != OPEN:
+            return 1
+        remaining = self._opened + self.open_seconds - time.monotonic()
+        return max(1, int(remaining + 0.5))
+
+    def acquire(self, limited: bool = True) -> bool:
+        """
+        Takes an in-flight slot, waiting up to queue_seconds for one if they
+        are all taken, unless the fetch isn't `limited`. Raises an
+        OriginUnavailableError at once while the breaker is open, or if no
+        slot was freed in time. Returns whether the fetch is the trial of a
+        half-open breaker.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self._opened + self.open_seconds:
+                    raise self._reject("down")
+                self._set_state(HALF_OPEN)
+            trial = False
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    raise self._reject("down")
+                self._trial = trial = True
+
+        if limited and self._slots is not None:
+            if not self._slots.acquire(timeout=self.queue_seconds):
+                with self._lock:
+                    if trial:
+                        self._trial = False
+                    raise self._reject("busy")
+        with self._lock:
+            self.in_flight += 1
+        return trial
+
+    def release(self, trial: bool, failed: bool, limited: bool = True) -> None:
+        """
+        Frees an in-flight slot and records whether its fetch failed.
+        """
+        if limited and self._slots is not None:
+            self._slots.release()
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                METRICS.incr(self._metric("failed"))
+            if trial:
+                self._trial = False
+                self._set_state(OPEN if failed else CLOSED)
+                return
+            if self.state != CLOSED:
+                # a fetch that started before the breaker opened
+                return
+
+            now = time.monotonic()
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and self._outcomes[0][0] <= now - self.window:
+                self._failures -= self._outcomes.popleft()[1]
+            fetches = len(self._outcomes)
+            if fetches >= self.min_fetches and (
+                self._failures >= self.error_rate * fetches
+            ):
+                self._set_state(OPEN)
+
+    @contextmanager
+    def fetch(self, limited: bool = True) -> Iterator[Fetch]:
+        """
+        Guards a fetch from the origin. It failed if no status was set (e.g. it
+        timed out), if the status is a 5xx, or if the origin took longer than
+        the slow threshold to answer. Downloading the body doesn't count, large
+        sources take long on healthy origins too.
+        """
+        trial = self.acquire(limited)
+        fetch = Fetch()
+        try:
+            yield fetch
+        finally:
+            failed = (
+                fetch.status is None
+                or fetch.status >= 500
+                or (fetch.answered_after or 0) > self.slow
+            )
+            self.release(trial, failed, limited)
+
+
+_ORIGINS = {}  # type: Dict[str, Origin]
+_ORIGINS_LOCK = threading.Lock()
+
+
+def get_origin(url: str) -> Origin:
+    host = urlsplit(url).netloc.lower()
+    origin = _ORIGINS.get(host)
+    if origin is None:
+        with _ORIGINS_LOCK:
+            origin = _ORIGINS.setdefault(host, Origin(host))
+    return origin
@@ -0,0 +1,291 @@
+"""
+Peer-aware mode: the nodes of a cluster split the sources between them with
+a consistent-hash ring, and a node forwards requests for a source it doesn't
+own to its owner over keep-alive connections. Each source and its renditions
+are then cached by one node, and adding or removing a node only moves the
+sources of its neighbours on the ring. Requests are rendered locally when
+their owner is down.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional
+
+import requests
+
+from .client_hints import HINT_HEADERS
+from .loaders.http import HAS_AIOHTTP, get_async_session
+from .metrics import METRICS
+from .settings import (
+    PEER_RETRY,
+    PEER_SELF,
+    PEER_TIMEOUT,
+    PEERS,
+    PEERS_DNS,
+    PEERS_DNS_TTL,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# points of each peer on the ring, more spread the sources more evenly
+RING_REPLICAS = 160
+
+# seconds to connect to a peer, one that doesn't accept connections is down
+PEER_CONNECT_TIMEOUT = 1.0
+
+# port of ITS_PEER_SELF when it isn't set, the port uwsgi listens on
+DEFAULT_PEER_PORT = 5000
+
+# requests from peers carry this header and are never forwarded again, even
+# while the nodes disagree about the ring
+FORWARDED_HEADER = "X-ITS-Forwarded"
+
+# responses name the node that served them
+NODE_HEADER = "X-ITS-Node"
+
+FORWARDED_REQUEST_HEADERS = ("If-None-Match", "If-Modified-Since") + HINT_HEADERS
+
+# hop-by-hop headers, and the ones the response is framed with again
+DROPPED_RESPONSE_HEADERS = {
+    "connection",
+    "content-encoding",
+    "content-length",
+    "date",
+    "keep-alive",
+    "server",
+    "transfer-encoding",
+}
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring of peers, each at RING_REPLICAS points.
+    """
+
+    def __init__(self, peers: Iterable[str], replicas: int = RING_REPLICAS) -> None:
+        self.peers = tuple(sorted(set(peers)))
+        points = sorted(
+            (_hash("{peer}#{i}".format(peer=peer, i=i)), peer)
+            for peer in self.peers
+            for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [peer for _, peer in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class PeerResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+_LOCK = threading.Lock()
+_RING = HashRing(PEERS)
+_RING_EXPIRES = 0.0
+_SELF = PEER_SELF
+# monotonic time until which peers that failed are skipped
+_DOWN = {}  # type: Dict[str, float]
+_LOCAL = threading.local()
+
+
+def peering() -> bool:
+    return bool(PEERS or PEERS_DNS)
+
+
+def resolve_peers(address: str) -> List[str]:
+    """
+    The host:port of every IPv4 address the host of `address` resolves to.
+    """
+    host, _, port = address.rpartition(":")
+    infos = socket.getaddrinfo(host, int(port), socket.AF_INET, socket.SOCK_STREAM)
+    return sorted({"{ip}:{port}".format(ip=info[4][0], port=port) for info in infos})
+
+
+def get_ring() -> HashRing:
+    global _RING, _RING_EXPIRES  # pylint: disable=global-statement
+    if not PEERS_DNS:
+        return _RING
+    with _LOCK:
+        if time.monotonic() >= _RING_EXPIRES:
+            try:
+                peers = resolve_peers(PEERS_DNS)
+            except OSError as error:
+                # keep the last ring until the name resolves again
+                LOGGER.warning("failed to resolve peers %s: %s", PEERS_DNS, error)
+                peers = []
+            if peers and tuple(peers) != _RING.peers:
+                _RING = HashRing(peers)
+                METRICS.gauge("peer.count", len(peers))
+            _RING_EXPIRES = time.monotonic() + PEERS_DNS_TTL
+        return _RING
+
+
+def self_address() -> str:
+    global _SELF  # pylint: disable=global-statement
+    if not _SELF:
+        _SELF = "{ip}:{port}".format(
+            ip=socket.gethostbyname(socket.gethostname()), port=DEFAULT_PEER_PORT
+        )
+    return _SELF
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    return headers.get(name) or headers.get(name.lower())
+
+
+def peer_for(
+    namespace: str, filename: str, headers: Mapping[str, str]
+) -> Optional[str]:
+    """
+    The peer that owns a source, or None if this node serves the request:
+    it owns the source, the request comes from a peer, or the owner is down.
+    """
+    if not peering() or _header(headers, FORWARDED_HEADER):
+        return None
+    peer = get_ring().owner("{ns}/{fn}".format(ns=namespace, fn=filename))
+    if peer is None or peer == self_address():
+        return None
+    if _DOWN.get(peer, 0) > time.monotonic():
+        METRICS.incr("peer.fallback")
+        return None
+    return peer
+
+
+def mark_down(peer: str, error: Exception) -> None:
+    LOGGER.warning("peer %s failed, skipping it: %s", peer, error)
+    METRICS.incr("peer.down")
+    _DOWN[peer] = time.monotonic() + PEER_RETRY
+
+
+def get_session() -> requests.Session:
+    # like the http loader, one keep-alive connection pool per thread
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        _LOCAL.session = session
+    return session
+
+
+def _request_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    forwarded = {FORWARDED_HEADER: self_address()}
+    for name in FORWARDED_REQUEST_HEADERS:
+        value = _header(headers, name)
+        if value:
+            forwarded[name] = value
+    return forwarded
+
+
+def _peer_response(
+    status: int, headers: Iterable[tuple], body: bytes
+) -> Optional[PeerResponse]:
+    if status >= 500:
+        # e.g. the peer is overloaded or timed out, the source may still render here
+        METRICS.incr("peer.fallback")
+        return None
+    METRICS.incr("peer.forward")
+    response_headers = {}  # type: Dict[str, str]
+    for name, value in headers:
+        if name.lower() in DROPPED_RESPONSE_HEADERS:
+            continue
+        if name in response_headers:
+            value = response_headers[name] + ", " + value
+        response_headers[name] = value
+    return PeerResponse(status, response_headers, body)
+
+
+def forward(
+    peer: str, target: str, headers: Mapping[str, str]
+) -> Optional[PeerResponse]:
+    """
+    Fetches the response to a request from a peer, `target` being its path and
+    query string. Returns None if the peer failed and the request should be
+    rendered locally.
+    """
+    url = "http://{peer}{target}".format(peer=peer, target=target)
+    try:
+        response = get_session().get(
+            url,
+            headers=_request_headers(headers),
+            timeout=(PEER_CONNECT_TIMEOUT, PEER_TIMEOUT),
+            allow_redirects=False,
+        )
+    except requests.RequestException as error:
+        mark_down(peer, error)
+        METRICS.incr("peer.fallback")
+        return None
+    return _peer_response(
+        response.status_code, response.headers.items(), response.content
+    )
+
+
+def broadcast(target: str, headers: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Sends a POST request, e.g. a purge, to every other peer with the
+    Authorization of the request. Returns how each peer answered, requests
+    from peers aren't broadcast again.
+    """
+    if not peering() or _header(headers, FORWARDED_HEADER):
+        return {}
+    request_headers = {FORWARDED_HEADER: self_address()}
+    authorization = _header(headers, "Authorization")
+    if authorization:
+        request_headers["Authorization"] = authorization
+
+    results = {}
+    for peer in get_ring().peers:
+        if peer == self_address():
+            continue
+        url = "http://{peer}{target}".format(peer=peer, target=target)
+        try:
+            response = get_session().post(
+                url,
+                headers=request_headers,
+                timeout=(PEER_CONNECT_TIMEOUT, PEER_TIMEOUT),
+            )
+        except requests.RequestException as error:
+            LOGGER.warning("failed to send %s to peer %s: %s", target, peer, error)
+            results[peer] = type(error).__name__
+        else:
+            results[peer] = str(response.status_code)
+    return results
+
+
+async def async_forward(
+    peer: str, target: str, headers: Mapping[str, str]
+) -> Optional[PeerResponse]:
+    if not HAS_AIOHTTP:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, forward, peer, target, headers)
+
+    import aiohttp  # pylint: disable=import-outside-toplevel
+
+    url = "http://{peer}{target}".format(peer=peer, target=target)
+    timeout = aiohttp.ClientTimeout(total=PEER_TIMEOUT, connect=PEER_CONNECT_TIMEOUT)
+    try:
+        async with get_async_session().get(
+            url,
+            headers=_request_headers(headers),
+            timeout=timeout,
+            allow_redirects=False,
+        ) as response:
+            body = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        mark_down(peer, error)
+        METRICS.incr("peer.fallback")
+        return None
+    return _peer_response(response.status, response.headers.items(), body)
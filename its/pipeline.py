@@ -1,13 +1,16 @@
 """
 Script to apply transformations to validated images.
 """
+
 import re
 from io import BytesIO
 from typing import Dict, Union
 
+from PIL import Image
 from PIL.JpegImagePlugin import JpegImageFile
 from PIL.PngImagePlugin import PngImageFile
 
+from .resampling import get_resampling
 from .transformations import (
     BlurTransform,
     FitTransform,
@@ -15,6 +18,9 @@ from .transformations import (
     ResizeTransform,
 )
 
+# everything up to the extension of a filename
+FILENAME_PREFIX_RE = re.compile(r".+?(\.)", re.IGNORECASE)
+
 
 def process_transforms(
     img: Union[JpegImageFile, PngImageFile, BytesIO], query: Dict[str, str]
@@ -26,25 +32,31 @@ def process_transforms(
     if not query:  # no transforms; return image as is
         return img
 
-    if isinstance(img, BytesIO):  # SVG, return image as is
+    if not isinstance(img, Image.Image):  # SVG, return image as is
         return img
 
     if query.get("crop"):
         query["fit"] = query.pop("crop")
 
     img_info = img.info
-    transform_order = [BlurTransform, ResizeTransform, FitTransform, OverlayTransform]
+    # blurs run on the resized image, with fewer pixels to blur, and their
+    # radius scaled to look the same as a blur of the source
+    transform_order = [ResizeTransform, FitTransform, BlurTransform, OverlayTransform]
+    # drafts and pyramid levels are smaller than the source radii refer to
+    source_width, source_height = img_info.get("source_size", img.size)
+    resampling = get_resampling(img_info.get("namespace", ""), query.get("resample"))
 
     # loop through the order dict and apply the transforms
     for transform in transform_order:
         slug = transform.slug
         if slug in query:
             parameters = transform.derive_parameters(query[slug])
-            img = transform().apply_transform(img, parameters)
+            scale = max(img.width / source_width, img.height / source_height)
+            img = transform().apply_transform(img, parameters, resampling, scale)
 
     if img.format is None and "filename" in img_info.keys():
         # attempt to grab the filetype from the filename
-        file_type = re.sub(r".+?(\.)", "", img_info["filename"], flags=re.IGNORECASE)
+        file_type = FILENAME_PREFIX_RE.sub("", img_info["filename"])
         if file_type.lower() == "jpg" or file_type.lower() == "jpeg":
             img.format = "JPEG"
         else:
@@ -0,0 +1,206 @@
+"""
+Tiny blurred previews of sources that pages show while the real image loads,
+as a data URI and a BlurHash (https://blurha.sh), from a draft decode or the
+smallest level of a cached pyramid instead of a full render.
+"""
+
+import base64
+from io import BytesIO
+from math import cos, floor, pi
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageFilter
+
+from .cache import LRUCache, source_tags
+from .errors import ITSClientError
+from .focal_point import PROXY_SIZE
+from .info import thumbnail
+from .loader import loader
+from .settings import INFO_TTL, MIME_TYPES, PLACEHOLDER_SIZE
+from .source_cache import SOURCE_CACHE, source_key
+from .transformations import FitTransform
+
+# placeholders of recent sources, by source identity and crop
+PLACEHOLDER_CACHE = LRUCache("placeholder", 4096)
+
+# blur radius in placeholder pixels, hides the blocks browsers upscale
+PLACEHOLDER_BLUR = 1
+
+PLACEHOLDER_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+_SRGB_TO_LINEAR = [
+    value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+    for value in (i / 255 for i in range(256))
+]
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(
+        BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1)
+    )
+
+
+def _linear_to_srgb(value: float) -> int:
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_sqrt(value: float) -> float:
+    return value ** 0.5 if value >= 0 else -((-value) ** 0.5)
+
+
+def blurhash(image: Image.Image, components: Tuple[int, int] = (4, 3)) -> str:
+    """
+    BlurHash of a small RGB image, with `components` cosines across and down.
+    """
+    width, height = image.size
+    components_x, components_y = components
+    pixels = [tuple(_SRGB_TO_LINEAR[c] for c in rgb) for rgb in image.getdata()]
+    cos_x = [
+        [cos(pi * i * x / width) for x in range(width)] for i in range(components_x)
+    ]
+    cos_y = [
+        [cos(pi * j * y / height) for y in range(height)] for j in range(components_y)
+    ]
+
+    factors = []  # type: List[Tuple[float, float, float]]
+    for j in range(components_y):
+        for i in range(components_x):
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            red = green = blue = 0.0
+            for y in range(height):
+                row = y * width
+                basis_y = cos_y[j][y] * scale
+                for x in range(width):
+                    basis = cos_x[i][x] * basis_y
+                    r, g, b = pixels[row + x]
+                    red += basis * r
+                    green += basis * g
+                    blue += basis * b
+            factors.append((red, green, blue))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((components_x - 1) + (components_y - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(value) for factor in ac for value in factor)
+        quantised_max = max(0, min(82, floor(actual_max * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1
+    result += _encode83(quantised_max, 1)
+
+    red, green, blue = (_linear_to_srgb(value) for value in dc)
+    result += _encode83((red << 16) + (green << 8) + blue, 4)
+    for factor in ac:
+        red, green, blue = (
+            max(0, min(18, floor(_sign_sqrt(value / maximum) * 9 + 9.5)))
+            for value in factor
+        )
+        result += _encode83(red * 19 * 19 + green * 19 + blue, 2)
+    return result
+
+
+def placeholder_query(query: Dict[str, str]) -> Dict[str, str]:
+    """
+    The parameters of a placeholder request that change it: the crop, so the
+    placeholder has the shape of the rendition, and the format.
+    """
+    if query["placeholder"]:
+        raise ITSClientError("placeholder takes no value")
+    fmt = query.get("format", "").lower()
+    if fmt and fmt not in PLACEHOLDER_FORMATS:
+        raise ITSClientError(
+            "placeholders are one of {}".format(", ".join(PLACEHOLDER_FORMATS))
+        )
+    return {key: query[key] for key in ("placeholder", "fit", "format") if key in query}
+
+
+def _source_thumbnail(
+    namespace: str, filename: str, validator: Optional[str]
+) -> Image.Image:
+    pyramid = SOURCE_CACHE.get(source_key(namespace, filename, validator))
+    if pyramid is not None:
+        level = pyramid.level_for((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        # levels are shared with other requests, never change them in place
+        scale = min(PROXY_SIZE / max(level.size), 1)
+        small = level.resize(
+            (max(round(level.width * scale), 1), max(round(level.height * scale), 1)),
+            Image.BOX,
+        )
+        if small.mode not in ("RGB", "RGBA"):
+            small = small.convert("RGB")
+    else:
+        image = loader(namespace, filename)
+        if not isinstance(image, Image.Image):
+            raise ITSClientError("{fn} is passed through as is".format(fn=filename))
+        small = thumbnail(image)
+    small.info.update(filename=filename, namespace=namespace)
+    return small
+
+
+def _fit(image: Image.Image, fit: str) -> Image.Image:
+    parameters = FitTransform.derive_parameters(fit)
+    try:
+        width, height = int(parameters[0]), int(parameters[1])
+        scale = PLACEHOLDER_SIZE / max(width, height)
+    except (ValueError, IndexError, ZeroDivisionError):
+        raise ITSClientError("crop requires a width and a height")
+    size = [str(max(round(width * scale), 1)), str(max(round(height * scale), 1))]
+    return FitTransform.apply_transform(image, size + list(parameters[2:]))
+
+
+def _source_placeholder(
+    namespace: str, filename: str, validator: Optional[str], query: Dict[str, str]
+) -> Dict[str, Any]:
+    small = _source_thumbnail(namespace, filename, validator)
+    if "fit" in query:
+        small = _fit(small, query["fit"])
+    else:
+        small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BOX)
+    small = small.filter(ImageFilter.GaussianBlur(PLACEHOLDER_BLUR))
+
+    alpha = small.mode == "RGBA"
+    fmt = PLACEHOLDER_FORMATS.get(query.get("format", "").lower())
+    if fmt is None:
+        fmt = "PNG" if alpha else "JPEG"
+    output = BytesIO()
+    if fmt == "JPEG":
+        small.convert("RGB").save(output, fmt, quality=60, optimize=True)
+    else:
+        small.save(output, fmt)
+
+    # transparent pixels hash like the white a page usually has under them
+    if alpha:
+        opaque = Image.new("RGB", small.size, "white")
+        opaque.paste(small, mask=small.getchannel("A"))
+    else:
+        opaque = small.convert("RGB")
+    components = (4, 3) if small.width >= small.height else (3, 4)
+
+    return {
+        "width": small.width,
+        "height": small.height,
+        "data_uri": "data:{mime};base64,{data}".format(
+            mime=MIME_TYPES[fmt], data=base64.b64encode(output.getvalue()).decode()
+        ),
+        "blurhash": blurhash(opaque, components),
+    }
+
+
+def source_placeholder(
+    namespace: str, filename: str, validator: Optional[str], query: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Placeholder of a source or, with a fit in the query, of the crop: its size,
+    the image as a data URI and its BlurHash. Cached like the info of sources.
+    """
+    return PLACEHOLDER_CACHE.get_or_set(
+        (namespace, filename, validator, tuple(sorted(query.items()))),
+        lambda: _source_placeholder(namespace, filename, validator, query),
+        ttl=None if validator else INFO_TTL,
+        tags=source_tags(namespace, filename),
+    )
@@ -0,0 +1,246 @@
+"""
+Renders the renditions listed in a manifest ahead of time, e.g. before a
+launch, and writes them to the derivative store (ITS_DERIVATIVE_STORE) that
+the servers read before rendering anything themselves.
+
+    python -m its.prerender manifest.jsonl --processes 8
+
+Every line of the manifest is either a url path or a JSON object:
+
+    /namespace/image.jpg?resize=320x
+    {"url": "/namespace/image.jpg?fit=640x360&format=webp"}
+    {"namespace": "namespace", "filename": "image.jpg", "renditions": ["resize=320x"]}
+
+Renditions of one source are rendered from a single decode.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from PIL import Image
+
+from .application import _parse_rendition
+from .derivative_store import DerivativeStore, create_derivative_store
+from .errors import ITSClientError
+from .loader import get_image_loader, loader
+from .render import render_renditions, source_bytes
+from .render_cache import Rendition, canonical_query, render_key
+from .settings import DERIVATIVE_STORE, NAMESPACES
+
+LOGGER = logging.getLogger(__name__)
+
+Source = Tuple[str, str]
+
+_STORE = None  # type: Optional[DerivativeStore]
+
+
+class SourceReport(NamedTuple):
+    namespace: str
+    filename: str
+    rendered: int = 0
+    skipped: int = 0
+    source_bytes: int = 0
+    rendered_bytes: int = 0
+    error: Optional[str] = None
+
+
+def parse_manifest(lines: Iterable[str]) -> Dict[Source, List[Dict[str, str]]]:
+    """
+    Returns the distinct queries of every source listed in a manifest,
+    in the order they're listed.
+    """
+    sources = OrderedDict()  # type: Dict[Source, Dict[str, Dict[str, str]]]
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            entry = json.loads(line) if line.startswith("{") else {"url": line}
+            if "url" in entry:
+                url = urlsplit(entry["url"])
+                namespace, _, filename = unquote(url.path).lstrip("/").partition("/")
+                # query strings or objects, like the renditions of a batch
+                renditions = [url.query]  # type: List[Any]
+            else:
+                namespace, filename = entry["namespace"], entry["filename"]
+                renditions = entry.get("renditions") or [entry.get("query", "")]
+            queries = [_parse_rendition(rendition) for rendition in renditions]
+        except (ValueError, KeyError, TypeError, ITSClientError) as error:
+            raise ValueError("line {}: {!r} ({})".format(number, line, error))
+        if not namespace or not filename:
+            raise ValueError("line {}: {!r} has no image path".format(number, line))
+
+        distinct = sources.setdefault((namespace, filename), OrderedDict())
+        for query in queries:
+            distinct[canonical_query(query)] = query
+
+    return OrderedDict(
+        (source, list(queries.values())) for source, queries in sources.items()
+    )
+
+
+def _init_worker(location: str) -> None:
+    global _STORE  # pylint: disable=global-statement
+    _STORE = create_derivative_store(location)
+
+
+def prerender_source(
+    source: Source, queries: List[Dict[str, str]], force: bool = False
+) -> SourceReport:
+    """
+    Renders the queries of a source that aren't stored yet and stores them.
+    """
+    store = _STORE
+    assert store is not None, "the worker's derivative store isn't initialised"
+    namespace, filename = source
+    report = SourceReport(namespace, filename)
+    try:
+        if namespace not in NAMESPACES or NAMESPACES[namespace].get("redirect"):
+            raise ITSClientError("{ns} doesn't render images".format(ns=namespace))
+
+        validators = get_image_loader(namespace).get_validators(namespace, filename)
+        keys = [
+            render_key(namespace, filename, query, validators and validators[0])
+            for query in queries
+        ]
+        missing = [
+            (key, query)
+            for key, query in zip(keys, queries)
+            if force or store.get(key) is None
+        ]
+        report = report._replace(skipped=len(queries) - len(missing))
+        if not missing:
+            return report
+
+        image = loader(namespace, filename)
+        if not isinstance(image, Image.Image):
+            raise ITSClientError("{fn} is passed through as is".format(fn=filename))
+        size = len(source_bytes(image))
+
+        renditions = render_renditions(
+            image, [query for _, query in missing], namespace, filename
+        )
+        for (key, _), (output, mime_type, _) in zip(missing, renditions):
+            store.put(key, Rendition(output.getvalue(), mime_type))
+
+        return report._replace(
+            rendered=len(renditions),
+            source_bytes=size * len(renditions),
+            rendered_bytes=sum(len(output.getbuffer()) for output, _, _ in renditions),
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.debug("failed to prerender %s/%s", namespace, filename, exc_info=True)
+        return report._replace(error="{}: {}".format(type(error).__name__, error))
+
+
+def _prerender(job: Tuple[Source, List[Dict[str, str]], bool]) -> SourceReport:
+    return prerender_source(*job)
+
+
+def prerender(
+    sources: Dict[Source, List[Dict[str, str]]],
+    location: str,
+    processes: int = 1,
+    force: bool = False,
+) -> Iterable[SourceReport]:
+    """
+    Yields the report of every source as soon as it is rendered.
+    """
+    jobs = [(source, queries, force) for source, queries in sources.items()]
+    if processes <= 1:
+        _init_worker(location)
+        for job in jobs:
+            yield _prerender(job)
+        return
+
+    with Pool(processes, initializer=_init_worker, initargs=(location,)) as pool:
+        yield from pool.imap_unordered(_prerender, jobs)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("manifest", help="manifest file, - reads standard input")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--store",
+        default=DERIVATIVE_STORE,
+        help="file:// or s3:// url, defaults to ITS_DERIVATIVE_STORE",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="render renditions that are stored"
+    )
+    parser.add_argument("--verbose", action="store_true", help="log debug messages")
+    args = parser.parse_args(argv)
+
+    # the application logs every request at debug level
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    if not args.store:
+        parser.error("there is nowhere to store renditions, set ITS_DERIVATIVE_STORE")
+
+    if args.manifest == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.manifest) as manifest:
+            lines = manifest.readlines()
+    try:
+        sources = parse_manifest(lines)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.monotonic()
+    totals = SourceReport("", "")
+    failed = 0
+    for report in prerender(sources, args.store, args.processes, args.force):
+        if report.error:
+            failed += 1
+            print(
+                "failed {ns}/{fn}: {error}".format(
+                    ns=report.namespace, fn=report.filename, error=report.error
+                ),
+                file=sys.stderr,
+            )
+        totals = totals._replace(
+            rendered=totals.rendered + report.rendered,
+            skipped=totals.skipped + report.skipped,
+            source_bytes=totals.source_bytes + report.source_bytes,
+            rendered_bytes=totals.rendered_bytes + report.rendered_bytes,
+        )
+    elapsed = time.monotonic() - start
+
+    saved = totals.source_bytes - totals.rendered_bytes
+    print(
+        "rendered {rendered} renditions of {sources} sources in {elapsed:.1f}s "
+        "({rate:.1f}/s), {skipped} were already stored, {failed} sources failed".format(
+            rendered=totals.rendered,
+            sources=len(sources),
+            elapsed=elapsed,
+            rate=totals.rendered / elapsed if elapsed else 0,
+            skipped=totals.skipped,
+            failed=failed,
+        )
+    )
+    print(
+        "stored {stored:.1f} MB, {saved:.1f} MB ({percent:.0f}%) less than "
+        "serving the sources".format(
+            stored=totals.rendered_bytes / 2 ** 20,
+            saved=saved / 2 ** 20,
+            percent=100 * saved / totals.source_bytes if totals.source_bytes else 0,
+        )
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Purges everything derived from a source after it was replaced at the same
+path, or from every source in a folder: pyramids, renditions, focal points,
+info and placeholders kept in memory, and renditions in the derivative store.
+Entries are tagged with their source and its folders, so a purge only touches
+the entries it removes.
+
+    python -m its.purge namespace/image.jpg namespace/folder/
+
+Run here, it purges the derivative store and the workers of this node that
+share ITS_PURGE_LOG. With --url, it asks a server to purge, which purges its
+peers too.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+from .derivative_store import get_derivative_store
+from .errors import ITSClientError
+from .focal_point import FOCAL_POINTS
+from .info import INFO_CACHE
+from .placeholder import PLACEHOLDER_CACHE
+from .render_cache import RENDER_CACHE
+from .settings import ADMIN_TOKEN, LOADER_TIMEOUT, NAMESPACES, PURGE_LOG
+from .source_cache import SOURCE_CACHE, SOURCE_REQUESTS
+from .transformations.overlay import OVERLAY_CACHE
+
+LOGGER = logging.getLogger(__name__)
+
+PURGED_CACHES = (
+    SOURCE_CACHE,
+    SOURCE_REQUESTS,
+    RENDER_CACHE,
+    FOCAL_POINTS,
+    INFO_CACHE,
+    PLACEHOLDER_CACHE,
+    OVERLAY_CACHE,
+)
+
+# seconds between two reads of the purge log by a worker
+PURGE_LOG_INTERVAL = 1.0
+
+_LOG_LOCK = threading.Lock()
+_LOG_OFFSET = None  # type: Optional[int]
+_LOG_CHECKED = 0.0
+
+
+def purge_tag(namespace: str, path: str) -> str:
+    """
+    The tag of a source, or of a folder if `path` ends with a slash or is empty.
+    """
+    if namespace not in NAMESPACES:
+        raise ITSClientError(
+            "{namespace} is not a configured namespace".format(namespace=namespace)
+        )
+    path = path.strip("/") + ("/" if not path or path.endswith("/") else "")
+    return "{ns}/{path}".format(ns=namespace, path=path).replace("//", "/")
+
+
+def purge_memory(tag: str) -> Dict[str, int]:
+    return {cache.name: cache.purge(tag) for cache in PURGED_CACHES}
+
+
+def purge(tag: str, shared: bool = True) -> Dict[str, int]:
+    """
+    Purges a tag from the memory of this worker and, through the purge log, of
+    the other workers of the node, and from the derivative store if `shared`.
+    Returns the number of entries removed from each.
+    """
+    counts = purge_memory(tag)
+    if PURGE_LOG:
+        # appends this small are atomic, workers never read half a line
+        with open(PURGE_LOG, "a") as log:
+            log.write(tag + "\n")
+    store = get_derivative_store()
+    if shared and store is not None:
+        counts["derivative_store"] = store.purge(tag)
+    LOGGER.info("purged %s: %s", tag, counts)
+    return counts
+
+
+def worker_processes() -> int:
+    """
+    Number of worker processes of this node, as far as uwsgi tells.
+    """
+    try:
+        import uwsgi  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return 1
+    return uwsgi.numproc
+
+
+def check_purge_log() -> None:
+    """
+    Warns when purges can't reach the other workers of the node, which keep
+    serving what was purged until it expires.
+    """
+    processes = worker_processes()
+    if processes > 1 and not PURGE_LOG:
+        LOGGER.warning(
+            "ITS_PURGE_LOG isn't set, purges only clear the memory of the worker "
+            "that handles them, not of the %s others",
+            processes - 1,
+        )
+
+
+def sync_purges() -> None:
+    """
+    Purges what the other workers logged since the last call, checking the log
+    at most every PURGE_LOG_INTERVAL seconds.
+    """
+    global _LOG_OFFSET, _LOG_CHECKED  # pylint: disable=global-statement
+    if not PURGE_LOG or time.monotonic() < _LOG_CHECKED + PURGE_LOG_INTERVAL:
+        return
+
+    with _LOG_LOCK:
+        if time.monotonic() < _LOG_CHECKED + PURGE_LOG_INTERVAL:
+            return
+        _LOG_CHECKED = time.monotonic()
+        try:
+            size = os.path.getsize(PURGE_LOG)
+        except FileNotFoundError:
+            size = 0
+        if _LOG_OFFSET is None:
+            # nothing was cached before the first request
+            _LOG_OFFSET = size
+        elif size < _LOG_OFFSET:
+            # the log was rotated
+            _LOG_OFFSET = 0
+        if size == _LOG_OFFSET:
+            return
+
+        with open(PURGE_LOG, "rb") as log:
+            log.seek(_LOG_OFFSET)
+            data = log.read(size - _LOG_OFFSET)
+        complete = data[: data.rfind(b"\n") + 1]
+        _LOG_OFFSET += len(complete)
+        for tag in complete.decode("utf-8").splitlines():
+            purge_memory(tag)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "sources", nargs="+", help="namespace/path of a source, or of a folder/"
+    )
+    parser.add_argument(
+        "--url", help="server to purge through, with ITS_ADMIN_TOKEN, e.g. http://its"
+    )
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for source in args.sources:
+        namespace, _, path = source.strip("/").partition("/")
+        if source.endswith("/") and path:
+            path += "/"
+        try:
+            if args.url:
+                response = requests.post(
+                    "{url}/admin/purge/{ns}/{path}".format(
+                        url=args.url.rstrip("/"), ns=namespace, path=path
+                    ),
+                    headers={"Authorization": "Bearer " + ADMIN_TOKEN},
+                    timeout=LOADER_TIMEOUT,
+                )
+                response.raise_for_status()
+                result = response.json()
+            else:
+                result = purge(purge_tag(namespace, path))
+        except (ITSClientError, requests.RequestException) as error:
+            failed += 1
+            print(
+                "failed {source}: {error}".format(source=source, error=error),
+                file=sys.stderr,
+            )
+            continue
+        print("{source}: {result}".format(source=source, result=json.dumps(result)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Image pyramid: successively halved copies of a decoded source, so several
+renditions of one source can each be resampled from a nearby level instead
+of from the full resolution image.
+"""
+
+import threading
+from math import ceil
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+# levels are only used while they're at least this many times larger than the
+# rendition, so resampling down from them looks the same as from the source
+LEVEL_MARGIN = 2
+
+# modes whose box-filtered halves are as good as the source
+PYRAMID_MODES = ("L", "LA", "RGB", "RGBA")
+
+
+class Pyramid:
+    """
+    Levels of a decoded image, built on demand. Level 0 is the image itself.
+    """
+
+    def __init__(self, image: Image.Image) -> None:
+        self.levels = [image]  # type: List[Image.Image]
+        # cached pyramids are shared by the request threads
+        self._lock = threading.Lock()
+
+    @property
+    def base(self) -> Image.Image:
+        return self.levels[0]
+
+    def _half(self, image: Image.Image) -> Image.Image:
+        level = image.resize((ceil(image.width / 2), ceil(image.height / 2)), Image.BOX)
+        # transforms rely on the format and the filename of their input
+        level.format = image.format
+        level.info = dict(image.info)
+        return level
+
+    def level_for(self, size: Optional[Tuple[int, int]]) -> Image.Image:
+        """
+        Smallest level that is still LEVEL_MARGIN times larger than `size`,
+        the base image if size is None.
+        """
+        if size is None or self.base.mode not in PYRAMID_MODES:
+            return self.base
+
+        width, height = size
+        index = 0
+        while True:
+            image = self.levels[index]
+            half_width, half_height = ceil(image.width / 2), ceil(image.height / 2)
+            if half_width < width * LEVEL_MARGIN or half_height < height * LEVEL_MARGIN:
+                return image
+            with self._lock:
+                if index + 1 == len(self.levels):
+                    self.levels.append(self._half(image))
+            index += 1
+
+    def nbytes(self) -> int:
+        return sum(
+            level.width * level.height * len(level.getbands()) for level in self.levels
+        )
+
+    def max_nbytes(self) -> int:
+        """
+        Bytes held once every level is built, the halves add up to 1/3 of the base.
+        """
+        base = self.base
+        return ceil(base.width * base.height * len(base.getbands()) * 4 / 3)
@@ -0,0 +1,275 @@
+"""
+Script to turn a loaded source image into the encoded bytes of a response.
+"""
+
+import logging
+from io import BytesIO
+from math import ceil, floor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .deadline import Deadline, deadline_scope, get_deadline
+from .loader import image_errors
+from .normalize import NormalizationError, normalize
+from .optimize import optimize
+from .pipeline import process_transforms
+from .pyramid import LEVEL_MARGIN, Pyramid
+from .settings import MIME_TYPES
+from .transformations import FitTransform
+from .transformations.fit import fit_region
+from .util import DELIMITERS, validate_image_type
+
+LOGGER = logging.getLogger(__name__)
+
+
+def draft_size(
+    image: Image.Image, query: Dict[str, str], margin: float = 1
+) -> Optional[Tuple[int, int]]:
+    """
+    Smallest source size the first resize or fit of a query needs, `margin`
+    times larger, or None if it needs the full resolution.
+    """
+    # crops are fits, see process_transforms
+    for slug in ("resize", "fit", "crop"):
+        if slug in query:
+            break
+    else:
+        return None
+
+    try:
+        width, height = [
+            int(value) if value else None
+            for value in DELIMITERS.split(query[slug])[:2]
+        ]
+    except ValueError:
+        return None
+
+    ratios = []
+    if width:
+        ratios.append(width / image.width)
+    if height:
+        ratios.append(height / image.height)
+    if not ratios:
+        return None
+
+    # resize fits the image inside the box, fit covers the whole box
+    scale = (min(ratios) if slug == "resize" else max(ratios)) * margin
+    if scale >= 1:
+        return None
+
+    return ceil(image.width * scale), ceil(image.height * scale)
+
+
+def query_region(
+    image: Image.Image, query: Dict[str, str], namespace: str, filename: str
+) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Box of a source the first transform of a query keeps when it is a fit,
+    or None if the query needs all of the source.
+    """
+    if "resize" in query:
+        return None
+    parameters = query.get("fit") or query.get("crop")
+    if not parameters:
+        return None
+    return fit_region(
+        image.size, FitTransform.derive_parameters(parameters), namespace, filename
+    )
+
+
+def _crop_region(
+    image: Image.Image,
+    source_size: Tuple[int, int],
+    region: Tuple[float, float, float, float],
+) -> Tuple[Image.Image, Optional[Tuple[float, float, float, float]]]:
+    """
+    Cuts out the pixels of a (drafted) source that cover a region of it, in
+    source pixels. Returns them and the region of the source they cover, or
+    the image as is and None if the region is all of it.
+    """
+    scale_x = image.width / source_size[0]
+    scale_y = image.height / source_size[1]
+    box = (
+        floor(region[0] * scale_x),
+        floor(region[1] * scale_y),
+        min(image.width, ceil(region[2] * scale_x)),
+        min(image.height, ceil(region[3] * scale_y)),
+    )
+    if box == (0, 0) + image.size:
+        return image, None
+
+    cropped = image.crop(box)
+    cropped.format = image.format
+    return (
+        cropped,
+        (box[0] / scale_x, box[1] / scale_y, box[2] / scale_x, box[3] / scale_y),
+    )
+
+
+def decode(
+    image: Image.Image,
+    namespace: str,
+    filename: str,
+    size: Optional[Tuple[int, int]] = None,
+    region: Optional[Tuple[float, float, float, float]] = None,
+) -> Image.Image:
+    """
+    Normalizes a lazily decoded source image, JPEGs are decoded at a reduced
+    scale that is still at least `size` if given. Only the `region` of the
+    source is kept if given, before it is normalized.
+    """
+    # transforms whose parameters are in source pixels need the original size
+    source_size = image.size
+    if size and image.format == "JPEG":
+        # let libjpeg decode at 1/2, 1/4 or 1/8 scale
+        image.draft(image.mode, size)
+    if region is not None:
+        image, region = _crop_region(image, source_size, region)
+
+    try:
+        image = normalize(image)
+    except NormalizationError as err:
+        LOGGER.warning("failed to normalize %s/%s: %s", namespace, filename, err)
+    image.info["filename"] = filename
+    image.info["namespace"] = namespace
+    image.info["source_size"] = source_size
+    if region is not None:
+        image.info["source_region"] = region
+    return image
+
+
+def finish(
+    image: Image.Image, query: Dict[str, str]
+) -> Tuple[Image.Image, str, Dict[str, Any]]:
+    """
+    Transforms and optimizes a decoded image. Returns the image to encode,
+    its mime type and the options to save it with.
+    """
+    result = process_transforms(image, query)
+
+    # image conversion and compression
+    # cache result
+    result = optimize(result, query)
+
+    if result.format is None:
+        result.format = image.format
+
+    mime_type = MIME_TYPES[result.format.upper()]
+
+    options = {"format": result.format.upper()}  # type: Dict[str, Any]
+    if result.format.upper() in ("JPEG", "JPG") and not get_deadline().should_degrade():
+        options.update(progressive=True, optimize=True)
+
+    return result, mime_type, options
+
+
+def prepare(
+    image: Image.Image, query: Dict[str, str], namespace: str, filename: str
+) -> Tuple[Image.Image, str, Dict[str, Any]]:
+    """
+    Decodes, normalizes, transforms and optimizes a source image.
+    Returns the image to encode, its mime type and the options to save it with.
+
+    Fits only normalize and transform the region of the source they keep, and
+    JPEGs are decoded at the scale of the fit, like pyramid levels.
+    """
+    region = query_region(image, query, namespace, filename)
+    size = None
+    if image.format == "JPEG":
+        # only JPEGs can be drafted, other formats don't degrade here
+        degrade = get_deadline().should_degrade()
+        if degrade or region is not None:
+            size = draft_size(image, query, margin=1 if degrade else LEVEL_MARGIN)
+
+    image = decode(image, namespace, filename, size, region)
+    return finish(image, query)
+
+
+def render(
+    image: Image.Image, query: Dict[str, str], namespace: str, filename: str
+) -> Tuple[BytesIO, str]:
+    """
+    Decodes, normalizes, transforms, optimizes and encodes a source image.
+    Returns the encoded image and its mime type.
+    """
+    result, mime_type, options = prepare(image, query, namespace, filename)
+
+    output = BytesIO()
+    result.save(output, **options)
+
+    return output, mime_type
+
+
+def prepare_pyramid(
+    pyramid: Pyramid, query: Dict[str, str]
+) -> Tuple[Image.Image, str, Dict[str, Any]]:
+    """
+    Same as prepare, but resamples from the smallest level of a pyramid of
+    the decoded source that is still large enough for the query.
+    """
+    source = pyramid.level_for(draft_size(pyramid.base, query))
+    return finish(source, dict(query))
+
+
+def render_pyramid(pyramid: Pyramid, query: Dict[str, str]) -> Tuple[BytesIO, str]:
+    result, mime_type, options = prepare_pyramid(pyramid, query)
+
+    output = BytesIO()
+    result.save(output, **options)
+
+    return output, mime_type
+
+
+def render_renditions(
+    image: Image.Image, queries: List[Dict[str, str]], namespace: str, filename: str
+) -> List[Tuple[BytesIO, str, Tuple[int, int]]]:
+    """
+    Renders several queries from a single decode of a source image.
+    Each rendition is resampled from the smallest level of an image pyramid
+    that is still large enough for it. Returns the encoded images, their
+    mime types and sizes.
+    """
+    image = decode(image, namespace, filename)
+    image.load()
+    pyramid = Pyramid(image)
+
+    renditions = []
+    for query in queries:
+        result, mime_type, options = prepare_pyramid(pyramid, query)
+        output = BytesIO()
+        result.save(output, **options)
+        renditions.append((output, mime_type, result.size))
+
+    return renditions
+
+
+def source_bytes(image: Image.Image) -> bytes:
+    """
+    Returns the raw bytes a lazily decoded source image was opened from.
+    """
+    file_obj = image.fp
+    if hasattr(file_obj, "getvalue"):
+        return file_obj.getvalue()
+    file_obj.seek(0)
+    return file_obj.read()
+
+
+def render_bytes(
+    source: bytes,
+    query: Dict[str, str],
+    namespace: str,
+    filename: str,
+    budget: Optional[float] = None,
+) -> Tuple[bytes, str, bool]:
+    """
+    Same as render, but takes and returns plain bytes so it can run in a
+    process pool. `budget` is the time the request has left, the returned
+    flag tells whether the render had to be degraded to meet it.
+    """
+    with deadline_scope(Deadline(budget)) as deadline:
+        with image_errors(namespace, filename):
+            image = Image.open(BytesIO(source))
+            validate_image_type(image)
+        output, mime_type = render(image, query, namespace, filename)
+    return output.getvalue(), mime_type, deadline.degraded
@@ -0,0 +1,52 @@
+"""
+In-memory cache of encoded renditions, shared by the request threads of a
+worker and disabled unless ITS_RENDER_CACHE_BYTES is set.
+"""
+
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+from .cache import LRUCache, source_tags
+from .settings import DEGRADED_MAX_AGE, RENDER_CACHE_BYTES, RENDER_CACHE_TTL
+
+
+class Rendition(NamedTuple):
+    body: bytes
+    mime_type: str
+    degraded: bool = False
+
+
+RENDER_CACHE = LRUCache(
+    "render", RENDER_CACHE_BYTES, sizeof=lambda rendition: len(rendition.body)
+)
+
+
+def canonical_query(query: Dict[str, str]) -> str:
+    return urlencode(sorted(query.items()))
+
+
+def render_key(
+    namespace: str, filename: str, query: Dict[str, str], validator: Optional[str]
+) -> str:
+    """
+    Cache key of a rendition. Sources whose loader has validators are keyed by
+    their version too, so a changed source is never served from the cache.
+    """
+    return "{ns}/{fn}?{query}#{validator}".format(
+        ns=namespace,
+        fn=filename,
+        query=canonical_query(query),
+        validator=validator or "",
+    )
+
+
+def render_key_tags(key: str) -> Tuple[str, ...]:
+    # render keys start with the path of their source, which never has a "?"
+    namespace, _, filename = key.partition("?")[0].partition("/")
+    return source_tags(namespace, filename)
+
+
+def cache_rendition(key: str, rendition: Rendition) -> None:
+    # degraded renditions are replaced by a full quality one soon
+    ttl = DEGRADED_MAX_AGE if rendition.degraded else RENDER_CACHE_TTL
+    RENDER_CACHE.set(key, rendition, ttl=ttl, tags=render_key_tags(key))
@@ -0,0 +1,313 @@
+"""
+Pool of pre-forked render processes.
+
+Decoding, normalizing, transforming and encoding run in a separate process so a
+pathological image can be killed when it misses its deadline without taking
+down the worker that serves the request (and its warm caches). Source and
+encoded bytes travel through a shared memory slot per process, only the query
+and small status messages are pickled.
+
+Render processes are forked by a forkserver, a single-threaded process started
+with the pool, rather than by the worker: a child forked from a threaded worker
+inherits whatever locks its other threads hold at that moment (logging
+handlers, metrics, caches) and can deadlock on them. Processes that are killed
+are replaced by a supervisor thread, so requests never wait on a new process.
+"""
+import logging
+import logging.config
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import tempfile
+import threading
+import time
+from io import BytesIO
+from multiprocessing import reduction
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from .deadline import Deadline, deadline_scope, get_deadline
+from .errors import ITSError, ITSRenderTimeoutError
+from .loader import image_errors
+from .metrics import METRICS
+from .render import render, source_bytes
+from .settings import LOGGING, RENDER_SLOT_BYTES, RENDER_TIMEOUT
+from .util import validate_image_type
+
+LOGGER = logging.getLogger(__name__)
+
+PROCESS_NAME = "its-render"
+
+# sizes sent in place of a slot length when the bytes didn't fit in the slot
+# and follow on the pipe instead
+OVERFLOW = -1
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def _portable_error(error: Exception) -> Tuple[Exception, Optional[int]]:
+    try:
+        # make sure the error survives the trip back to the front-end worker
+        pickle.dumps(error)
+    except Exception:  # pylint: disable=broad-except
+        error = ITSError(repr(error), status_code=500)
+    return error, getattr(error, "status_code", None)
+
+
+def _serve(conn) -> None:
+    """
+    Main loop of a render process.
+    """
+    # the front-end worker decides when render processes stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.config.dictConfig(LOGGING)
+
+    # typeshed declares recv_handle without its return value, the descriptor
+    slot_fd = reduction.recv_handle(conn)  # type: ignore
+    slot = mmap.mmap(slot_fd, 0)
+    os.close(slot_fd)
+
+    while True:
+        try:
+            size, query, namespace, filename, budget = conn.recv()
+            source = conn.recv_bytes() if size == OVERFLOW else slot[:size]
+        except EOFError:
+            return
+
+        deadline = Deadline(budget)
+        try:
+            with deadline_scope(deadline):
+                with image_errors(namespace, filename):
+                    image = Image.open(BytesIO(source))
+                    validate_image_type(image)
+                output, mime_type = render(image, query, namespace, filename)
+        except Exception as error:  # pylint: disable=broad-except
+            conn.send(("error",) + _portable_error(error))
+            continue
+
+        encoded = output.getbuffer()
+        if len(encoded) <= len(slot):
+            slot[: len(encoded)] = encoded
+            conn.send(("ok", len(encoded), mime_type, deadline.degraded))
+        else:
+            conn.send(("ok", OVERFLOW, mime_type, deadline.degraded))
+            conn.send_bytes(encoded)
+        del encoded
+
+
+class RenderProcess:
+    """
+    A render process and the shared memory slot it exchanges images through.
+    """
+
+    def __init__(self, context, slot_bytes: int) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve, args=(child_conn,), name=PROCESS_NAME, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+        # the slot is an unlinked temporary file (under TMPDIR, best a tmpfs)
+        # mapped by both processes, which don't share anonymous mappings when
+        # the forkserver starts the render process
+        with tempfile.TemporaryFile() as slot_file:
+            slot_file.truncate(slot_bytes)
+            self.slot = mmap.mmap(slot_file.fileno(), slot_bytes)
+            reduction.send_handle(self.conn, slot_file.fileno(), self.process.pid)
+
+    def render(
+        self,
+        source: memoryview,
+        query: Dict[str, str],
+        namespace: str,
+        filename: str,
+        timeout: float,
+    ) -> Tuple[BytesIO, str]:
+        deadline = get_deadline()
+        job = (query, namespace, filename, deadline.remaining())
+        if len(source) <= len(self.slot):
+            self.slot[: len(source)] = source
+            self.conn.send((len(source),) + job)
+        else:
+            self.conn.send((OVERFLOW,) + job)
+            self.conn.send_bytes(source)
+
+        if not self.conn.poll(max(timeout, 0)):
+            raise DeadlineExceeded()
+
+        status, *result = self.conn.recv()
+        if status == "error":
+            error, status_code = result
+            if status_code is not None:
+                error.status_code = status_code
+            raise error
+
+        size, mime_type, degraded = result
+        deadline.degraded = deadline.degraded or degraded
+        if size == OVERFLOW:
+            return BytesIO(self.conn.recv_bytes()), mime_type
+        return BytesIO(self.slot[:size]), mime_type
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+        self.process.join()
+        self.conn.close()
+        self.slot.close()
+
+
+class RenderPool:
+    """
+    Fixed-size pool of render processes, safe to share between request threads.
+    """
+
+    def __init__(self, processes: int, slot_bytes: int = RENDER_SLOT_BYTES) -> None:
+        self.slot_bytes = slot_bytes
+        # the forkserver imports this module once, so starting a render process
+        # is still a fork rather than a fresh interpreter
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload([__name__])
+        self._idle = queue.Queue()  # type: queue.Queue
+        for _ in range(processes):
+            self._idle.put(RenderProcess(self._context, slot_bytes))
+
+        self._closed = threading.Event()
+        self._retired = queue.Queue()  # type: queue.Queue
+        self._supervisor = threading.Thread(
+            target=self._supervise, name="render-pool-supervisor", daemon=True
+        )
+        self._supervisor.start()
+
+    def render(
+        self,
+        image: Image.Image,
+        query: Dict[str, str],
+        namespace: str,
+        filename: str,
+        timeout: Optional[float] = None,
+    ) -> Tuple[BytesIO, str]:
+        """
+        Renders a lazily decoded source image in one of the pool's processes.
+        Raises an ITSRenderTimeoutError if it takes longer than `timeout`, and
+        without taking a process if there is no time left.
+        """
+        if timeout is None:
+            timeout = RENDER_TIMEOUT
+        if timeout <= 0:
+            METRICS.incr("render_pool.expired")
+            raise ITSRenderTimeoutError(
+                "no time is left to render {ns}/{fn}".format(ns=namespace, fn=filename)
+            )
+        expires = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise ITSRenderTimeoutError(
+                "no render process became available for {ns}/{fn}".format(
+                    ns=namespace, fn=filename
+                )
+            )
+
+        try:
+            return worker.render(
+                source_view(image),
+                query,
+                namespace,
+                filename,
+                timeout=expires - time.monotonic(),
+            )
+        except DeadlineExceeded:
+            METRICS.incr("render_pool.killed")
+            LOGGER.warning(
+                "render of %s/%s with %s took longer than %ss, killing pid %s",
+                namespace,
+                filename,
+                query,
+                timeout,
+                worker.process.pid,
+            )
+            self._retire(worker)
+            worker = None
+            raise ITSRenderTimeoutError(
+                "rendering {ns}/{fn} took too long".format(ns=namespace, fn=filename)
+            )
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            METRICS.incr("render_pool.died")
+            LOGGER.error("render process %s died", worker.process.pid)
+            self._retire(worker)
+            worker = None
+            raise ITSError(
+                "rendering {ns}/{fn} failed".format(ns=namespace, fn=filename),
+                status_code=500,
+            )
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._retired.put(None)
+        self._supervisor.join()
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+    def _retire(self, worker: RenderProcess) -> None:
+        """
+        Hands a late or dead render process to the supervisor thread, which
+        kills and replaces it.
+        """
+        self._retired.put(worker)
+
+    def _supervise(self) -> None:
+        while True:
+            worker = self._retired.get()
+            if worker is None:
+                return
+            worker.kill()
+            while not self._closed.is_set():
+                try:
+                    self._idle.put(RenderProcess(self._context, self.slot_bytes))
+                    break
+                except Exception:  # pylint: disable=broad-except
+                    METRICS.incr("render_pool.start_error")
+                    LOGGER.exception("failed to start a render process")
+                    self._closed.wait(1)
+
+
+def source_view(image: Image.Image) -> memoryview:
+    """
+    Zero-copy view of the bytes a lazily decoded source was opened from.
+    """
+    file_obj = image.fp
+    if hasattr(file_obj, "getbuffer"):
+        return file_obj.getbuffer()
+    return memoryview(source_bytes(image))
+
+
+_POOL_LOCK = threading.Lock()
+_POOL = None  # type: Optional[RenderPool]
+
+
+def start_render_pool(processes: int) -> Optional[RenderPool]:
+    global _POOL  # pylint: disable=global-statement
+    if multiprocessing.current_process().name == PROCESS_NAME:
+        # render processes import the main module of the worker again
+        return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = RenderPool(processes)
+    return _POOL
+
+
+def get_render_pool() -> Optional[RenderPool]:
+    return _POOL
@@ -0,0 +1,89 @@
+"""
+Resampling filters of resizes, chosen per request with resample=FILTER[,GAP]
+or per namespace with a "resample" key in its ITS_BACKENDS config.
+"""
+
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .deadline import resample_filter
+from .errors import ConfigError, ITSClientError
+from .settings import DEFAULT_RESAMPLE, NAMESPACES
+from .util import DELIMITERS
+
+# from the fastest to the sharpest
+FILTERS = {
+    "nearest": Image.NEAREST,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
+
+
+class Resampling(NamedTuple):
+    filter: int = Image.LANCZOS
+    # Pillow reduces by an integer factor first, as long as the image stays
+    # reducing_gap times larger than the target; None resamples every pixel
+    reducing_gap: Optional[float] = None
+
+    def resize(
+        self,
+        img: Image.Image,
+        size: Sequence[int],
+        box: Optional[Tuple[float, float, float, float]] = None,
+    ) -> Image.Image:
+        return img.resize(
+            size,
+            resample_filter(self.filter),
+            box=box,
+            reducing_gap=self.reducing_gap,
+        )
+
+
+def parse_resampling(value: str) -> Resampling:
+    """
+    Parses FILTER or FILTER,GAP, e.g. bicubic,2. Raises ValueError.
+    """
+    name, *gap = DELIMITERS.split(value.strip().lower())
+    if name not in FILTERS or len(gap) > 1:
+        raise ValueError("unknown resampling filter {!r}".format(value))
+
+    reducing_gap = float(gap[0]) if gap else None
+    # Pillow won't reduce an image to less than the target size
+    if reducing_gap is not None and not reducing_gap >= 1:
+        raise ValueError("reducing gap {} is less than 1".format(reducing_gap))
+    return Resampling(FILTERS[name], reducing_gap)
+
+
+def namespace_resampling(
+    namespace: str, config: Optional[Dict[str, Any]] = None
+) -> Resampling:
+    """
+    Default resampling of a namespace. An invalid setting raises a ConfigError,
+    which bind_namespaces already reports when the application starts.
+    """
+    if config is None:
+        config = NAMESPACES.get(namespace, {})
+    try:
+        return parse_resampling(config.get("resample", DEFAULT_RESAMPLE))
+    except ValueError as error:
+        setting = namespace if "resample" in config else "ITS_RESAMPLE"
+        raise ConfigError("invalid resample setting of {}: {}".format(setting, error))
+
+
+def get_resampling(namespace: str, value: Optional[str] = None) -> Resampling:
+    """
+    Resampling of a request's resample parameter, or the namespace's default.
+    """
+    if value is None:
+        return namespace_resampling(namespace)
+    try:
+        return parse_resampling(value)
+    except ValueError:
+        raise ITSClientError(
+            "resample takes one of {filters}, optionally followed by a reducing "
+            "gap of at least 1, e.g. resample=bicubic,2".format(
+                filters=", ".join(FILTERS)
+            )
+        )
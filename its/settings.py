@@ -1,8 +1,6 @@
 import json
 import os
 
-from newrelic.agent import NewRelicContextFormatter
-
 
 # Set DEBUG = True to enable debugging application.
 DEBUG = os.environ.get("ITS_DEBUG", "false").lower() == "true"
@@ -46,18 +44,172 @@ NAMESPACES = json.JSONDecoder().decode(
     s=os.environ.get("ITS_BACKENDS", DEFAULT_NAMESPACES)
 )
 
+# folder that contains one folder per file_system namespace,
+# a namespace can override it with a "root" key
+FILE_SYSTEM_ROOT = os.environ.get(
+    "ITS_FILE_SYSTEM_ROOT", os.path.dirname(os.path.abspath(__file__))
+)
+
+# seconds loaders wait on an origin, a namespace can override it with a "timeout" key
+LOADER_TIMEOUT = float(os.environ.get("ITS_LOADER_TIMEOUT", "30"))
+
+# largest source the http and s3 loaders download, in bytes (0 for no limit),
+# a namespace can override it with a "max_bytes" key
+SOURCE_MAX_BYTES = int(os.environ.get("ITS_SOURCE_MAX_BYTES", str(100 * 2 ** 20)))
+
+# http origins (hosts) each worker fetches from at most ITS_ORIGIN_MAX_FETCHES at
+# once (0 for no limit), further fetches wait up to ITS_ORIGIN_QUEUE_SECONDS for
+# one of them to finish. A circuit breaker stops fetching from an origin for
+# ITS_ORIGIN_BREAKER_OPEN_SECONDS once ITS_ORIGIN_BREAKER_ERROR_RATE of at least
+# ITS_ORIGIN_BREAKER_MIN_FETCHES fetches in the last ITS_ORIGIN_BREAKER_WINDOW
+# seconds failed, fetches whose headers take longer than ITS_ORIGIN_SLOW_SECONDS
+# to arrive count as failed
+ORIGIN_MAX_FETCHES = int(os.environ.get("ITS_ORIGIN_MAX_FETCHES", "16"))
+ORIGIN_QUEUE_SECONDS = float(os.environ.get("ITS_ORIGIN_QUEUE_SECONDS", "1"))
+ORIGIN_BREAKER_WINDOW = float(os.environ.get("ITS_ORIGIN_BREAKER_WINDOW", "30"))
+ORIGIN_BREAKER_MIN_FETCHES = int(os.environ.get("ITS_ORIGIN_BREAKER_MIN_FETCHES", "10"))
+ORIGIN_BREAKER_ERROR_RATE = float(
+    os.environ.get("ITS_ORIGIN_BREAKER_ERROR_RATE", "0.5")
+)
+ORIGIN_BREAKER_OPEN_SECONDS = float(
+    os.environ.get("ITS_ORIGIN_BREAKER_OPEN_SECONDS", "30")
+)
+ORIGIN_SLOW_SECONDS = float(os.environ.get("ITS_ORIGIN_SLOW_SECONDS", "10"))
+
 
 DEFAULT_OVERLAYS = json.dumps({"passport": "tests/images/logo.png"})
 
 OVERLAYS = json.JSONDecoder().decode(s=os.environ.get("ITS_OVERLAYS", DEFAULT_OVERLAYS))
 
+# maximum number of decoded bytes of overlay images kept in memory per worker
+OVERLAY_CACHE_BYTES = int(os.environ.get("ITS_OVERLAY_CACHE_BYTES", str(8 * 2 ** 20)))
+
+# resampling filter of resizes and crops (nearest, bilinear, bicubic or lanczos),
+# optionally followed by a reducing gap, e.g. "bicubic,2"; namespaces can
+# override it with a "resample" key and requests with ?resample=
+DEFAULT_RESAMPLE = os.environ.get("ITS_RESAMPLE", "lanczos")
+
+# largest blur radius, relative to the longer side of the blurred image
+BLUR_MAX_RADIUS = float(os.environ.get("ITS_BLUR_MAX_RADIUS", "0.1"))
+
 # the keyword used to recognize focal point args in filenames
 FOCUS_KEYWORD = os.environ.get("ITS_FOCUS_KEYWORD", "focus-")
 
 DELIMITERS_RE = os.environ.get("ITS_DELIMITERS_RE", "[x_,]")
 
+# seconds a request must have left for crop=WxH,auto to look for the focal point
+# of a source instead of falling back to the center (the search itself isn't
+# interrupted, it takes about as long for any source), and how many seconds focal
+# points are remembered for every other crop of the source
+AUTO_FOCUS_MIN_REMAINING = float(os.environ.get("ITS_AUTO_FOCUS_MIN_REMAINING", "0.01"))
+AUTO_FOCUS_TTL = float(os.environ.get("ITS_AUTO_FOCUS_TTL", "3600"))
+
+# JSON index of focal points by "namespace/path", "file:///path/index.json" or
+# "s3://bucket/index.json" ("" disables it), reloaded every ITS_FOCAL_POINT_INDEX_TTL
+# seconds. Focal points in the index win over the ones in filenames
+FOCAL_POINT_INDEX = os.environ.get("ITS_FOCAL_POINT_INDEX", "")
+FOCAL_POINT_INDEX_TTL = float(os.environ.get("ITS_FOCAL_POINT_INDEX_TTL", "300"))
+
 SENTRY_DSN = os.environ.get("ITS_SENTRY_DSN")
 
+# number of pre-forked processes per worker that decode, transform and encode images
+# (0 renders in the request thread), how many seconds a render may take before its
+# process is killed and replaced (less if ITS_REQUEST_BUDGET runs out first), and the
+# size of each process' shared memory slot
+RENDER_PROCESSES = int(os.environ.get("ITS_RENDER_PROCESSES", "0"))
+RENDER_TIMEOUT = float(os.environ.get("ITS_RENDER_TIMEOUT", "10"))
+RENDER_SLOT_BYTES = int(os.environ.get("ITS_RENDER_SLOT_BYTES", str(32 * 2 ** 20)))
+
+# maximum number of encoded bytes kept in each worker's render cache (0 disables it)
+# and how many seconds renditions stay there
+RENDER_CACHE_BYTES = int(os.environ.get("ITS_RENDER_CACHE_BYTES", "0"))
+RENDER_CACHE_TTL = float(os.environ.get("ITS_RENDER_CACHE_TTL", "3600"))
+
+# store of renditions shared by all workers, "file:///path/to/dir" or
+# "s3://bucket/prefix" ("" disables it). Renditions are written by
+# ITS_DERIVATIVE_STORE_WRITERS background threads, writes are dropped while
+# ITS_DERIVATIVE_STORE_PENDING of them are already waiting
+DERIVATIVE_STORE = os.environ.get("ITS_DERIVATIVE_STORE", "")
+DERIVATIVE_STORE_WRITERS = int(os.environ.get("ITS_DERIVATIVE_STORE_WRITERS", "2"))
+DERIVATIVE_STORE_PENDING = int(os.environ.get("ITS_DERIVATIVE_STORE_PENDING", "64"))
+
+# maximum number of decoded bytes of source image pyramids kept in each worker's
+# source cache (0 disables it), how many requests for a source it takes to keep
+# its pyramid, and how many seconds pyramids of sources without validators stay
+SOURCE_CACHE_BYTES = int(os.environ.get("ITS_SOURCE_CACHE_BYTES", "0"))
+SOURCE_CACHE_MIN_REQUESTS = int(os.environ.get("ITS_SOURCE_CACHE_MIN_REQUESTS", "2"))
+SOURCE_CACHE_TTL = float(os.environ.get("ITS_SOURCE_CACHE_TTL", "600"))
+
+# seconds after those pyramids expire that they are still served, while they are
+# refreshed in the background or while their origin fails (0 disables either),
+# a namespace can override them with "stale_while_revalidate" and "stale_if_error"
+SOURCE_STALE_WHILE_REVALIDATE = float(
+    os.environ.get("ITS_SOURCE_STALE_WHILE_REVALIDATE", "0")
+)
+SOURCE_STALE_IF_ERROR = float(os.environ.get("ITS_SOURCE_STALE_IF_ERROR", "0"))
+
+# bytes ?info requests fetch to parse the header of a source, from loaders that
+# can fetch a range of it, and how many seconds the info and placeholders of
+# sources without validators stay cached
+INFO_HEADER_BYTES = int(os.environ.get("ITS_INFO_HEADER_BYTES", str(64 * 2 ** 10)))
+INFO_TTL = float(os.environ.get("ITS_INFO_TTL", "600"))
+
+# longest side of ?placeholder previews, in pixels
+PLACEHOLDER_SIZE = int(os.environ.get("ITS_PLACEHOLDER_SIZE", "32"))
+
+# size images to the DPR, Width and Viewport-Width client hints of requests
+# (namespaces can override it with a "client_hints" key), snapping widths up to
+# the comma-delimited ladder of ITS_CLIENT_HINTS_WIDTHS pixels
+CLIENT_HINTS = os.environ.get("ITS_CLIENT_HINTS", "false").lower() == "true"
+CLIENT_HINTS_WIDTHS = sorted(
+    int(width)
+    for width in os.environ.get(
+        "ITS_CLIENT_HINTS_WIDTHS", "160,320,480,640,768,960,1280,1600,1920,2560"
+    ).split(",")
+)
+
+# token admin requests send as "Authorization: Bearer <token>" ("" disables them)
+ADMIN_TOKEN = os.environ.get("ITS_ADMIN_TOKEN", "")
+
+# file the workers of a node append purges to, and read the purges of the other
+# workers from ("" only purges the memory of the worker that gets the request,
+# set it whenever uwsgi runs more than one process)
+PURGE_LOG = os.environ.get("ITS_PURGE_LOG", "")
+
+# maximum number of renditions a single batch request may ask for
+BATCH_MAX_RENDITIONS = int(os.environ.get("ITS_BATCH_MAX_RENDITIONS", "20"))
+
+# seconds a request may take before its render is degraded, i.e. switches to
+# draft decoding, cheaper resampling and encoding, and skips pngquant once fewer
+# than ITS_DEGRADE_REMAINING seconds remain (keep the budget below uwsgi's harakiri).
+# Degraded renders are only cacheable for ITS_DEGRADED_MAX_AGE seconds.
+REQUEST_BUDGET = float(os.environ.get("ITS_REQUEST_BUDGET", "12"))
+DEGRADE_REMAINING = float(os.environ.get("ITS_DEGRADE_REMAINING", "4"))
+DEGRADED_MAX_AGE = int(os.environ.get("ITS_DEGRADED_MAX_AGE", "60"))
+
+# asgi server (its.asgi): maximum concurrent origin fetches per event loop,
+# and the size and kind ("thread" or "process") of the pool that renders images
+ASGI_MAX_FETCHES = int(os.environ.get("ITS_ASGI_MAX_FETCHES", "256"))
+ASGI_RENDER_WORKERS = int(
+    os.environ.get("ITS_ASGI_RENDER_WORKERS", str(os.cpu_count() or 1))
+)
+ASGI_RENDER_POOL = os.environ.get("ITS_ASGI_RENDER_POOL", "thread")
+
+# peer-aware mode: each node of a cluster owns a consistent-hash slice of the
+# sources and forwards requests for the others to their owner, so every source and
+# its renditions are cached by one node. Peers are a comma-delimited list of
+# host:port (ITS_PEERS), or a host:port whose name resolves to the address of every
+# node (ITS_PEERS_DNS, resolved again every ITS_PEERS_DNS_TTL seconds).
+# ITS_PEER_SELF is the host:port peers reach this node at (by default the address
+# of its hostname and port 5000). Peers that fail are skipped for ITS_PEER_RETRY
+# seconds, their requests are rendered locally meanwhile.
+PEERS = [peer for peer in os.environ.get("ITS_PEERS", "").split(",") if peer]
+PEERS_DNS = os.environ.get("ITS_PEERS_DNS", "")
+PEERS_DNS_TTL = float(os.environ.get("ITS_PEERS_DNS_TTL", "30"))
+PEER_SELF = os.environ.get("ITS_PEER_SELF", "")
+PEER_TIMEOUT = float(os.environ.get("ITS_PEER_TIMEOUT", "8"))
+PEER_RETRY = float(os.environ.get("ITS_PEER_RETRY", "10"))
+
 # set the ITS_CORS_ORIGINS environment variable to a comma-delimited string of domains
 # for each domain in that list, ITS will respond to GET and HEAD requests with CORS headers
 CORS_ORIGINS = os.environ.get(
@@ -73,7 +225,8 @@ LOGGING = {
             'format': '[%(asctime)s] %(levelname)s - %(name)s - %(message)s'
         },
         'newrelic': {
-            '()': NewRelicContextFormatter
+            # resolved by dictConfig, so settings can be imported without newrelic
+            '()': 'newrelic.agent.NewRelicContextFormatter'
         },
     },
     'root': {
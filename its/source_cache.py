@@ -0,0 +1,204 @@
+"""
+In-memory cache of decoded sources, kept as image pyramids so repeated
+thumbnails of a popular source are resampled from a nearby level instead of
+decoding and downscaling the full resolution image every time. Disabled
+unless ITS_SOURCE_CACHE_BYTES is set.
+
+Pyramids of sources without validators expire, and can then be served stale
+while they're refreshed in the background, or while their origin fails.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional, Set
+
+from PIL import Image
+
+from .cache import LRUCache, source_tags
+from .errors import ITSError, NotFoundError
+from .loader import loader
+from .metrics import METRICS
+from .pyramid import Pyramid
+from .render import decode
+from .settings import (
+    NAMESPACES,
+    SOURCE_CACHE_BYTES,
+    SOURCE_CACHE_MIN_REQUESTS,
+    SOURCE_CACHE_TTL,
+    SOURCE_STALE_IF_ERROR,
+    SOURCE_STALE_WHILE_REVALIDATE,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+SOURCE_CACHE = LRUCache(
+    "source", SOURCE_CACHE_BYTES, sizeof=lambda pyramid: pyramid.max_nbytes()
+)
+
+# recent requests per source, to only keep the pyramids of popular ones
+SOURCE_REQUESTS = LRUCache("source_requests", 4096)
+
+# levels built up front by build_pyramid, smaller renditions use the last one
+EAGER_LEVEL_SIZE = (32, 32)
+
+# threads that refresh stale pyramids, per worker
+REVALIDATION_THREADS = 2
+
+# sources being refreshed, so each is fetched once however many requests it gets
+_REVALIDATING = set()  # type: Set[str]
+_REVALIDATING_LOCK = threading.Lock()
+_REVALIDATOR = None  # type: Optional[ThreadPoolExecutor]
+
+
+class StaleWindows(NamedTuple):
+    while_revalidate: float
+    if_error: float
+
+
+def stale_windows(namespace: str) -> StaleWindows:
+    config = NAMESPACES.get(namespace, {})
+    return StaleWindows(
+        float(config.get("stale_while_revalidate", SOURCE_STALE_WHILE_REVALIDATE)),
+        float(config.get("stale_if_error", SOURCE_STALE_IF_ERROR)),
+    )
+
+
+def source_key(namespace: str, filename: str, validator: Optional[str]) -> str:
+    return "{ns}/{fn}#{validator}".format(
+        ns=namespace, fn=filename, validator=validator or ""
+    )
+
+
+def get_pyramid(
+    namespace: str, filename: str, validator: Optional[str]
+) -> Optional[Pyramid]:
+    """
+    Returns the cached pyramid of a source, or None after counting the request
+    if the source isn't cached (yet).
+    """
+    key = source_key(namespace, filename, validator)
+    pyramid = SOURCE_CACHE.get(key)
+    if pyramid is None:
+        pyramid = _stale_pyramid(key, stale_windows(namespace).while_revalidate)
+        if pyramid is not None:
+            METRICS.incr("source_cache.stale")
+            revalidate(namespace, filename)
+            return pyramid
+        SOURCE_REQUESTS.set(
+            key,
+            SOURCE_REQUESTS.get(key, 0) + 1,
+            tags=source_tags(namespace, filename),
+        )
+    return pyramid
+
+
+def is_popular(namespace: str, filename: str, validator: Optional[str]) -> bool:
+    key = source_key(namespace, filename, validator)
+    return SOURCE_REQUESTS.get(key, 0) >= SOURCE_CACHE_MIN_REQUESTS
+
+
+def cache_pyramid(
+    image: Image.Image,
+    namespace: str,
+    filename: str,
+    validator: Optional[str],
+    eager: bool = False,
+) -> Pyramid:
+    """
+    Decodes a source into a pyramid and keeps it in the source cache, with
+    every level down to EAGER_LEVEL_SIZE if `eager`. Concurrent requests for
+    the same source wait for a single decode.
+    """
+
+    def build() -> Pyramid:
+        decoded = decode(image, namespace, filename)
+        decoded.load()
+        pyramid = Pyramid(decoded)
+        if eager:
+            pyramid.level_for(EAGER_LEVEL_SIZE)
+        return pyramid
+
+    key = source_key(namespace, filename, validator)
+    # validated sources can't change without changing their key
+    ttl = None if validator else SOURCE_CACHE_TTL
+    pyramid = SOURCE_CACHE.get_or_set(
+        key,
+        build,
+        ttl=ttl,
+        tags=source_tags(namespace, filename),
+        stale=max(stale_windows(namespace)),
+    )
+    SOURCE_REQUESTS.delete(key)
+    return pyramid
+
+
+def _stale_pyramid(key: str, window: float) -> Optional[Pyramid]:
+    stale = SOURCE_CACHE.get_stale(key) if window > 0 else None
+    if stale is None or stale[1] > window:
+        return None
+    return stale[0]
+
+
+def is_origin_error(error: Exception) -> bool:
+    """
+    Whether a loader failed because of its origin (5xx, timeouts, connection
+    errors) rather than because the source is missing or isn't an image.
+    """
+    if isinstance(error, ITSError):
+        return error.status_code >= 500
+    return True
+
+
+def stale_if_error(
+    namespace: str, filename: str, validator: Optional[str]
+) -> Optional[Pyramid]:
+    """
+    The expired pyramid of a source to serve while its origin fails, if it
+    expired within the stale_if_error window of its namespace.
+    """
+    key = source_key(namespace, filename, validator)
+    pyramid = _stale_pyramid(key, stale_windows(namespace).if_error)
+    if pyramid is not None:
+        METRICS.incr("source_cache.stale_if_error")
+    return pyramid
+
+
+def get_revalidator() -> ThreadPoolExecutor:
+    global _REVALIDATOR  # pylint: disable=global-statement
+    with _REVALIDATING_LOCK:
+        if _REVALIDATOR is None:
+            _REVALIDATOR = ThreadPoolExecutor(max_workers=REVALIDATION_THREADS)
+    return _REVALIDATOR
+
+
+def revalidate(namespace: str, filename: str) -> bool:
+    """
+    Fetches a source without validators again in the background and replaces
+    its pyramid, unless it is already being fetched.
+    """
+    key = source_key(namespace, filename, None)
+    with _REVALIDATING_LOCK:
+        if key in _REVALIDATING:
+            return False
+        _REVALIDATING.add(key)
+    get_revalidator().submit(_revalidate, namespace, filename, key)
+    return True
+
+
+def _revalidate(namespace: str, filename: str, key: str) -> None:
+    try:
+        image = loader(namespace, filename)
+        if isinstance(image, Image.Image):
+            cache_pyramid(image, namespace, filename, None)
+        METRICS.incr("source_cache.revalidated")
+    except NotFoundError:
+        # the source was deleted, stop serving it
+        SOURCE_CACHE.delete(key)
+    except Exception:  # pylint: disable=broad-except
+        # the stale pyramid is served until its windows close
+        METRICS.incr("source_cache.revalidate_error")
+        LOGGER.warning("failed to revalidate %s", key, exc_info=True)
+    finally:
+        with _REVALIDATING_LOCK:
+            _REVALIDATING.discard(key)
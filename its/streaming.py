@@ -0,0 +1,223 @@
+"""
+Helpers to send response bodies in chunks instead of building them in memory.
+"""
+
+import queue
+import threading
+from io import BytesIO
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# encoded chunks waiting for a slow client before the encoder is paused
+ENCODER_QUEUE_CHUNKS = 4
+
+# bytes of an encoded image its header is looked for in
+HEADER_PEEK_BYTES = 64 * 1024
+
+
+def iter_buffer(buffer, chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Yields a buffer (bytes, memoryview, mmap...) in chunks, only one chunk is
+    copied at a time.
+    """
+    view = memoryview(buffer)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size].tobytes()
+
+
+class SourceStream:
+    """
+    Body of a source that is passed through to the client as is (e.g. SVG),
+    streamed from the loader. `length` is None when the origin didn't say.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], length: Optional[int] = None) -> None:
+        self.chunks = chunks
+        self.length = length
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.chunks)
+
+    def read(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class EncoderCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """
+    Write-only file object that hands what Pillow's encoders write to the
+    thread consuming the queue.
+    """
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event) -> None:
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        while True:
+            if self.cancelled.is_set():
+                raise EncoderCancelled()
+            try:
+                self.chunks.put(data, timeout=0.1)
+                return len(data)
+            except queue.Full:
+                continue
+
+    def flush(self) -> None:
+        pass
+
+
+def _encode(image: Image.Image, options: Dict[str, Any], writer: _QueueWriter):
+    try:
+        image.save(writer, **options)
+    except EncoderCancelled:
+        return
+    except Exception as error:  # pylint: disable=broad-except
+        writer.chunks.put(error)
+        return
+    writer.chunks.put(None)
+
+
+class EncodedStream:
+    """
+    Iterator over the chunks an encoder thread produces. WSGI servers close
+    response iterables when the client goes away, which stops the encoder.
+    """
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event) -> None:
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._first = None  # type: Optional[bytes]
+
+    def __iter__(self) -> "EncodedStream":
+        return self
+
+    def __next__(self) -> bytes:
+        if self._first is not None:
+            chunk, self._first = self._first, None
+            return chunk
+
+        chunk = self._chunks.get()
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        if isinstance(chunk, Exception):
+            self.close()
+            raise chunk
+        return chunk
+
+    def prefetch(self) -> None:
+        self._first = next(self)
+
+    def close(self) -> None:
+        self._cancelled.set()
+
+
+def iter_encoded(image: Image.Image, options: Dict[str, Any]) -> Iterator[bytes]:
+    """
+    Encodes an image with image.save(**options) in a background thread and
+    yields the encoded bytes as the encoder produces them.
+
+    The first chunk is awaited before returning, so encoding errors are raised
+    here instead of after the response status has been sent.
+    """
+    chunks = queue.Queue(maxsize=ENCODER_QUEUE_CHUNKS)  # type: queue.Queue
+    cancelled = threading.Event()
+    thread = threading.Thread(
+        target=_encode,
+        args=(image, options, _QueueWriter(chunks, cancelled)),
+        daemon=True,
+    )
+    thread.start()
+
+    body = EncodedStream(chunks, cancelled)
+    try:
+        body.prefetch()
+    except StopIteration:
+        return iter(())
+    return body
+
+
+class TeeStream:
+    """
+    Passes chunks through and hands the whole body to `on_complete` once the
+    last chunk was sent, e.g. to cache it.
+    """
+
+    def __init__(
+        self, chunks: Iterable[bytes], on_complete: Callable[[bytes], None]
+    ) -> None:
+        self._chunks = iter(chunks)
+        self._on_complete = on_complete
+        self._parts = []  # type: List[bytes]
+
+    def __iter__(self) -> "TeeStream":
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            body, self._parts = b"".join(self._parts), []
+            self._on_complete(body)
+            raise
+        self._parts.append(chunk)
+        return chunk
+
+    def close(self) -> None:
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class PeekedStream:
+    """
+    Chunks of a stream whose first chunks were already read.
+    """
+
+    def __init__(self, head: List[bytes], chunks: Iterator[bytes]) -> None:
+        self._head = head
+        self._chunks = chunks
+
+    def __iter__(self) -> "PeekedStream":
+        return self
+
+    def __next__(self) -> bytes:
+        if self._head:
+            return self._head.pop(0)
+        return next(self._chunks)
+
+    def close(self) -> None:
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def peek_image_size(
+    chunks: Iterable[bytes], max_bytes: int = HEADER_PEEK_BYTES
+) -> Tuple[Optional[Tuple[int, int]], PeekedStream]:
+    """
+    Size of the encoded image in a body, parsed from its first chunks, and the
+    whole body. The size is None if the header isn't in its first `max_bytes`.
+    """
+    chunks = iter(chunks)
+    head = []  # type: List[bytes]
+    read = 0
+    size = None
+    for chunk in chunks:
+        head.append(chunk)
+        read += len(chunk)
+        try:
+            size = Image.open(BytesIO(b"".join(head))).size
+        except (OSError, EOFError, SyntaxError):
+            if read < max_bytes:
+                continue
+        break
+    return size, PeekedStream(head, chunks)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import threading
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.asgi import application
+from its.loaders.file_system import FileSystemLoader
+
+
+def asgi_messages(path, query_string=b"", headers=None, method="GET", body=b""):
+    scope = {
+        "type": "http",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "query_string": query_string,
+        "headers": [(b"host", b"localhost")] + (headers or []),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(application(scope, receive, send))
+    finally:
+        loop.close()
+    return messages
+
+
+def asgi_get(path, query_string=b"", headers=None, method="GET", body=b""):
+    start, *bodies = asgi_messages(path, query_string, headers, method, body)
+    assert not bodies[-1].get("more_body")
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    return start["status"], headers, b"".join(body["body"] for body in bodies)
+
+
+class TestASGI(TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.img_dir = Path(__file__).parent / "images"
+
+    def test_transform(self):
+        status, headers, body = asgi_get(
+            "/tests/images/test.png", b"resize=50x&format=jpg"
+        )
+        assert status == 200
+        assert headers["content-type"] == "image/jpeg"
+        assert headers["cache-control"] == "max-age=31536000"
+        assert Image.open(BytesIO(body)).width == 50
+
+    def test_legacy_routes(self):
+        status, headers, body = asgi_get("/tests/images/test.png.crop.50x40.png")
+        assert status == 200
+        assert Image.open(BytesIO(body)).size == (50, 40)
+
+        status, headers, body = asgi_get(
+            "/tests/images/test.png.focalcrop.50x40.10.90.png"
+        )
+        assert status == 200
+        assert Image.open(BytesIO(body)).size == (50, 40)
+
+        status, headers, body = asgi_get("/tests/images/test.png.resize.x28.jpg")
+        assert status == 200
+        assert headers["content-type"] == "image/jpeg"
+        assert Image.open(BytesIO(body)).height == 28
+
+    def test_svg_passthrough(self):
+        status, headers, body = asgi_get("/tests/images/wikipedia_logo.svg")
+        assert status == 200
+        assert headers["content-type"] == "image/svg+xml"
+        assert body == (self.img_dir / "wikipedia_logo.svg").read_bytes()
+
+    def test_conditional_requests(self):
+        threads = []
+        get_validators = FileSystemLoader.get_validators
+
+        def validators(*args):
+            threads.append(threading.current_thread())
+            return get_validators(*args)
+
+        with patch.object(FileSystemLoader, "get_validators", staticmethod(validators)):
+            status, headers, _ = asgi_get("/tests/images/test.png", b"resize=50x")
+            assert status == 200
+            status, _, body = asgi_get(
+                "/tests/images/test.png",
+                b"resize=50x",
+                headers=[(b"if-none-match", headers["etag"].encode())],
+            )
+        assert (status, body) == (304, b"")
+        # the source is stat'ed off the event loop
+        assert threading.main_thread() not in threads
+
+    def test_post_routes(self):
+        payload = {"renditions": ["resize=50x", "resize=20x&format=png"]}
+        status, headers, body = asgi_get(
+            "/tests/images/test.png",
+            headers=[(b"content-type", b"application/json")],
+            method="POST",
+            body=json.dumps(payload).encode(),
+        )
+        assert status == 200
+        assert headers["content-type"] == "application/json"
+        assert len(json.loads(body.decode())["renditions"]) == 2
+
+        # the admin endpoints answer as they do under wsgi
+        status, _, _ = asgi_get("/admin/purge/tests/test.png", method="POST")
+        assert status == 404
+
+    def test_errors(self):
+        status, _, body = asgi_get("/invalid-namespace/image.jpg")
+        assert status == 400
+        assert b"invalid-namespace is not a configured namespace" in body
+
+        status, _, body = asgi_get("/tests/images/test.png", b"resize=bad")
+        assert status == 400
+
+        status, _, _ = asgi_get("/tests/images/does-not-exist.png")
+        assert status == 404
+
+    def test_redirect(self):
+        status, headers, _ = asgi_get(
+            "/station-images/StationColorProfiles/color/WGBH.png.resize.240x120.png"
+        )
+        assert status == 301
+        assert headers["location"].startswith(
+            "https://station-service.example.com/station/image-redirects/"
+        )
+
+    def test_cors(self):
+        _, headers, _ = asgi_get(
+            "/tests/images/test.png", headers=[(b"origin", b"www.example.com")]
+        )
+        assert headers["access-control-allow-origin"] == "www.example.com"
+
+        _, headers, _ = asgi_get(
+            "/tests/images/test.png", headers=[(b"origin", b"evil.example.com")]
+        )
+        assert "access-control-allow-origin" not in headers
@@ -0,0 +1,155 @@
+import base64
+import json
+import time
+from contextlib import contextmanager
+from email.parser import BytesParser
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.cache import LRUCache
+from its.pyramid import Pyramid
+from its.render_cache import Rendition, cache_rendition
+from its.settings import DEGRADED_MAX_AGE, RENDER_CACHE_TTL
+
+
+@contextmanager
+def render_cache():
+    cache = LRUCache("render", 2 ** 24, sizeof=lambda rendition: len(rendition.body))
+    with patch("its.application.RENDER_CACHE", cache):
+        with patch("its.render_cache.RENDER_CACHE", cache):
+            yield cache
+
+
+class TestPyramid(TestCase):
+    def test_levels(self):
+        image = Image.new("RGB", (1000, 800))
+        pyramid = Pyramid(image)
+        assert pyramid.level_for(None) is image
+        assert pyramid.level_for((600, 10)) is image
+
+        level = pyramid.level_for((100, 80))
+        assert level.size == (250, 200)
+        assert len(pyramid.levels) == 3
+        assert pyramid.level_for((200, 100)).size == (500, 400)
+        assert pyramid.nbytes() == 3 * (1000 * 800 + 500 * 400 + 250 * 200)
+
+    def test_palette_images_are_not_halved(self):
+        image = Image.new("P", (1000, 800))
+        assert Pyramid(image).level_for((10, 10)) is image
+
+
+class TestBatch(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def post(self, payload, **kwargs):
+        return self.client.post(
+            "tests/images/seagull.jpg",
+            data=json.dumps(payload),
+            content_type="application/json",
+            **kwargs
+        )
+
+    def test_manifest(self):
+        response = self.post(
+            {
+                "renditions": [
+                    "crop=160x90&format=webp",
+                    {"resize": "100x", "format": "png"},
+                    "resize=x40",
+                ]
+            }
+        )
+        assert response.status_code == 200
+        manifest = response.get_json()["renditions"]
+        assert [entry["mime_type"] for entry in manifest] == [
+            "image/webp",
+            "image/png",
+            "image/jpeg",
+        ]
+        assert manifest[0]["url"] == "/tests/images/seagull.jpg?fit=160x90&format=webp"
+        for entry in manifest:
+            image = Image.open(BytesIO(base64.b64decode(entry["data"])))
+            assert image.size == (entry["width"], entry["height"])
+        assert (manifest[0]["width"], manifest[0]["height"]) == (160, 90)
+        assert manifest[1]["width"] == 100
+        assert manifest[2]["height"] == 40
+
+    def test_multipart(self):
+        response = self.post(
+            {"renditions": ["resize=50x", "resize=80x&format=png"]},
+            headers={"Accept": "multipart/mixed"},
+        )
+        assert response.mimetype == "multipart/mixed"
+        message = BytesParser().parsebytes(
+            b"Content-Type: "
+            + response.headers["Content-Type"].encode()
+            + b"\r\n\r\n"
+            + response.data
+        )
+        parts = message.get_payload()
+        assert [part.get_content_type() for part in parts] == [
+            "image/jpeg",
+            "image/png",
+        ]
+        assert Image.open(BytesIO(parts[1].get_payload(decode=True))).width == 80
+
+    def test_write_through(self):
+        with render_cache():
+            response = self.post(
+                {"renditions": ["resize=60x"], "cache": True, "data": False}
+            )
+            entry = response.get_json()["renditions"][0]
+            assert "data" not in entry
+
+            with patch("its.application.loader", side_effect=AssertionError):
+                response = self.client.get(entry["url"])
+            assert response.status_code == 200
+            assert response.headers["Content-Length"] == str(entry["size"])
+            assert Image.open(BytesIO(response.data)).width == 60
+
+    def test_errors(self):
+        assert self.post({"renditions": []}).status_code == 400
+        assert self.post({"renditions": "resize=10x"}).status_code == 400
+        assert self.post({"renditions": ["resize=10x"] * 21}).status_code == 400
+        assert self.post({"renditions": ["resize=bad"]}).status_code == 400
+        response = self.client.post(
+            "tests/images/wikipedia_logo.svg",
+            data=json.dumps({"renditions": ["resize=10x"]}),
+            content_type="application/json",
+        )
+        assert response.status_code == 400
+
+
+class TestRenderCache(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def test_cached_renditions(self):
+        with render_cache(), patch(
+            "its.application.get_render_pool", return_value=None
+        ):
+            response = self.client.get("tests/images/test.png?resize=30x")
+            assert response.status_code == 200
+            first = response.data
+
+            with patch("its.application.loader", side_effect=AssertionError):
+                response = self.client.get("tests/images/test.png?resize=30x")
+            assert response.data == first
+
+    def test_degraded_renditions_expire_soon(self):
+        with render_cache() as cache:
+            cache_rendition("full", Rendition(b"body", "image/png"))
+            cache_rendition("degraded", Rendition(b"body", "image/png", degraded=True))
+            _, _, expires = cache._entries["degraded"]
+            assert expires - time.monotonic() <= DEGRADED_MAX_AGE
+            _, _, expires = cache._entries["full"]
+            assert expires - time.monotonic() > RENDER_CACHE_TTL - 1
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from its.application import APP
+from its.cache import LRUCache
+from its.metrics import Metrics
+from its.transformations.overlay import OVERLAY_CACHE
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache("test", max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_evicts_by_size(self):
+        cache = LRUCache("test", max_size=10, sizeof=len)
+        cache.set("a", b"12345")
+        cache.set("b", b"123456")
+        assert cache.get("a") is None
+        assert cache.size == 6
+        # entries larger than the whole cache are not stored
+        cache.set("c", b"12345678901")
+        assert cache.get("c") is None
+        assert cache.get("b") == b"123456"
+
+    def test_ttl(self):
+        cache = LRUCache("test", max_size=10)
+        cache.set("a", 1, ttl=0.01)
+        time.sleep(0.02)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_stale(self):
+        cache = LRUCache("test", max_size=10)
+        cache.set("a", 1, ttl=0.01, stale=60)
+        cache.set("b", 2, ttl=0.01)
+        assert cache.get_stale("a") == (1, 0.0)
+        time.sleep(0.02)
+        assert cache.get("a") is None
+        value, age = cache.get_stale("a")
+        assert value == 1 and 0 < age < 60
+        assert cache.get_stale("b") is None
+        assert len(cache) == 1
+
+    def test_get_or_set_calls_factory_once(self):
+        cache = LRUCache("test", max_size=10)
+        calls = []
+        lock = threading.Lock()
+
+        def factory():
+            with lock:
+                calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(lambda _: cache.get_or_set("key", factory), range(8))
+            )
+
+        assert results == ["value"] * 8
+        assert len(calls) == 1
+
+
+class TestMetrics(TestCase):
+    def test_concurrent_increments(self):
+        metrics = Metrics()
+
+        def bump(_):
+            for _ in range(1000):
+                metrics.incr("requests")
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(bump, range(4)))
+
+        assert metrics.snapshot()["requests"] == 4000
+
+
+class TestThreadedRequests(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+
+    def test_concurrent_overlay_requests(self):
+        OVERLAY_CACHE.clear()
+
+        def get(_):
+            client = APP.test_client()
+            return client.get(
+                "tests/images/test.png?overlay=tests/images/five.png&resize=100x100"
+            ).status_code
+
+        # render in this process so its overlay cache is the one being shared
+        with patch("its.application.get_render_pool", return_value=None):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                statuses = list(executor.map(get, range(8)))
+
+        assert statuses == [200] * 8
+        assert len(OVERLAY_CACHE) == 1
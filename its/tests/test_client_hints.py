@@ -0,0 +1,126 @@
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.client_hints import Hints, apply_hints, parse_hints, snap_width
+
+from .test_asgi import asgi_get
+
+
+class TestClientHints(TestCase):
+    def test_parse_hints(self):
+        assert parse_hints({}) is None
+        assert parse_hints({"Sec-CH-DPR": "2", "Width": "500"}) == Hints(2.0, 500)
+        assert parse_hints({"viewport-width": "400", "dpr": "9"}) == Hints(
+            4.0, None, 400
+        )
+        assert parse_hints({"DPR": "bad", "Width": "-3"}) is None
+
+    def test_snap_width(self):
+        assert snap_width(1) == 160
+        assert snap_width(320) == 320
+        assert snap_width(321) == 480
+        assert snap_width(10000) == 2560
+
+    def test_explicit_width(self):
+        query, content_dpr = apply_hints({"resize": "300x200"}, Hints(2.0))
+        assert query == {"resize": "640x426"}
+        assert content_dpr == 2.133
+
+        # the width hint caps the explicit width
+        query, content_dpr = apply_hints({"fit": "300x200x10x90"}, Hints(3.0, 500))
+        assert query == {"fit": "640x426,10,90"}
+
+        query, content_dpr = apply_hints({"resize": "x200"}, Hints(2.0))
+        assert query == {"resize": "x200"}
+        assert content_dpr is None
+
+    def test_implicit_width(self):
+        query, content_dpr = apply_hints({"format": "webp"}, Hints(2.0, None, 400))
+        assert query == {"format": "webp", "resize": "960x,no-scale-up"}
+        assert content_dpr == 2.4
+
+        query, content_dpr = apply_hints({}, Hints(2.0))
+        assert query == {}
+        assert content_dpr is None
+
+
+class TestClientHintsRequests(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def setUp(self):
+        patcher = patch("its.client_hints.CLIENT_HINTS", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resize(self):
+        response = self.client.get(
+            "/tests/images/seagull.jpg?resize=300x", headers={"Sec-CH-DPR": "2"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-DPR"] == "2.133"
+        assert "Sec-CH-Width" in response.headers["Vary"]
+        assert "Sec-CH-DPR" in response.headers["Accept-CH"]
+        assert Image.open(BytesIO(response.data)).width == 640
+
+        response = self.client.get(
+            "/tests/images/seagull.jpg?resize=300x",
+            headers={"Sec-CH-DPR": "2", "If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status_code == 304
+        assert "Accept-CH" in response.headers
+
+    def test_clamped_to_source(self):
+        # seagull.jpg is 1280 pixels wide, the hints ask for 2560 of them
+        hints = {"Sec-CH-Viewport-Width": "1000", "Sec-CH-DPR": "2"}
+        response = self.client.get("/tests/images/seagull.jpg", headers=hints)
+        assert Image.open(BytesIO(response.data)).width == 1280
+        assert response.headers["Content-DPR"] == "1.28"
+
+        response = self.client.get(
+            "/tests/images/seagull.jpg",
+            headers=dict(hints, **{"If-None-Match": response.headers["ETag"]}),
+        )
+        assert response.status_code == 304
+        assert "Content-DPR" not in response.headers
+
+        # a rendition bound by a height as well can't tell why it is narrower
+        response = self.client.get(
+            "/tests/images/seagull.jpg?resize=1000x900,no-scale-up", headers=hints
+        )
+        assert Image.open(BytesIO(response.data)).width == 1280
+        assert "Content-DPR" not in response.headers
+
+        status, headers, body = asgi_get(
+            "/tests/images/seagull.jpg",
+            headers=[(b"sec-ch-viewport-width", b"1000"), (b"sec-ch-dpr", b"2")],
+        )
+        assert Image.open(BytesIO(body)).width == 1280
+        assert headers["content-dpr"] == "1.28"
+
+    def test_without_hints(self):
+        response = self.client.get("/tests/images/seagull.jpg?resize=300x")
+        assert Image.open(BytesIO(response.data)).width == 300
+        assert "Accept-CH" in response.headers
+        assert "Content-DPR" not in response.headers
+
+    def test_opt_in(self):
+        with patch("its.client_hints.CLIENT_HINTS", False):
+            response = self.client.get(
+                "/tests/images/seagull.jpg?resize=300x", headers={"DPR": "2"}
+            )
+        assert Image.open(BytesIO(response.data)).width == 300
+        assert "Accept-CH" not in response.headers
+
+    def test_asgi(self):
+        status, headers, _ = asgi_get(
+            "/tests/images/seagull.jpg", b"resize=300x", [(b"width", b"500")]
+        )
+        assert status == 200
+        assert headers["content-dpr"] == "1.067"
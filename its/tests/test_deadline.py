@@ -0,0 +1,82 @@
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.deadline import Deadline, deadline_scope, get_deadline, resample_filter
+from its.settings import NAMESPACES
+from its.tests.test_asgi import asgi_get
+
+
+class TestDeadline(TestCase):
+    def test_no_budget(self):
+        deadline = Deadline()
+        assert deadline.remaining() == float("inf")
+        assert not deadline.should_degrade()
+        assert not deadline.degraded
+
+    def test_should_degrade(self):
+        deadline = Deadline(0.1)
+        assert deadline.remaining() <= 0.1
+        assert deadline.should_degrade()
+        assert deadline.degraded
+
+    def test_scope(self):
+        assert get_deadline().remaining() == float("inf")
+        with deadline_scope(Deadline(0)):
+            assert resample_filter() == Image.BILINEAR
+        assert resample_filter() == Image.LANCZOS
+
+    def test_cheap_filters_are_not_degraded(self):
+        with deadline_scope(Deadline(0)) as deadline:
+            assert resample_filter(Image.BILINEAR) == Image.BILINEAR
+            assert resample_filter(Image.NEAREST) == Image.NEAREST
+        assert not deadline.degraded
+
+
+class TestDegradedResponses(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def test_full_quality(self):
+        response = self.client.get("tests/images/seagull.jpg?resize=100x")
+        assert response.headers["Cache-Control"] == "max-age=31536000"
+        assert "X-ITS-Degraded" not in response.headers
+
+    def test_degraded(self):
+        # less than ITS_DEGRADE_REMAINING, but time enough for a render process
+        with patch("its.application.REQUEST_BUDGET", 1):
+            response = self.client.get("tests/images/seagull.jpg?resize=100x")
+
+        assert response.status_code == 200
+        assert response.headers["X-ITS-Degraded"] == "1"
+        assert response.headers["Cache-Control"] == "max-age=60"
+        image = Image.open(BytesIO(response.data))
+        assert image.width == 100
+        assert "progressive" not in image.info
+
+    @patch("its.application.get_render_pool", return_value=None)
+    def test_bilinear_namespace(self, _):
+        with patch.dict(NAMESPACES["tests"], {"resample": "bilinear"}), patch(
+            "its.application.REQUEST_BUDGET", 0.001
+        ):
+            response = self.client.get("tests/images/test.png?resize=50x")
+
+        assert response.status_code == 200
+        assert "X-ITS-Degraded" not in response.headers
+        assert response.headers["Cache-Control"] == "max-age=31536000"
+
+    def test_degraded_asgi(self):
+        with patch("its.asgi.REQUEST_BUDGET", 0.001):
+            status, headers, body = asgi_get(
+                "/tests/images/seagull.jpg", b"resize=100x"
+            )
+
+        assert status == 200
+        assert headers["x-its-degraded"] == "1"
+        assert headers["cache-control"] == "max-age=60"
+        assert Image.open(BytesIO(body)).width == 100
@@ -0,0 +1,207 @@
+import tempfile
+import threading
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+from PIL import Image
+
+from its.application import APP
+from its.derivative_store import (
+    FileSystemDerivativeStore,
+    S3DerivativeStore,
+    create_derivative_store,
+)
+from its.errors import ConfigError
+from its.metrics import METRICS
+from its.render_cache import Rendition
+
+from .test_asgi import asgi_messages
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = (bytes(Body), ContentType)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body, content_type = self.objects[(Bucket, Key)]
+        return {
+            "Body": FakeBody(body),
+            "ContentLength": len(body),
+            "ContentType": content_type,
+        }
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if key.startswith(Prefix))
+        for start in range(0, len(keys), 2):
+            yield {"Contents": [{"Key": key} for key in keys[start : start + 2]]}
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            del self.objects[(Bucket, item["Key"])]
+
+
+class TestDerivativeStores(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        METRICS.reset()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_store(self, store):
+        assert store.read("ns/a.jpg?fit=10x10#") is None
+        store.put("ns/a.jpg?fit=10x10#", Rendition(b"\n" * 100000, "image/png"))
+        stored = store.read("ns/a.jpg?fit=10x10#")
+        assert (stored.mime_type, stored.length) == ("image/png", 100000)
+        assert stored.read() == b"\n" * 100000
+        assert METRICS.snapshot()["derivative_store.hit"] == 1
+
+    def test_file_system(self):
+        store = FileSystemDerivativeStore(self.directory.name)
+        self.check_store(store)
+
+    def test_s3(self):
+        client = FakeS3Client()
+        store = S3DerivativeStore("bucket", "/renditions/", client=client)
+        self.check_store(store)
+        [(bucket, key)] = client.objects
+        assert bucket == "bucket" and key.startswith("renditions/")
+
+    def check_purge(self, store):
+        for key in (
+            "ns/a.jpg?fit=10x10#",
+            "ns/a.jpg?fit=20x20#",
+            "ns/a.jpg/b.jpg?fit=10x10#",
+            "ns/c/d.jpg?fit=10x10#",
+            "ns/c/e.jpg?fit=10x10#",
+            "other/c/d.jpg?fit=10x10#",
+        ):
+            store.put(key, Rendition(b"a", "image/png"))
+        assert store.purge("ns/a.jpg") == 2
+        assert store.read("ns/a.jpg/b.jpg?fit=10x10#") is not None
+        assert store.purge("ns/c/") == 2
+        assert store.purge("ns/c/") == 0
+        assert store.read("other/c/d.jpg?fit=10x10#") is not None
+        assert store.purge("ns/") == 1
+
+    def test_file_system_purge(self):
+        self.check_purge(FileSystemDerivativeStore(self.directory.name))
+
+    def test_s3_purge(self):
+        client = FakeS3Client()
+        self.check_purge(S3DerivativeStore("bucket", "renditions", client=client))
+        assert len(client.objects) == 1
+
+    def test_failing_store_is_a_miss(self):
+        store = FileSystemDerivativeStore(self.directory.name)
+        with patch.object(store, "get", side_effect=OSError("disk on fire")):
+            assert store.read("key") is None
+        assert METRICS.snapshot()["derivative_store.read_error"] == 1
+
+    def test_writes_are_dropped_when_pending(self):
+        store = FileSystemDerivativeStore(self.directory.name, writers=1, pending=1)
+        release = threading.Event()
+        put = store.put
+
+        def slow_put(key, rendition):
+            release.wait(5)
+            put(key, rendition)
+
+        with patch.object(store, "put", slow_put):
+            assert store.write_behind("a", Rendition(b"a", "image/png"))
+            assert not store.write_behind("b", Rendition(b"b", "image/png"))
+            release.set()
+            store.flush()
+
+        assert store.read("a").read() == b"a"
+        assert store.read("b") is None
+        assert METRICS.snapshot()["derivative_store.dropped"] == 1
+        assert store.write_behind("b", Rendition(b"b", "image/png"))
+        store.flush()
+
+    def test_create(self):
+        assert create_derivative_store("") is None
+        store = create_derivative_store("file://" + self.directory.name)
+        assert store.root == self.directory.name
+        store = create_derivative_store("s3://bucket/prefix")
+        assert (store.bucket, store.prefix) == ("bucket", "prefix")
+        with self.assertRaises(ConfigError):
+            create_derivative_store("/no/scheme")
+
+
+class TestDerivativeStoreRequests(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = FileSystemDerivativeStore(self.directory.name)
+        for module in ("its.application", "its.asgi"):
+            patcher = patch(module + ".get_derivative_store", return_value=self.store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_renditions_are_stored_and_served(self):
+        response = self.client.get("tests/images/seagull.jpg?resize=100x")
+        rendered = response.get_data()
+        self.store.flush()
+
+        with patch("its.application.loader") as loader:
+            response = self.client.get("tests/images/seagull.jpg?resize=100x")
+            assert not loader.called
+        assert response.mimetype == "image/jpeg"
+        assert response.headers["Content-Length"] == str(len(rendered))
+        assert response.get_data() == rendered
+        assert Image.open(BytesIO(response.get_data())).width == 100
+
+    def test_asgi_streams_stored_renditions(self):
+        response = self.client.get("tests/images/seagull.jpg?resize=100x")
+        rendered = response.get_data()
+        self.store.flush()
+
+        with patch("its.asgi.async_loader") as loader:
+            start, *bodies = asgi_messages("/tests/images/seagull.jpg", b"resize=100x")
+            assert not loader.called
+        headers = dict(start["headers"])
+        assert headers[b"content-length"] == str(len(rendered)).encode()
+        assert all(body["more_body"] for body in bodies[:-1])
+        assert b"".join(body["body"] for body in bodies) == rendered
+
+    def test_degraded_renditions_are_not_stored(self):
+        with patch("its.application.REQUEST_BUDGET", 1):
+            response = self.client.get("tests/images/seagull.jpg?resize=90x")
+            response.get_data()
+        assert response.headers["X-ITS-Degraded"] == "1"
+        self.store.flush()
+
+        with patch("its.application.loader", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get("tests/images/seagull.jpg?resize=90x")
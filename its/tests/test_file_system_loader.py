@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.errors import NotFoundError
+from its.loaders.file_system import FileSystemLoader, MappedFile
+from its.settings import NAMESPACES
+from its.tests.test_asgi import asgi_get
+
+
+class TestMappedFile(TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.img_dir = Path(__file__).parent / "images"
+
+    def test_file_object(self):
+        path = self.img_dir / "test.png"
+        data = path.read_bytes()
+        mapped = MappedFile(path)
+        assert len(mapped) == len(data)
+        assert mapped.read(8) == data[:8]
+        assert mapped.tell() == 8
+        mapped.seek(-4, os.SEEK_END)
+        assert mapped.read() == data[-4:]
+        mapped.seek(0)
+        assert mapped.getvalue() == data
+        assert mapped.getbuffer().readonly
+
+    def test_open_with_pillow(self):
+        image = Image.open(MappedFile(self.img_dir / "seagull.jpg"))
+        image.load()
+        assert image.format == "JPEG"
+
+
+class TestFileSystemLoader(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "mounted"))
+        shutil.copy(
+            str(Path(__file__).parent / "images" / "test.png"),
+            os.path.join(self.root, "mounted", "test.png"),
+        )
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root)
+
+    def test_configurable_root(self):
+        config = {"mounted": {"loader": "file_system", "root": self.root}}
+        with patch.dict(NAMESPACES, config):
+            image = FileSystemLoader.load_image("mounted", "test.png")
+            assert isinstance(image.fp, MappedFile)
+
+            config["mounted"]["mmap"] = False
+            image = FileSystemLoader.load_image("mounted", "test.png")
+            assert isinstance(image.fp, BytesIO)
+
+    def test_path_traversal(self):
+        with self.assertRaises(NotFoundError):
+            FileSystemLoader.get_path("tests", "../../setup.py")
+
+    def test_conditional_requests(self):
+        url = "tests/images/test.png?resize=50x"
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+        assert response.status_code == 200
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert not response.data
+
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+
+        response = self.client.get(
+            "tests/images/test.png?resize=60x", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+        response = self.client.get(
+            url, headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}
+        )
+        assert response.status_code == 200
+
+    def test_conditional_requests_asgi(self):
+        _, headers, _ = asgi_get("/tests/images/test.png", b"resize=50x")
+        status, _, body = asgi_get(
+            "/tests/images/test.png",
+            b"resize=50x",
+            headers=[(b"if-none-match", headers["etag"].encode())],
+        )
+        assert status == 304
+        assert body == b""
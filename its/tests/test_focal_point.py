@@ -0,0 +1,122 @@
+import json
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from its.application import APP
+from its.deadline import Deadline, deadline_scope
+from its.errors import ConfigError
+from its.focal_point import FOCAL_POINTS, FocalPointIndex, auto_focal_point
+from its.metrics import METRICS
+from its.transformations import FitTransform
+
+
+def busy_image(box):
+    """
+    Flat image with a bundle of lines in `box`.
+    """
+    image = Image.new("RGB", (1600, 900), (90, 120, 150))
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = box
+    for offset in range(0, right - left, 12):
+        draw.line((left + offset, top, left, bottom - offset), fill="white", width=3)
+    return image
+
+
+class TestAutoFocalPoint(TestCase):
+    def setUp(self):
+        FOCAL_POINTS.clear()
+        METRICS.reset()
+
+    def test_salient_region(self):
+        x, y = auto_focal_point(busy_image((1150, 150, 1450, 450)))
+        assert 70 <= x <= 85 and 15 <= y <= 35
+        x, y = auto_focal_point(busy_image((100, 500, 400, 800)))
+        assert 10 <= x <= 25 and 60 <= y <= 85
+
+    def test_flat_images_use_the_center(self):
+        assert auto_focal_point(Image.new("RGB", (300, 200), "red")) == (50, 50)
+        assert auto_focal_point(Image.new("L", (1, 1))) == (50, 50)
+
+    def test_memoized_per_source(self):
+        first = auto_focal_point(busy_image((1150, 150, 1450, 450)), "ns/a.jpg")
+        # a flat image would use the center, the memoized point wins
+        assert auto_focal_point(Image.new("RGB", (160, 90)), "ns/a.jpg") == first
+
+    def test_late_requests(self):
+        image = busy_image((1150, 150, 1450, 450))
+        with deadline_scope(Deadline(0.005)):
+            assert auto_focal_point(image, "ns/b.jpg") == (50, 50)
+        assert METRICS.snapshot()["focal_point.late"] == 1
+
+        # the fallback isn't remembered for the next crops
+        assert FOCAL_POINTS.get("ns/b.jpg") is None
+        assert auto_focal_point(image, "ns/b.jpg") != (50, 50)
+
+    def test_fit(self):
+        image = busy_image((1150, 150, 1450, 450))
+        image.info["filename"] = "busy.png"
+        cropped = FitTransform.apply_transform(image, ["400", "400", "auto"])
+        centered = FitTransform.apply_transform(image, ["400", "400"])
+        assert cropped.size == (400, 400)
+
+        def lines(crop):
+            return crop.convert("L").histogram()[255]
+
+        # the center crop cuts the lines off
+        assert lines(cropped) > lines(centered)
+
+    def test_request(self):
+        APP.config["TESTING"] = True
+        response = APP.test_client().get("tests/images/seagull.jpg?crop=120x80,auto")
+        assert response.status_code == 200
+        assert Image.open(BytesIO(response.get_data())).size == (120, 80)
+
+
+class TestFocalPointIndex(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "focal_points.json")
+        self.index = FocalPointIndex("file://" + str(self.path), ttl=60)
+
+    def write(self, points):
+        self.path.write_text(json.dumps(points))
+
+    def test_reloaded_after_ttl(self):
+        self.write({"ns/a.jpg": [10, 90]})
+        assert self.index.get("ns", "a.jpg") == (10, 90)
+        assert self.index.get("ns", "b.jpg") is None
+
+        self.write({"ns/a.jpg": [20, 80]})
+        assert self.index.get("ns", "a.jpg") == (10, 90)
+        with patch("its.focal_point.time.monotonic", return_value=10 ** 9):
+            assert self.index.get("ns", "a.jpg") == (20, 80)
+
+    def test_broken_index_keeps_the_previous_one(self):
+        self.write({"ns/a.jpg": [10, 90]})
+        assert self.index.get("ns", "a.jpg") == (10, 90)
+        self.path.write_text("{")
+        with patch("its.focal_point.time.monotonic", return_value=10 ** 9):
+            assert self.index.get("ns", "a.jpg") == (10, 90)
+
+    def test_location(self):
+        with self.assertRaises(ConfigError):
+            FocalPointIndex("/focal_points.json")
+
+    def test_index_wins_over_filename(self):
+        self.write({"tests/busy_focus-90x90.png": [0, 0]})
+        image = busy_image((1150, 150, 1450, 450))
+        image.info.update(namespace="tests", filename="busy_focus-90x90.png")
+        with patch("its.focal_point.FOCAL_POINTS_INDEX", self.index):
+            cropped = FitTransform.apply_transform(image, ["100", "100"])
+        assert (
+            cropped.tobytes()
+            == image.crop((0, 0, 900, 900))
+            .resize((100, 100), Image.ANTIALIAS)
+            .tobytes()
+        )
@@ -0,0 +1,186 @@
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from PIL import Image
+
+from its.application import APP
+from its.errors import SourceTooLargeError
+from its.info import INFO_CACHE, source_info
+from its.loader import load_header
+from its.loaders.base import is_whole_range
+from its.loaders.http import HTTPLoader
+from its.loaders.s3_loader import S3Loader
+from its.streaming import iter_buffer
+
+from .test_asgi import asgi_get
+from .test_source_reader import Chunks
+
+IMAGES = Path(__file__).parent / "images"
+
+
+def http_response(status_code, content, headers=None):
+    return Mock(
+        status_code=status_code,
+        content=content,
+        headers=headers or {},
+        iter_content=lambda size: iter_buffer(content, size),
+    )
+
+
+class TestInfo(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def setUp(self):
+        INFO_CACHE.clear()
+
+    def test_info(self):
+        response = self.client.get("/tests/images/seagull.jpg?info&resize=10x")
+        assert response.status_code == 200
+        assert response.mimetype == "application/json"
+        info = response.get_json()
+        with Image.open(IMAGES / "seagull.jpg") as image:
+            assert (info["width"], info["height"]) == image.size
+        assert info["format"] == "JPEG"
+        assert info["mime_type"] == "image/jpeg"
+        assert info["mode"] == "RGB"
+        assert info["alpha"] is False
+        assert len(info["focal_point"]) == 2
+        assert info["dominant_color"].startswith("#")
+
+        response = self.client.get(
+            "/tests/images/seagull.jpg?info",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status_code == 304
+
+    def test_alpha_and_filename_focal_point(self):
+        info = self.client.get(
+            "/tests/images/white_image_with_transparent_background.png?info"
+        ).get_json()
+        assert info["alpha"] is True
+        assert info["dominant_color"] == "#ffffff"
+
+        info = self.client.get("/tests/images/seagull_focus-10x90.jpg?info").get_json()
+        assert info["focal_point"] == [10, 90]
+
+    def test_cached_per_source(self):
+        first = source_info("tests", "images/seagull.jpg", "v1")
+        with patch("its.info.load_header") as load_header:
+            assert source_info("tests", "images/seagull.jpg", "v1") == first
+            assert not load_header.called
+
+    def test_header_only(self):
+        with patch("its.info.loader") as loader:
+            response = self.client.get("/tests/images/seagull.jpg?info=header")
+            assert not loader.called
+        info = response.get_json()
+        assert (info["width"], info["height"]) == (1280, 874)
+        assert "dominant_color" not in info
+
+        response = self.client.get("/tests/images/seagull.jpg?info=everything")
+        assert response.status_code == 400
+
+    def test_errors(self):
+        assert self.client.get("/tests/images/missing.jpg?info").status_code == 404
+        assert (
+            self.client.get("/tests/images/wikipedia_logo.svg?info").status_code == 400
+        )
+        assert self.client.get("/station-images/a.jpg?info").status_code == 400
+
+    def test_asgi(self):
+        status, headers, body = asgi_get("/tests/images/test.png", b"info")
+        assert status == 200
+        assert b'"format": "PNG"' in body
+
+
+class TestHeaderFetch(TestCase):
+    def setUp(self):
+        self.loader = HTTPLoader("merlin", {"prefixes": ["s3.amazonaws.com"]})
+        self.session = Mock()
+        patcher = patch.object(self.loader, "get_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.source = (IMAGES / "seagull.jpg").read_bytes()
+
+    def partial_response(self, size):
+        return http_response(
+            206,
+            self.source[:size],
+            {"Content-Range": "bytes 0-{}/{}".format(size - 1, len(self.source))},
+        )
+
+    def test_range(self):
+        self.session.get.return_value = self.partial_response(4096)
+        with patch("its.loader.get_image_loader", return_value=self.loader):
+            image = load_header("merlin", "s3.amazonaws.com/a.jpg", 4096)
+        assert self.session.get.call_args[1]["headers"] == {"Range": "bytes=0-4095"}
+        assert image.size == (1280, 874)
+
+    def test_header_larger_than_the_range(self):
+        self.session.get.side_effect = [
+            self.partial_response(1024),
+            http_response(200, self.source),
+        ]
+        with patch("its.loader.get_image_loader", return_value=self.loader):
+            image = load_header("merlin", "s3.amazonaws.com/a.jpg", 1024)
+        assert image.size == (1280, 874)
+        assert self.session.get.call_count == 2
+
+    def test_origin_without_ranges(self):
+        self.session.get.return_value = http_response(200, self.source)
+        file_obj, complete = self.loader.get_header(
+            "merlin", "s3.amazonaws.com/a.jpg", 1024
+        )
+        assert complete
+        assert file_obj.getvalue() == self.source
+
+    def test_reads_stop_after_the_range(self):
+        # an origin that answers the range with all of the source
+        response = self.partial_response(len(self.source))
+        response.iter_content = Chunks(self.source)
+        self.session.get.return_value = response
+        file_obj, complete = self.loader.get_header(
+            "merlin", "s3.amazonaws.com/a.jpg", 4096
+        )
+        assert not complete
+        assert len(file_obj.getvalue()) < len(self.source)
+        assert response.iter_content.read == 4096
+        assert response.close.called
+
+    def test_max_bytes(self):
+        self.loader.max_bytes = 1024
+        self.session.get.return_value = http_response(200, self.source)
+        with self.assertRaises(SourceTooLargeError):
+            self.loader.get_header("merlin", "s3.amazonaws.com/a.jpg", 1024)
+
+    @patch.dict("its.settings.NAMESPACES", {"s3": {"bucket": "bucket"}})
+    def test_s3(self):
+        s3 = S3Loader("s3", {"bucket": "bucket"})
+        body = Mock(iter_chunks=Chunks(self.source))
+        client = Mock()
+        client.get_object.return_value = {
+            "Body": body,
+            "ContentLength": len(self.source),
+            "ContentRange": "bytes 0-{}/{}".format(
+                len(self.source) - 1, len(self.source)
+            ),
+        }
+        with patch.object(s3, "get_client", return_value=client):
+            file_obj, complete = s3.get_header("s3", "a.jpg", 4096)
+            assert not complete
+            assert body.iter_chunks.read == 4096
+            assert body.close.called
+
+            s3.max_bytes = 1024
+            with self.assertRaises(SourceTooLargeError):
+                s3.get_header("s3", "a.jpg", 4096)
+
+    def test_whole_range(self):
+        assert is_whole_range("bytes 0-99/100", 100, 1024)
+        assert not is_whole_range("bytes 0-1023/5000", 1024, 1024)
+        assert is_whole_range(None, 100, 1024)
+        assert not is_whole_range(None, 1024, 1024)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from its.errors import ConfigError
+from its.loader import get_image_loader
+from its.loaders import BaseLoader, FileSystemLoader, HTTPLoader
+from its.loaders.registry import bind_namespaces, build_registry
+
+
+class TestLoaderRegistry(TestCase):
+    def test_builtin_loaders(self):
+        registry = build_registry()
+        assert registry["file_system"] is FileSystemLoader
+        assert registry["http"] is HTTPLoader
+
+    def test_entry_point_plugins(self):
+        class PluginLoader(BaseLoader):
+            slug = "plugin"
+
+        entry_point = MagicMock()
+        entry_point.name = "plugin"
+        entry_point.load.return_value = PluginLoader
+        with patch(
+            "its.loaders.registry.iter_entry_points", return_value=[entry_point]
+        ):
+            registry = build_registry()
+        assert registry["plugin"] is PluginLoader
+
+        entry_point.load.return_value = object
+        with patch(
+            "its.loaders.registry.iter_entry_points", return_value=[entry_point]
+        ):
+            with self.assertRaises(ConfigError):
+                build_registry()
+
+    def test_duplicate_slugs(self):
+        class DuplicateLoader(FileSystemLoader):
+            pass
+
+        with self.assertRaises(ConfigError):
+            build_registry()
+
+        # keep the duplicate from leaking into later registries
+        DuplicateLoader.slug = None
+
+    def test_bind_namespaces(self):
+        registry = build_registry()
+        bound = bind_namespaces(
+            {
+                "fast": {"loader": "http", "prefixes": ["a.example.com"], "timeout": 1},
+                "slow": {"loader": "http", "prefixes": ["b.example.com"]},
+                "moved": {"redirect": True, "url": "https://example.com/"},
+            },
+            registry,
+        )
+        assert set(bound) == {"fast", "slow"}
+        assert bound["fast"] is not bound["slow"]
+        assert bound["fast"].timeout == 1
+        assert bound["fast"].get_session() is not bound["slow"].get_session()
+
+    def test_misconfigured_namespaces(self):
+        registry = build_registry()
+        with self.assertRaises(ConfigError):
+            bind_namespaces({"bad": {"loader": "ftp"}}, registry)
+        with self.assertRaises(ConfigError):
+            bind_namespaces({"bad": {"loader": "http"}}, registry)
+        with self.assertRaises(ConfigError):
+            bind_namespaces({"bad": {"loader": "s3"}}, registry)
+        with self.assertRaises(ConfigError):
+            bind_namespaces(
+                {"bad": {"loader": "file_system", "resample": "sharpest"}}, registry
+            )
+
+    def test_get_image_loader(self):
+        assert isinstance(get_image_loader("tests"), FileSystemLoader)
+        assert get_image_loader("tests") is get_image_loader("tests")
+        with self.assertRaises(ConfigError):
+            get_image_loader("station-images")
@@ -0,0 +1,228 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from unittest import TestCase
+from unittest.mock import patch
+
+from its.application import APP
+from its.errors import ITSLoaderError, OriginUnavailableError
+from its.loaders.http import HTTPLoader
+from its.metrics import METRICS
+from its.origins import CLOSED, HALF_OPEN, OPEN, Origin
+
+from .test_asgi import asgi_get
+
+IMAGE = (Path(__file__).parent / "images" / "test.png").read_bytes()
+SVG = (Path(__file__).parent / "images" / "wikipedia_logo.svg").read_bytes()
+
+
+class TestOrigin(TestCase):
+    def fetch(self, origin, status):
+        with origin.fetch() as fetch:
+            fetch.status = status
+
+    def test_opens_on_error_rate(self):
+        METRICS.reset()
+        origin = Origin("origin", min_fetches=4, error_rate=0.5, open_seconds=60)
+        for status in (200, 500, 404):
+            self.fetch(origin, status)
+        assert origin.state == CLOSED
+        with self.assertRaises(ValueError), origin.fetch():
+            raise ValueError("connection reset")
+        assert origin.state == OPEN
+        assert METRICS.snapshot()["origin.origin.breaker"] == 2
+
+        with self.assertRaises(OriginUnavailableError) as raised:
+            self.fetch(origin, 200)
+        assert raised.exception.status_code == 503
+        assert 50 < raised.exception.retry_after <= 60
+        assert METRICS.snapshot()["origin.origin.rejected"] == 1
+
+    def test_old_fetches_leave_the_window(self):
+        origin = Origin("origin", window=0.01, min_fetches=2, error_rate=0.5)
+        self.fetch(origin, 500)
+        time.sleep(0.02)
+        self.fetch(origin, 500)
+        assert origin.state == CLOSED
+
+    def test_slow_fetches_fail(self):
+        origin = Origin("origin", min_fetches=1, slow=0.01)
+        # a large source downloads long after a timely answer
+        with origin.fetch() as fetch:
+            fetch.status = 200
+            time.sleep(0.02)
+        assert origin.state == CLOSED
+
+        with origin.fetch() as fetch:
+            time.sleep(0.02)
+            fetch.status = 200
+        assert origin.state == OPEN
+
+    def test_half_open(self):
+        origin = Origin("origin", min_fetches=1, open_seconds=0.01)
+        self.fetch(origin, 503)
+        time.sleep(0.02)
+
+        # a single trial is let through
+        trial = origin.acquire()
+        assert trial and origin.state == HALF_OPEN
+        with self.assertRaises(OriginUnavailableError):
+            origin.acquire()
+        origin.release(trial, failed=True)
+        assert origin.state == OPEN
+
+        time.sleep(0.02)
+        self.fetch(origin, 200)
+        assert origin.state == CLOSED
+
+    def test_in_flight_limit(self):
+        origin = Origin("origin", max_fetches=1, queue_seconds=0.01)
+        trial = origin.acquire()
+        with self.assertRaises(OriginUnavailableError) as raised:
+            origin.acquire()
+        assert "busy" in raised.exception.message
+        origin.release(trial, failed=False)
+        self.fetch(origin, 200)
+        assert origin.in_flight == 0
+
+        # fetches wait for a slot to be freed
+        origin.queue_seconds = 1
+        trial = origin.acquire()
+        threading.Timer(0.05, origin.release, (trial, False)).start()
+        self.fetch(origin, 200)
+        assert origin.in_flight == 0
+
+        # unlimited fetches don't take one
+        trial = origin.acquire()
+        with origin.fetch(limited=False) as fetch:
+            fetch.status = 200
+        origin.release(trial, failed=False)
+
+
+class FlakyOrigin(ThreadingMixIn, HTTPServer):
+    """
+    Stand-in origin that answers, fails or hangs, as the test needs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FlakyHandler)
+        self.status = 200
+        self.release = threading.Event()
+        self.release.set()
+        self.requests = 0
+
+    @property
+    def host(self):
+        return "127.0.0.1:{port}".format(port=self.server_address[1])
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.requests += 1
+        self.server.release.wait(5)
+        if self.server.status != 200:
+            body = b"down"
+        else:
+            body = SVG if self.path.endswith(".svg") else IMAGE
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFlakyOrigin(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+        self.server = FlakyOrigin()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def setUp(self):
+        self.server.status = 200
+        self.server.requests = 0
+        self.loader = HTTPLoader("flaky", {"prefixes": [""], "timeout": 1})
+        self.origin = Origin(
+            self.server.host,
+            max_fetches=2,
+            queue_seconds=0.1,
+            min_fetches=3,
+            open_seconds=0.2,
+        )
+        url = "http://{host}/".format(host=self.server.host)
+        for patcher in (
+            patch.dict("its.origins._ORIGINS", {self.server.host: self.origin}),
+            patch.dict("its.settings.NAMESPACES", {"flaky": {"prefixes": [""]}}),
+            patch.dict("its.loader.NAMESPACE_LOADERS", {"flaky": self.loader}),
+            patch.object(HTTPLoader, "get_url", staticmethod(lambda ns, fn: url + fn)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_breaker(self):
+        assert self.client.get("/flaky/a.png?resize=10x").status_code == 200
+
+        self.server.status = 503
+        for _ in range(3):
+            with self.assertRaises(ITSLoaderError):
+                self.loader.load_image("flaky", "a.png")
+        assert self.origin.state == OPEN
+
+        # the origin isn't asked again while the breaker is open
+        requests = self.server.requests
+        response = self.client.get("/flaky/a.png?resize=10x")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert self.server.requests == requests
+        status, headers, _ = asgi_get("/flaky/a.png", b"resize=10x")
+        assert (status, headers["retry-after"]) == (503, "1")
+
+        self.server.status = 200
+        time.sleep(0.2)
+        status, _, _ = asgi_get("/flaky/a.png", b"resize=10x")
+        assert status == 200
+        assert self.origin.state == CLOSED
+
+    def test_svg_passthrough_asgi(self):
+        status, headers, body = asgi_get("/flaky/logo.svg")
+        assert status == 200
+        assert headers["content-type"] == "image/svg+xml"
+        assert headers["content-length"] == str(len(SVG))
+        assert body == SVG
+
+    def test_hanging_origin(self):
+        self.server.release.clear()
+        self.addCleanup(self.server.release.set)
+        fetches = [
+            threading.Thread(target=self.client.get, args=("/flaky/a.png",))
+            for _ in range(2)
+        ]
+        for fetch in fetches:
+            fetch.start()
+        while self.origin.in_flight < 2:
+            time.sleep(0.01)
+
+        # other requests fail soon instead of waiting on the origin too
+        start = time.monotonic()
+        assert self.client.get("/flaky/b.png").status_code == 503
+        assert time.monotonic() - start < 0.5
+
+        for fetch in fetches:
+            fetch.join()
+        # the fetches timed out, which isn't mistaken for a broken source
+        with self.assertRaises(ITSLoaderError) as raised:
+            self.loader.load_image("flaky", "a.png")
+        assert raised.exception.status_code == 502
+        assert self.origin.in_flight == 0
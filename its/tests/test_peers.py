@@ -0,0 +1,215 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import requests
+
+from its.peers import (
+    NODE_HEADER,
+    HashRing,
+    broadcast,
+    forward,
+    peer_for,
+    resolve_peers,
+)
+
+from .test_asgi import asgi_get
+
+ROOT = Path(__file__).parents[2]
+SOURCES = (
+    "abe.jpg",
+    "abstract.png",
+    "five.png",
+    "grayscale.png",
+    "logo.png",
+    "middle.png",
+    "seagull_focus-10x90.jpg",
+    "seagull_focus-90x90.jpg",
+    "test.jpeg",
+    "test.png",
+    "top_left.png",
+    "vertical-line.png",
+)
+
+SERVER = """
+import sys
+from werkzeug.serving import run_simple
+from its.application import APP
+run_simple("127.0.0.1", int(sys.argv[1]), APP, threaded=True)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_node(port, peers):
+    env = dict(os.environ, ITS_PEERS=",".join(peers))
+    env["ITS_PEER_SELF"] = "127.0.0.1:{}".format(port)
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(port)],
+        cwd=str(ROOT),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("ITS didn't start on port {}".format(port))
+
+
+class TestHashRing(TestCase):
+    def test_spread(self):
+        ring = HashRing(["a:5000", "b:5000", "c:5000"])
+        owners = Counter(ring.owner("tests/{}.jpg".format(i)) for i in range(3000))
+        assert set(owners) == {"a:5000", "b:5000", "c:5000"}
+        assert min(owners.values()) > 700
+
+    def test_adding_a_peer_moves_its_share(self):
+        keys = ["tests/{}.jpg".format(i) for i in range(3000)]
+        before = HashRing(["a:5000", "b:5000", "c:5000"])
+        after = HashRing(["a:5000", "b:5000", "c:5000", "d:5000"])
+        moved = [key for key in keys if before.owner(key) != after.owner(key)]
+        assert all(after.owner(key) == "d:5000" for key in moved)
+        assert len(moved) < len(keys) / 3
+
+    def test_empty(self):
+        assert HashRing([]).owner("tests/a.jpg") is None
+
+    def test_resolve_peers(self):
+        infos = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.2", 5000)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.1", 5000)),
+        ]
+        with patch("its.peers.socket.getaddrinfo", return_value=infos):
+            assert resolve_peers("its.local:5000") == ["10.0.0.1:5000", "10.0.0.2:5000"]
+
+
+class TestPeerFor(TestCase):
+    def setUp(self):
+        for name, value in (
+            ("PEERS", ["a:5000", "b:5000"]),
+            ("_RING", HashRing(["a:5000", "b:5000"])),
+            ("_DOWN", {}),
+        ):
+            patcher = patch("its.peers." + name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.owner = HashRing(["a:5000", "b:5000"]).owner("tests/images/test.png")
+        other = "b:5000" if self.owner == "a:5000" else "a:5000"
+        patcher = patch("its.peers._SELF", other)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_owner(self):
+        assert peer_for("tests", "images/test.png", {}) == self.owner
+        assert peer_for("tests", "images/test.png", {"X-ITS-Forwarded": "b"}) is None
+        with patch("its.peers._SELF", self.owner):
+            assert peer_for("tests", "images/test.png", {}) is None
+
+    def test_down(self):
+        session = Mock()
+        session.get.side_effect = requests.ConnectionError("refused")
+        with patch("its.peers.get_session", return_value=session):
+            assert forward(self.owner, "/tests/images/test.png?", {}) is None
+        assert peer_for("tests", "images/test.png", {}) is None
+
+    def test_server_error(self):
+        session = Mock()
+        session.get.return_value = Mock(status_code=503, headers={}, content=b"")
+        with patch("its.peers.get_session", return_value=session):
+            assert forward(self.owner, "/tests/images/test.png?", {}) is None
+        # a busy peer still owns its sources
+        assert peer_for("tests", "images/test.png", {}) == self.owner
+
+    def test_broadcast(self):
+        session = Mock()
+        session.post.return_value = Mock(status_code=200)
+        headers = {"Authorization": "Bearer secret"}
+        with patch("its.peers.get_session", return_value=session):
+            assert broadcast("/admin/purge/tests/", headers) == {self.owner: "200"}
+            assert broadcast("/admin/purge/tests/", {"X-ITS-Forwarded": "a"}) == {}
+        assert session.post.call_args[1]["headers"]["Authorization"] == "Bearer secret"
+
+
+class TestCluster(TestCase):
+    """
+    Two ITS nodes of a three node ring, the third is down.
+    """
+
+    @classmethod
+    def setUpClass(self):
+        ports = [free_port() for _ in range(3)]
+        peers = ["127.0.0.1:{}".format(port) for port in ports]
+        self.ring = ring = HashRing(peers)
+        self.down = ring.owner("tests/images/seagull.jpg")
+        self.nodes = {
+            peer: "http://{}".format(peer) for peer in peers if peer != self.down
+        }
+        self.processes = [
+            start_node(int(peer.split(":")[1]), peers) for peer in self.nodes
+        ]
+        # a source each node owns
+        self.sources = {}
+        for name in SOURCES:
+            owner = ring.owner("tests/images/" + name)
+            self.sources.setdefault(owner, "/tests/images/" + name)
+
+    @classmethod
+    def tearDownClass(self):
+        for process in self.processes:
+            process.kill()
+            process.wait()
+
+    def test_forwarded_to_owner(self):
+        owners = [owner for owner in self.nodes if owner in self.sources]
+        assert owners
+        for owner in owners:
+            path = self.sources[owner] + "?resize=100x"
+            responses = [requests.get(url + path) for url in self.nodes.values()]
+            assert [response.headers[NODE_HEADER] for response in responses] == [
+                owner
+            ] * len(self.nodes)
+            assert len({response.content for response in responses}) == 1
+
+            not_modified = [
+                requests.get(
+                    url + path,
+                    headers={"If-None-Match": responses[0].headers["ETag"]},
+                )
+                for url in self.nodes.values()
+            ]
+            assert {response.status_code for response in not_modified} == {304}
+
+    def test_owner_down(self):
+        for node, url in self.nodes.items():
+            response = requests.get(url + "/tests/images/seagull.jpg?resize=100x")
+            assert response.status_code == 200
+            assert response.headers[NODE_HEADER] == node
+
+    def test_not_found(self):
+        for url in self.nodes.values():
+            assert requests.get(url + "/tests/images/missing.jpg").status_code == 404
+
+    def test_asgi(self):
+        owner = next(owner for owner in self.nodes if owner in self.sources)
+        with patch("its.peers.PEERS", list(self.ring.peers)), patch(
+            "its.peers._RING", self.ring
+        ), patch("its.peers._SELF", self.down), patch("its.peers._DOWN", {}):
+            status, headers, _ = asgi_get(self.sources[owner], b"resize=100x")
+        assert status == 200
+        assert headers[NODE_HEADER.lower()] == owner
@@ -7,12 +7,14 @@ from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter, ImageStat
 
 import its.errors
 from its.application import APP
 from its.optimize import has_transparent_background, optimize
 from its.pipeline import process_transforms
+from its.render import decode, finish, prepare, query_region
+from its.transformations.blur import gaussian_blur
 
 
 def get_pixels(image):
@@ -301,6 +303,128 @@ class TestResizeTransform(TestCase):
             optimize(result, query)
 
 
+def mean_difference(first, second):
+    return sum(ImageStat.Stat(ImageChops.difference(first, second)).mean) / 3
+
+
+class TestBlurTransform(TestCase):
+    @classmethod
+    def setUpClass(self):
+        image = Image.open(Path(__file__).parent / "images" / "seagull.jpg")
+        self.image = image.convert("RGB")
+
+    def test_large_radius_matches_full_resolution_blur(self):
+        for radius in (20, 60):
+            expected = self.image.filter(ImageFilter.GaussianBlur(radius))
+            blurred = gaussian_blur(self.image, radius)
+            assert blurred.size == self.image.size
+            assert mean_difference(blurred, expected) < 1
+
+    def test_blur_after_resize(self):
+        query = {"blur": "20", "resize": "320x"}
+        blurred = process_transforms(self.image.copy(), dict(query))
+        # the way blurs were applied before: at full resolution, then resized
+        expected = self.image.filter(ImageFilter.GaussianBlur(20)).resize(
+            blurred.size, Image.LANCZOS
+        )
+        assert blurred.width == 320
+        assert mean_difference(blurred.convert("RGB"), expected) < 2
+
+    def test_radius_is_capped(self):
+        capped = process_transforms(self.image.copy(), {"blur": "100000"})
+        expected = gaussian_blur(self.image, 0.1 * max(self.image.size))
+        assert mean_difference(capped, expected) < 1
+
+    def test_negative_radius(self):
+        with self.assertRaises(its.errors.ITSClientError):
+            process_transforms(self.image.copy(), {"blur": "-1"})
+
+
+class TestRegionDecoding(TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.img_dir = Path(__file__).parent / "images"
+        self.seagull_png = BytesIO()
+        Image.open(self.img_dir / "seagull.jpg").save(self.seagull_png, "PNG")
+
+    def open(self, name):
+        if name == "seagull.png":
+            return Image.open(BytesIO(self.seagull_png.getvalue()))
+        return Image.open(self.img_dir / name)
+
+    def full_decode(self, name, query):
+        # how fits were rendered before: from all of the source
+        image = decode(self.open(name), "tests", "images/" + name)
+        return finish(image, dict(query))[0]
+
+    def test_expected_fixtures(self):
+        for expected, name, query in (
+            ("seagull-500-500-50-10.jpg", "seagull.jpg", {"fit": "500x500x50x10"}),
+            (
+                "seagull-500-500-10-90.jpg",
+                "seagull_focus-10x90.jpg",
+                {"crop": "500x500"},
+            ),
+        ):
+            result = prepare(self.open(name), query, "tests", "images/" + name)[0]
+            expected = Image.open(self.img_dir / "expected" / expected)
+            assert result.size == expected.size
+            assert mean_difference(result, expected.convert("RGB")) < 2
+
+    def test_matches_full_decode(self):
+        for name in ("seagull.jpg", "seagull.png", "abe.jpg"):
+            for query in (
+                {"crop": "300x300x90x10"},
+                {"fit": "100x100"},
+                {"crop": "40x400x0x100"},
+                {"fit": "600x100x50x50", "format": "png"},
+            ):
+                result = prepare(self.open(name), dict(query), "tests", name)[0]
+                expected = self.full_decode(name, query)
+                assert result.size == expected.size
+                assert result.mode == expected.mode
+                # libjpeg's scaled decoding looks a little different
+                assert mean_difference(result, expected) < 3, (name, query)
+
+    def test_decodes_the_region(self):
+        image = self.open("seagull.png")
+        region = query_region(image, {"crop": "300x300x90x10"}, "tests", "a.png")
+        assert tuple(round(value, 1) for value in region) == (365.4, 0, 1239.4, 874)
+        decoded = decode(image, "tests", "a.png", region=region)
+        assert decoded.size == (875, 874)
+        assert decoded.info["source_region"] == (365, 0, 1240, 874)
+
+        image = self.open("seagull.png")
+        region = query_region(image, {"crop": "100x50"}, "tests", "a.png")
+        decoded = decode(image, "tests", "a.png", region=region)
+        assert image.size == (1280, 874)
+        assert decoded.size == (1280, 640)
+
+        # nor are pixels of JPEGs finer than the fit needs
+        image = self.open("seagull.jpg")
+        query = {"crop": "100x100x90x10"}
+        result, _, _ = prepare(image, query, "tests", "a.jpg")
+        assert image.size == (320, 219)
+        assert result.size == (100, 100)
+
+    def test_regions(self):
+        image = self.open("seagull.jpg")
+        for query in (
+            {"resize": "100x100", "fit": "100x100"},
+            {"crop": "100x100,auto"},
+            {"crop": "100x100x101x0"},
+            {"crop": "axb"},
+            {"blur": "10"},
+        ):
+            assert query_region(image, query, "tests", "a.jpg") is None
+        assert query_region(image, {"crop": "100x100"}, "tests", "a_focus-0x0.jpg") == (
+            0,
+            0,
+            874,
+            874,
+        )
+
+
 class TestImageResults(TestCase):
     @classmethod
     def setUpClass(self):
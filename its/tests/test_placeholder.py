@@ -0,0 +1,103 @@
+import base64
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.cache import LRUCache
+from its.placeholder import (
+    BASE83,
+    PLACEHOLDER_CACHE,
+    blurhash,
+    source_placeholder,
+)
+from its.pyramid import Pyramid
+from its.source_cache import source_key
+
+from .test_asgi import asgi_get
+
+IMAGES = Path(__file__).parent / "images"
+
+
+def decode_data_uri(data_uri):
+    header, _, data = data_uri.partition(",")
+    return header, Image.open(BytesIO(base64.b64decode(data)))
+
+
+class TestPlaceholder(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def setUp(self):
+        PLACEHOLDER_CACHE.clear()
+
+    def test_placeholder(self):
+        response = self.client.get("/tests/images/seagull.jpg?placeholder&resize=10x")
+        assert response.status_code == 200
+        placeholder = response.get_json()
+        assert (placeholder["width"], placeholder["height"]) == (32, 22)
+        header, image = decode_data_uri(placeholder["data_uri"])
+        assert header == "data:image/jpeg;base64"
+        assert image.size == (32, 22)
+        assert len(placeholder["blurhash"]) == 28
+        assert placeholder["blurhash"][0] == "L"  # 4x3 components
+
+    def test_crop_and_format(self):
+        placeholder = self.client.get(
+            "/tests/images/seagull.jpg?placeholder&crop=900x1600&format=webp"
+        ).get_json()
+        assert (placeholder["width"], placeholder["height"]) == (18, 32)
+        header, image = decode_data_uri(placeholder["data_uri"])
+        assert header == "data:image/webp;base64"
+        assert image.size == (18, 32)
+        # 3x4 components for portraits
+        assert placeholder["blurhash"][0] == "T"
+
+    def test_alpha(self):
+        placeholder = self.client.get(
+            "/tests/images/white_image_with_transparent_background.png?placeholder"
+        ).get_json()
+        header, image = decode_data_uri(placeholder["data_uri"])
+        assert header == "data:image/png;base64"
+        assert image.mode == "RGBA"
+
+    def test_blurhash_average_color(self):
+        value = 0
+        for char in blurhash(Image.new("RGB", (32, 20), (200, 30, 90)))[2:6]:
+            value = value * 83 + BASE83.index(char)
+        assert value == (200 << 16) + (30 << 8) + 90
+
+    def test_cached_pyramid_level(self):
+        with Image.open(IMAGES / "seagull.jpg") as image:
+            pyramid = Pyramid(image.convert("RGB"))
+        cache = LRUCache("source", 2 ** 28, sizeof=lambda pyramid: pyramid.max_nbytes())
+        cache.set(source_key("tests", "images/seagull.jpg", "v1"), pyramid)
+
+        with patch("its.placeholder.SOURCE_CACHE", cache):
+            with patch("its.placeholder.loader") as loader:
+                placeholder = source_placeholder(
+                    "tests", "images/seagull.jpg", "v1", {"placeholder": ""}
+                )
+                assert not loader.called
+        assert (placeholder["width"], placeholder["height"]) == (32, 22)
+        # the shared level is left as it was
+        assert min(level.width for level in pyramid.levels) >= 64
+
+    def test_errors(self):
+        for query in (
+            "placeholder=tiny",
+            "placeholder&format=gif",
+            "placeholder&crop=x",
+        ):
+            response = self.client.get("/tests/images/seagull.jpg?" + query)
+            assert response.status_code == 400
+
+    def test_asgi(self):
+        status, _, body = asgi_get("/tests/images/test.png", b"placeholder")
+        assert status == 200
+        assert b'"blurhash"' in body
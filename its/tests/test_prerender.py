@@ -0,0 +1,83 @@
+import json
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from its.application import APP
+from its.derivative_store import FileSystemDerivativeStore
+from its.prerender import main, parse_manifest
+
+
+class TestPrerender(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = FileSystemDerivativeStore(str(Path(self.directory.name, "store")))
+
+    def run_main(self, lines, *args):
+        manifest = Path(self.directory.name, "manifest.jsonl")
+        manifest.write_text("\n".join(lines))
+        stdout, stderr = StringIO(), StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            status = main(
+                [
+                    str(manifest),
+                    "--processes",
+                    "1",
+                    "--store",
+                    "file://" + self.store.root,
+                ]
+                + list(args)
+            )
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_parse_manifest(self):
+        sources = parse_manifest(
+            [
+                "/tests/images/seagull.jpg?resize=100x",
+                "# comment",
+                json.dumps({"url": "/tests/images/seagull.jpg?resize=100x"}),
+                json.dumps(
+                    {
+                        "namespace": "tests",
+                        "filename": "images/test.png",
+                        "renditions": ["crop=10x10", {"resize": "20x"}],
+                    }
+                ),
+            ]
+        )
+        assert sources == {
+            ("tests", "images/seagull.jpg"): [{"resize": "100x"}],
+            ("tests", "images/test.png"): [{"fit": "10x10"}, {"resize": "20x"}],
+        }
+
+        with self.assertRaises(ValueError):
+            parse_manifest(['{"namespace": "tests"}'])
+
+    def test_renditions_are_stored(self):
+        lines = [
+            "/tests/images/seagull.jpg?resize=100x",
+            "/tests/images/seagull.jpg?crop=50x50&format=webp",
+            "/tests/images/missing.jpg?resize=100x",
+        ]
+        status, stdout, stderr = self.run_main(lines)
+        assert status == 1
+        assert "rendered 2 renditions of 2 sources" in stdout
+        assert "1 sources failed" in stdout
+        assert "failed tests/images/missing.jpg" in stderr
+
+        APP.config["TESTING"] = True
+        with patch("its.application.get_derivative_store", return_value=self.store):
+            with patch("its.application.loader") as loader:
+                response = APP.test_client().get(
+                    "tests/images/seagull.jpg?crop=50x50&format=webp"
+                )
+                assert not loader.called
+        assert response.mimetype == "image/webp"
+
+        status, stdout, _ = self.run_main(lines[:2])
+        assert status == 0
+        assert "2 were already stored" in stdout
@@ -0,0 +1,143 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from its import purge as purge_module
+from its.application import APP
+from its.cache import LRUCache, source_tags
+from its.errors import ITSClientError
+from its.derivative_store import FileSystemDerivativeStore
+from its.info import INFO_CACHE
+from its.purge import check_purge_log, main, purge, purge_tag, sync_purges
+from its.render_cache import Rendition
+
+from .test_batch import render_cache
+
+
+class TestTags(TestCase):
+    def test_source_tags(self):
+        assert source_tags("tests", "images/a.jpg") == (
+            "tests/",
+            "tests/images/",
+            "tests/images/a.jpg",
+        )
+
+    def test_purge(self):
+        cache = LRUCache("test", 3)
+        cache.set("a", 1, tags=source_tags("ns", "a.jpg"))
+        cache.set("b", 2, tags=source_tags("ns", "folder/b.jpg"))
+        cache.set("c", 3)
+        assert cache.purge("ns/folder/") == 1
+        assert cache.get("b") is None
+        assert (cache.get("a"), cache.get("c")) == (1, 3)
+        assert cache.size == 2
+        assert cache.purge("ns/") == 1
+        assert cache.purge("ns/a.jpg") == 0
+
+    def test_evicted_entries_are_untagged(self):
+        cache = LRUCache("test", 1)
+        cache.set("a", 1, tags=("ns/a.jpg",))
+        cache.set("b", 2, tags=("ns/b.jpg",))
+        assert cache.purge("ns/a.jpg") == 0
+        assert cache._tagged == {"ns/b.jpg": {"b"}}
+
+    def test_purge_tag(self):
+        assert purge_tag("tests", "images/a.jpg") == "tests/images/a.jpg"
+        assert purge_tag("tests", "images/") == "tests/images/"
+        assert purge_tag("tests", "") == "tests/"
+        with self.assertRaises(ITSClientError):
+            purge_tag("unknown", "a.jpg")
+
+
+class TestPurge(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def setUp(self):
+        INFO_CACHE.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_endpoint(self):
+        path = "/admin/purge/tests/images/seagull.jpg"
+        assert self.client.post(path).status_code == 404
+
+        store = FileSystemDerivativeStore(self.directory.name)
+        store.put("tests/images/seagull.jpg?resize=10x#", Rendition(b"a", "image/png"))
+        store.put("tests/images/test.png?resize=10x#", Rendition(b"b", "image/png"))
+        with render_cache() as cache, patch(
+            "its.purge.PURGED_CACHES", (cache, INFO_CACHE)
+        ), patch("its.purge.get_derivative_store", return_value=store), patch(
+            "its.application.ADMIN_TOKEN", "secret"
+        ):
+            for url in (
+                "/tests/images/seagull.jpg?resize=10x",
+                "/tests/images/seagull.jpg?info",
+                "/tests/images/test.png?resize=10x",
+            ):
+                # renditions are cached once they're sent
+                assert self.client.get(url).data
+            assert (len(cache), len(INFO_CACHE)) == (2, 1)
+
+            response = self.client.post(
+                path, headers={"Authorization": "Bearer secret"}
+            )
+            assert response.status_code == 200
+            assert response.get_json()["purged"] == {
+                "render": 1,
+                "info": 1,
+                "derivative_store": 1,
+            }
+            assert (len(cache), len(INFO_CACHE)) == (1, 0)
+            assert store.read("tests/images/test.png?resize=10x#") is not None
+
+            response = self.client.post(
+                "/admin/purge/tests/", headers={"Authorization": "Bearer secret"}
+            )
+            assert response.get_json()["purged"]["render"] == 1
+            assert response.get_json()["purged"]["derivative_store"] == 1
+
+            response = self.client.post(
+                "/admin/purge/unknown/a.jpg", headers={"Authorization": "Bearer secret"}
+            )
+            assert response.status_code == 400
+
+    def test_purge_log(self):
+        log = Path(self.directory.name) / "purges"
+        cache = LRUCache("test", 10)
+        with patch("its.purge.PURGE_LOG", str(log)), patch(
+            "its.purge.PURGED_CACHES", (cache,)
+        ), patch("its.purge._LOG_OFFSET", None), patch("its.purge._LOG_CHECKED", 0.0):
+            sync_purges()
+            cache.set("a", 1, tags=("tests/a.jpg",))
+            cache.set("b", 1, tags=("tests/b.jpg",))
+
+            # another worker
+            purge("tests/a.jpg")
+            cache.set("a", 1, tags=("tests/a.jpg",))
+            purge_module._LOG_CHECKED = 0.0
+            sync_purges()
+            assert cache.get("a") is None
+            assert cache.get("b") == 1
+            assert log.read_text() == "tests/a.jpg\n"
+
+    def test_purge_log_warning(self):
+        with patch("its.purge.worker_processes", return_value=4), patch(
+            "its.purge.PURGE_LOG", ""
+        ), self.assertLogs("its.purge", "WARNING") as logs:
+            check_purge_log()
+        assert "not of the 3 others" in logs.output[0]
+
+        with patch("its.purge.worker_processes", return_value=4), patch(
+            "its.purge.PURGE_LOG", "/var/run/its/purges"
+        ), patch.object(purge_module.LOGGER, "warning") as warning:
+            check_purge_log()
+        warning.assert_not_called()
+
+    def test_cli(self):
+        with patch("its.purge.get_derivative_store", return_value=None):
+            assert main(["tests/images/seagull.jpg", "tests/"]) == 0
+            assert main(["unknown/a.jpg"]) == 1
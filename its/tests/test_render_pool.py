@@ -0,0 +1,114 @@
+import threading
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP
+from its.errors import ITSClientError, ITSRenderTimeoutError
+from its.loader import loader
+from its.render_pool import RenderPool, RenderProcess
+
+
+class TestRenderPool(TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.pool = RenderPool(1, slot_bytes=2 ** 20)
+
+    @classmethod
+    def tearDownClass(self):
+        self.pool.close()
+
+    def test_render(self):
+        image = loader("tests", "images/seagull.jpg")
+        output, mime_type = self.pool.render(
+            image, {"resize": "100x", "format": "png"}, "tests", "images/seagull.jpg"
+        )
+        assert mime_type == "image/png"
+        assert Image.open(output).width == 100
+
+    def test_source_larger_than_slot(self):
+        pool = RenderPool(1, slot_bytes=1024)
+        try:
+            image = loader("tests", "images/test.png")
+            output, _ = pool.render(
+                image, {"resize": "10x"}, "tests", "images/test.png"
+            )
+            assert Image.open(output).width == 10
+        finally:
+            pool.close()
+
+    def test_client_errors_are_raised_in_worker(self):
+        image = loader("tests", "images/test.png")
+        with self.assertRaises(ITSClientError):
+            self.pool.render(image, {"resize": "bad"}, "tests", "images/test.png")
+
+    def test_runaway_render_is_killed_and_replaced(self):
+        image = loader("tests", "images/seagull.jpg")
+        with self.assertRaises(ITSRenderTimeoutError):
+            self.pool.render(
+                image, {"blur": "100"}, "tests", "images/seagull.jpg", timeout=0.01
+            )
+
+        # the replacement process serves the next request
+        image = loader("tests", "images/test.png")
+        output, _ = self.pool.render(image, {"resize": "10x"}, "tests", "test.png")
+        assert Image.open(output).width == 10
+
+    def test_processes_are_replaced_off_the_request_thread(self):
+        started = []
+
+        class Recorded(RenderProcess):
+            def __init__(self, *args):
+                started.append(threading.current_thread())
+                super().__init__(*args)
+
+        image = loader("tests", "images/seagull.jpg")
+        with patch("its.render_pool.RenderProcess", Recorded):
+            with self.assertRaises(ITSRenderTimeoutError):
+                self.pool.render(
+                    image, {"blur": "100"}, "tests", "images/seagull.jpg", timeout=0.01
+                )
+            output, _ = self.pool.render(image, {"resize": "10x"}, "tests", "a.jpg")
+        assert Image.open(output).width == 10
+        assert started == [self.pool._supervisor]
+        # and aren't forked from this threaded process
+        assert self.pool._context.get_start_method() == "forkserver"
+
+    def test_timeout_response(self):
+        APP.config["TESTING"] = True
+        client = APP.test_client()
+        with patch("its.application.get_render_pool", return_value=self.pool):
+            with patch("its.application.RENDER_TIMEOUT", 0.01):
+                response = client.get("tests/images/seagull.jpg?blur=100")
+            assert response.status_code == 503
+
+            response = client.get("tests/images/seagull.jpg?resize=50x")
+            assert response.status_code == 200
+            assert Image.open(BytesIO(response.data)).width == 50
+
+    def test_renders_end_with_the_request(self):
+        APP.config["TESTING"] = True
+        client = APP.test_client()
+        with patch("its.application.get_render_pool", return_value=self.pool), patch(
+            "its.application.REQUEST_BUDGET", 2
+        ), patch.object(self.pool, "render", wraps=self.pool.render) as render:
+            response = client.get("tests/images/seagull.jpg?resize=50x")
+            assert response.status_code == 200
+            assert render.call_args[0][4] <= 2
+
+            # requests out of time are rendered degraded without a process
+            with patch("its.application.REQUEST_BUDGET", -1):
+                response = client.get("tests/images/seagull.jpg?resize=40x")
+            assert response.status_code == 200
+            assert response.headers["X-ITS-Degraded"] == "1"
+            assert render.call_count == 1
+
+    def test_no_time_left(self):
+        image = loader("tests", "images/test.png")
+        worker = self.pool._idle.queue[0]
+        with self.assertRaises(ITSRenderTimeoutError):
+            self.pool.render(image, {"resize": "10x"}, "tests", "test.png", timeout=0)
+        # no process was taken, let alone killed
+        assert self.pool._idle.queue[0] is worker
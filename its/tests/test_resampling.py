@@ -0,0 +1,68 @@
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image, ImageOps
+
+from its.application import APP
+from its.errors import ConfigError, ITSClientError
+from its.pipeline import process_transforms
+from its.resampling import Resampling, get_resampling, parse_resampling
+from its.settings import NAMESPACES
+from its.transformations import FitTransform
+
+SEAGULL = Path(__file__).parent / "images" / "seagull.jpg"
+
+
+class TestResampling(TestCase):
+    def test_parse(self):
+        assert parse_resampling("lanczos") == Resampling(Image.LANCZOS)
+        assert parse_resampling("Bicubic,2") == Resampling(Image.BICUBIC, 2.0)
+        for value in ("", "box", "bilinear,0.5", "bilinear,2,3", "nearest,nan"):
+            with self.assertRaises(ValueError):
+                parse_resampling(value)
+
+    def test_namespace_default(self):
+        with patch.dict(NAMESPACES, {"fast": {"resample": "bilinear,3"}}):
+            assert get_resampling("fast") == Resampling(Image.BILINEAR, 3.0)
+            # requests choose their own
+            assert get_resampling("fast", "nearest") == Resampling(Image.NEAREST)
+        assert get_resampling("tests") == Resampling(Image.LANCZOS)
+
+        with patch.dict(NAMESPACES, {"broken": {"resample": "sharpest"}}):
+            with self.assertRaises(ConfigError):
+                get_resampling("broken")
+        with self.assertRaises(ITSClientError):
+            get_resampling("tests", "sharpest")
+
+    def test_resize(self):
+        image = Image.open(SEAGULL)
+        image.load()
+        resized = process_transforms(
+            image.copy(), {"resize": "100x", "resample": "nearest"}
+        )
+        expected = image.resize(resized.size, Image.NEAREST)
+        assert resized.tobytes() == expected.tobytes()
+
+    def test_fit_matches_image_ops(self):
+        image = Image.open(SEAGULL)
+        image.info["filename"] = "seagull.jpg"
+        for size, focal_point in (((300, 100), (20, 70)), ((90, 160), (100, 0))):
+            fitted = FitTransform.apply_transform(
+                image, [str(size[0]), str(size[1])] + [str(v) for v in focal_point]
+            )
+            expected = ImageOps.fit(
+                image, size, Image.LANCZOS, centering=[v / 100 for v in focal_point]
+            )
+            assert fitted.tobytes() == expected.tobytes()
+
+    def test_request(self):
+        APP.config["TESTING"] = True
+        client = APP.test_client()
+        response = client.get("tests/images/seagull.jpg?crop=120x80&resample=bicubic,2")
+        assert response.status_code == 200
+        assert Image.open(BytesIO(response.get_data())).size == (120, 80)
+
+        response = client.get("tests/images/seagull.jpg?resize=120x&resample=box")
+        assert response.status_code == 400
@@ -0,0 +1,171 @@
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from PIL import Image
+
+from its.application import APP, load_source
+from its.cache import LRUCache
+from its.errors import ITSLoaderError, NotFoundError
+from its.pyramid import Pyramid
+from its.source_cache import (
+    SOURCE_REQUESTS,
+    cache_pyramid,
+    get_pyramid,
+    source_key,
+    stale_windows,
+)
+
+from .test_asgi import asgi_get
+
+
+@contextmanager
+def source_cache():
+    cache = LRUCache("source", 2 ** 28, sizeof=lambda pyramid: pyramid.max_nbytes())
+    SOURCE_REQUESTS.clear()
+    with patch("its.application.SOURCE_CACHE", cache):
+        with patch("its.asgi.SOURCE_CACHE", cache):
+            with patch("its.source_cache.SOURCE_CACHE", cache):
+                yield cache
+
+
+class TestSourceCache(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+
+    def test_pyramid_size(self):
+        pyramid = Pyramid(Image.new("RGB", (1024, 512)))
+        pyramid.level_for((1, 1))
+        assert pyramid.nbytes() <= pyramid.max_nbytes()
+        assert pyramid.max_nbytes() == 1024 * 512 * 4
+
+    @patch("its.application.get_render_pool", return_value=None)
+    def test_popular_sources_are_cached(self, _):
+        path = "tests/images/seagull.jpg?resize=100x"
+        with source_cache() as cache:
+            first = self.client.get(path).get_data()
+            assert len(cache) == 0
+
+            second = self.client.get(path).get_data()
+            assert len(cache) == 1
+            [pyramid] = [entry[0] for entry in cache._entries.values()]
+
+            with patch("its.application.loader") as loader:
+                response = self.client.get("tests/images/seagull.jpg?resize=50x")
+                assert not loader.called
+            assert Image.open(BytesIO(response.get_data())).width == 50
+            assert len(pyramid.levels) > 1
+
+        assert Image.open(BytesIO(first)).size == Image.open(BytesIO(second)).size
+
+    def test_asgi(self):
+        with source_cache() as cache:
+            for _ in range(3):
+                status, _, body = asgi_get(
+                    "/tests/images/seagull.jpg", b"resize=100x&format=png"
+                )
+                assert status == 200
+                assert Image.open(BytesIO(body)).size[0] == 100
+            assert len(cache) == 1
+
+    def test_admin_hook(self):
+        path = "/admin/pyramids/tests/images/seagull.jpg"
+        with source_cache() as cache:
+            assert self.client.post(path).status_code == 404
+
+            with patch("its.application.ADMIN_TOKEN", "secret"):
+                response = self.client.post(
+                    path, headers={"Authorization": "Bearer wrong"}
+                )
+                assert response.status_code == 403
+
+                response = self.client.post(
+                    path, headers={"Authorization": "Bearer secret"}
+                )
+                assert response.status_code == 200
+                levels = response.get_json()["levels"]
+                assert len(levels) > 3
+                assert min(levels[-1]) < 128
+                assert len(cache) == 1
+
+
+@patch("its.source_cache.SOURCE_CACHE_TTL", 0.01)
+class TestStaleSources(TestCase):
+    def setUp(self):
+        self.image = Image.new("RGB", (64, 64))
+
+    def expire(self, cache):
+        pyramid = cache_pyramid(self.image, "tests", "a.jpg", None)
+        time.sleep(0.02)
+        assert cache.get(source_key("tests", "a.jpg", None)) is None
+        return pyramid
+
+    def test_stale_windows(self):
+        with patch.dict(
+            "its.source_cache.NAMESPACES", {"stale": {"stale_if_error": 60}}
+        ), patch("its.source_cache.SOURCE_STALE_WHILE_REVALIDATE", 10.0):
+            assert stale_windows("stale") == (10, 60)
+            assert stale_windows("tests") == (10, 0)
+
+    @patch("its.source_cache.SOURCE_STALE_WHILE_REVALIDATE", 60.0)
+    def test_stale_while_revalidate(self):
+        fresh = Image.new("RGB", (32, 32))
+        loaded = threading.Event()
+        release = threading.Event()
+
+        def slow_loader(namespace, filename):
+            loaded.set()
+            release.wait(5)
+            return fresh
+
+        with source_cache() as cache, patch(
+            "its.source_cache.loader", side_effect=slow_loader
+        ) as loader:
+            stale = self.expire(cache)
+            # every request is served stale while the source is refreshed once
+            assert get_pyramid("tests", "a.jpg", None) is stale
+            assert get_pyramid("tests", "a.jpg", None) is stale
+            assert loaded.wait(5)
+            release.set()
+            for _ in range(100):
+                pyramid = get_pyramid("tests", "a.jpg", None)
+                if pyramid is not stale:
+                    break
+                time.sleep(0.01)
+            assert pyramid.levels[0].size == (32, 32)
+            assert loader.call_count == 1
+
+    @patch("its.source_cache.SOURCE_STALE_WHILE_REVALIDATE", 60.0)
+    def test_revalidated_source_is_gone(self):
+        with source_cache() as cache, patch(
+            "its.source_cache.loader", side_effect=NotFoundError("gone")
+        ):
+            self.expire(cache)
+            assert get_pyramid("tests", "a.jpg", None) is not None
+            for _ in range(100):
+                if not cache.get_stale(source_key("tests", "a.jpg", None)):
+                    break
+                time.sleep(0.01)
+            assert get_pyramid("tests", "a.jpg", None) is None
+
+    @patch("its.application.get_render_pool", return_value=None)
+    @patch("its.source_cache.SOURCE_STALE_IF_ERROR", 60.0)
+    def test_stale_if_error(self, _):
+        with source_cache() as cache:
+            stale = self.expire(cache)
+            with patch(
+                "its.application.loader",
+                side_effect=ITSLoaderError("origin failed", status_code=500),
+            ):
+                assert load_source("tests", "a.jpg", None) is stale
+
+            # the source isn't served stale when it is missing or not an image
+            with patch(
+                "its.application.loader", side_effect=NotFoundError("gone")
+            ), self.assertRaises(NotFoundError):
+                load_source("tests", "a.jpg", None)
@@ -0,0 +1,131 @@
+import struct
+import zlib
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from PIL import Image
+
+from its.errors import ITSClientError, ITSInvalidImageFileError, SourceTooLargeError
+from its.loader import loader
+from its.loaders.base import SourceReader
+from its.loaders.http import HTTPLoader
+from its.loaders.s3_loader import S3Loader
+from its.streaming import iter_buffer
+
+IMAGES = Path(__file__).parent / "images"
+
+MP4 = b"\x00\x00\x00\x18ftypmp42" + bytes(2 ** 20)
+
+
+def png_chunk(kind, data):
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+# the header of a 100000x100000 PNG, followed by the start of its pixels
+HUGE_PNG = (
+    b"\x89PNG\r\n\x1a\n"
+    + png_chunk(b"IHDR", struct.pack(">IIBBBBB", 100000, 100000, 8, 2, 0, 0, 0))
+    + struct.pack(">I", 2 ** 30)
+    + b"IDAT"
+    + bytes(2 ** 20)
+)
+
+
+class Chunks:
+    """
+    Yields a body in chunks and counts how many were read.
+    """
+
+    def __init__(self, body, size=4096):
+        self.body = body
+        self.size = size
+        self.read = 0
+
+    def __call__(self, *args):
+        for chunk in iter_buffer(self.body, self.size):
+            self.read += len(chunk)
+            yield chunk
+
+
+class TestSourceReader(TestCase):
+    def read(self, chunks, max_bytes=0, length=None):
+        reader = SourceReader(max_bytes, length)
+        for chunk in chunks():
+            reader.feed(chunk)
+        return reader.finish()
+
+    def test_image(self):
+        source = (IMAGES / "seagull.jpg").read_bytes()
+        image = Image.open(self.read(Chunks(source)))
+        image.load()
+        assert image.size == (1280, 874)
+
+    def test_not_an_image(self):
+        chunks = Chunks(MP4)
+        with self.assertRaises(ITSInvalidImageFileError):
+            self.read(chunks)
+        assert chunks.read == 4096
+
+        with self.assertRaises(ITSInvalidImageFileError):
+            self.read(Chunks(b"GIF89a"))
+
+    def test_too_many_pixels(self):
+        chunks = Chunks(HUGE_PNG)
+        with self.assertRaises(Image.DecompressionBombError):
+            self.read(chunks)
+        assert chunks.read == 16 * 1024
+
+    def test_max_bytes(self):
+        source = (IMAGES / "seagull.jpg").read_bytes()
+        with self.assertRaises(SourceTooLargeError):
+            SourceReader(len(source) - 1, len(source))
+
+        chunks = Chunks(source)
+        with self.assertRaises(SourceTooLargeError):
+            self.read(chunks, max_bytes=10000)
+        assert chunks.read == 12288
+
+
+class TestStreamedLoaders(TestCase):
+    def test_http(self):
+        http = HTTPLoader("merlin", {"prefixes": ["s3.amazonaws.com"]})
+        session = Mock()
+        response = Mock(status_code=200, headers={}, iter_content=Chunks(MP4))
+        session.get.return_value = response
+
+        with patch.object(http, "get_session", return_value=session), patch(
+            "its.loader.get_image_loader", return_value=http
+        ):
+            with self.assertRaises(ITSClientError) as raised:
+                loader("merlin", "s3.amazonaws.com/a.mp4")
+            assert "not a supported file type" in raised.exception.message
+            assert response.iter_content.read < len(MP4)
+            assert response.close.called
+
+            http.max_bytes = 1024
+            response.headers = {"Content-Length": str(len(MP4))}
+            with self.assertRaises(ITSClientError) as raised:
+                loader("merlin", "s3.amazonaws.com/a.mp4")
+            assert "too large" in raised.exception.message
+
+    @patch.dict("its.settings.NAMESPACES", {"s3": {"bucket": "bucket"}})
+    def test_s3(self):
+        s3 = S3Loader("s3", {"bucket": "bucket", "max_bytes": 1024})
+        source = (IMAGES / "seagull.jpg").read_bytes()
+        body = Mock(iter_chunks=Chunks(source))
+        client = Mock()
+        client.get_object.return_value = {"Body": body, "ContentLength": len(source)}
+        with patch.object(s3, "get_client", return_value=client):
+            with self.assertRaises(SourceTooLargeError):
+                s3.load_image("s3", "a.jpg")
+            assert body.iter_chunks.read == 0
+            assert body.close.called
+
+            s3.max_bytes = 0
+            assert s3.load_image("s3", "a.jpg").size == (1280, 874)
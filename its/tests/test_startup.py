@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from pathlib import Path
+from unittest import TestCase
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+class TestStartup(TestCase):
+    def test_heavy_dependencies_are_imported_lazily(self):
+        code = (
+            "import sys; import its.wsgi; "
+            "print(','.join(name for name in "
+            "('boto3', 'botocore', 'enforce', 'sentry_sdk', 'aiohttp') "
+            "if name in sys.modules))"
+        )
+        output = subprocess.check_output(
+            [sys.executable, "-c", code], cwd=str(ROOT), stderr=subprocess.DEVNULL
+        )
+        assert output.decode().strip() == ""
@@ -0,0 +1,87 @@
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from its.application import APP
+from its.streaming import iter_buffer, iter_encoded, peek_image_size
+
+
+class TestStreaming(TestCase):
+    def test_iter_buffer(self):
+        chunks = list(iter_buffer(b"abcdefg", chunk_size=3))
+        assert chunks == [b"abc", b"def", b"g"]
+        assert all(isinstance(chunk, bytes) for chunk in chunks)
+
+    def test_iter_encoded(self):
+        image = Image.open(Path(__file__).parent / "images" / "seagull.jpg")
+        image.load()
+        expected = BytesIO()
+        image.save(expected, format="PNG")
+
+        chunks = list(iter_encoded(image, {"format": "PNG"}))
+        assert len(chunks) > 1
+        assert b"".join(chunks) == expected.getvalue()
+
+    def test_peek_image_size(self):
+        image = Image.new("RGB", (300, 200))
+        encoded = BytesIO()
+        image.save(encoded, format="PNG")
+
+        size, body = peek_image_size(iter_buffer(encoded.getvalue(), chunk_size=10))
+        assert size == (300, 200)
+        assert b"".join(body) == encoded.getvalue()
+
+        size, body = peek_image_size([b"<svg/>"] * 3, max_bytes=12)
+        assert size is None
+        assert b"".join(body) == b"<svg/>" * 3
+
+    def test_encoding_errors_are_raised_before_streaming(self):
+        image = Image.new("P", (10, 10))
+        with self.assertRaises(OSError):
+            iter_encoded(image, {"format": "JPEG"})
+
+    def test_closed_stream_stops_the_encoder(self):
+        image = Image.open(Path(__file__).parent / "images" / "seagull.jpg")
+        image.load()
+        threads = threading.active_count()
+        body = iter_encoded(image, {"format": "PNG"})
+        body.close()
+        for _ in range(50):
+            if threading.active_count() == threads:
+                break
+            time.sleep(0.01)
+        assert threading.active_count() == threads
+
+
+class TestStreamedResponses(TestCase):
+    @classmethod
+    def setUpClass(self):
+        APP.config["TESTING"] = True
+        self.client = APP.test_client()
+        self.img_dir = Path(__file__).parent / "images"
+
+    def test_encoded_while_sending(self):
+        with patch("its.application.get_render_pool", return_value=None):
+            response = self.client.get("tests/images/seagull.jpg?resize=100x")
+        assert response.is_streamed
+        assert "Content-Length" not in response.headers
+        assert Image.open(BytesIO(response.data)).width == 100
+
+    def test_rendered_buffer_has_length(self):
+        pool = MagicMock()
+        pool.render.return_value = (BytesIO(b"rendered"), "image/png")
+        with patch("its.application.get_render_pool", return_value=pool):
+            response = self.client.get("tests/images/seagull.jpg?resize=100x")
+        assert response.headers["Content-Length"] == "8"
+        assert response.data == b"rendered"
+
+    def test_svg_passthrough_has_length(self):
+        svg = (self.img_dir / "wikipedia_logo.svg").read_bytes()
+        response = self.client.get("tests/images/wikipedia_logo.svg")
+        assert response.headers["Content-Length"] == str(len(svg))
+        assert response.data == svg
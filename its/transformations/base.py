@@ -2,6 +2,8 @@ from typing import Sequence, Union
 
 from PIL import Image
 
+from ..resampling import Resampling
+
 
 class BaseTransform:
 
@@ -13,8 +15,15 @@ class BaseTransform:
 
     @staticmethod
     def apply_transform(
-        img: Image.Image, parameters: Sequence[Union[str, int]]
+        img: Image.Image,
+        parameters: Sequence[Union[str, int]],
+        resampling: Resampling = Resampling(),
+        scale: float = 1.0,
     ) -> Image.Image:
+        """
+        Transforms an image. Resizes use `resampling`, `scale` is how much the
+        image was resized since the source, whose pixels parameters refer to.
+        """
         raise NotImplementedError
 
     @staticmethod
@@ -1,12 +1,39 @@
-import re
+from math import sqrt
 from typing import Sequence
 
-from PIL import ImageFilter
+from PIL import Image, ImageFilter
 
 from ..errors import ITSClientError
-from ..settings import DELIMITERS_RE
+from ..resampling import Resampling
+from ..settings import BLUR_MAX_RADIUS
+from ..util import DELIMITERS
 from .base import BaseTransform
 
+# radii up to this are blurred at full resolution
+FAST_BLUR_MIN_RADIUS = 16
+
+# radius larger blurs have on the reduced copy they're blurred on
+REDUCED_RADIUS = 4
+
+
+def gaussian_blur(img: Image.Image, radius: float) -> Image.Image:
+    """
+    Gaussian blur whose cost doesn't grow with the radius. Large blurs are
+    applied to a copy reduced until the radius is REDUCED_RADIUS pixels and
+    scaled back up, which leaves no visible difference once the details are
+    blurred away (the mean difference to a full resolution blur is below 1/255).
+    """
+    if radius <= FAST_BLUR_MIN_RADIUS:
+        return img.filter(ImageFilter.GaussianBlur(radius))
+
+    factor = radius / REDUCED_RADIUS
+    size = (max(round(img.width / factor), 1), max(round(img.height / factor), 1))
+    reduced = img.resize(size, Image.BOX)
+    # box reduction blurs a little too, with a variance of factor²/12
+    reduced_radius = sqrt(radius ** 2 - factor ** 2 / 12) / factor
+    blurred = reduced.filter(ImageFilter.GaussianBlur(reduced_radius))
+    return blurred.resize(img.size, Image.BILINEAR)
+
 
 class BlurTransform(BaseTransform):
 
@@ -14,16 +41,22 @@ class BlurTransform(BaseTransform):
 
     @staticmethod
     def derive_parameters(query: str) -> Sequence[str]:
-        return re.split(DELIMITERS_RE, query)
+        return DELIMITERS.split(query)
 
-    def apply_transform(self, img, parameters):
+    def apply_transform(self, img, parameters, resampling=Resampling(), scale=1.0):
         """
-        Blurs the image from value passed in parameters
+        Blurs the image from value passed in parameters.
+        The radius is in source pixels, `scale` is how much the image was
+        resized since. Radii are capped at ITS_BLUR_MAX_RADIUS times the
+        longer side of the image.
         """
 
         try:
             blur = int(parameters[0])
         except ValueError:
             raise ITSClientError(error="blur requires valid value")
+        if blur < 0:
+            raise ITSClientError(error="blur radius can't be negative")
 
-        return img.filter(ImageFilter.GaussianBlur(blur))
+        radius = min(blur * scale, BLUR_MAX_RADIUS * max(img.size))
+        return gaussian_blur(img, radius)
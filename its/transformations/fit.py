@@ -1,63 +1,176 @@
 import logging
 import re
-from typing import Sequence, Union
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple, Union
 
-from PIL import Image, ImageOps
+from PIL import Image
 
 from ..errors import ITSClientError, ITSTransformError
-from ..settings import DELIMITERS_RE, FOCUS_KEYWORD
+from ..focal_point import auto_focal_point, indexed_focal_point
+from ..resampling import Resampling
+from ..settings import FOCUS_KEYWORD
+from ..util import DELIMITERS
 from .base import BaseTransform
 
 LOGGER = logging.getLogger(__name__)
 
 
-def _fit_image(img, crop_width, crop_height, focal_x, focal_y):
-    focal_x_percentage = focal_x / 100
-    focal_y_percentage = focal_y / 100
-    fitted_image = ImageOps.fit(
-        img,
-        (crop_width, crop_height),
-        method=Image.ANTIALIAS,
-        centering=(focal_x_percentage, focal_y_percentage),
+def _fit_box(
+    size: Tuple[int, int], target: Tuple[int, int], centering: Tuple[float, float]
+) -> Tuple[float, float, float, float]:
+    """
+    Largest box of the target's aspect ratio in an image of `size`, placed
+    about `centering` like ImageOps.fit places it.
+    """
+    width, height = size
+    ratio = target[0] / target[1]
+    # sub-pixel, like ImageOps.fit, rounding would shift the fit from its output
+    box_width, box_height = float(width), float(height)
+    if width / height > ratio:
+        box_width = ratio * height
+    elif width / height < ratio:
+        box_height = width / ratio
+
+    left = (width - box_width) * centering[0]
+    top = (height - box_height) * centering[1]
+    return (left, top, left + box_width, top + box_height)
+
+
+def _region_box(
+    box: Tuple[float, float, float, float],
+    region: Tuple[float, float, float, float],
+    size: Tuple[int, int],
+) -> Tuple[float, float, float, float]:
+    """
+    A box of the source in the pixels of an image of `size` decoded from the
+    `region` of the source.
+    """
+    scale_x = size[0] / (region[2] - region[0])
+    scale_y = size[1] / (region[3] - region[1])
+    return (
+        max(0, (box[0] - region[0]) * scale_x),
+        max(0, (box[1] - region[1]) * scale_y),
+        min(size[0], (box[2] - region[0]) * scale_x),
+        min(size[1], (box[3] - region[1]) * scale_y),
     )
+
+
+def _fit_image(img, crop_width, crop_height, focal_x, focal_y, resampling=Resampling()):
+    target = (crop_width, crop_height)
+    centering = (focal_x / 100, focal_y / 100)
+    region = img.info.get("source_region")
+    if region is None:
+        box = _fit_box(img.size, target, centering)
+    else:
+        # only the part of the source this fit keeps was decoded
+        box = _fit_box(img.info["source_size"], target, centering)
+        box = _region_box(box, region, img.size)
+    # ImageOps.fit resizes the same box, but can't use a reducing gap
+    fitted_image = resampling.resize(img, (crop_width, crop_height), box=box)
     fitted_image.format = img.format
 
     return fitted_image
 
 
-def _derive_focal_point(
-    img: Image.Image, query_parameters: Sequence[Union[str, int]]
-) -> Sequence[Union[str, int]]:
-    filename = img.info["filename"]
+# everything up to and including the keyword, and the file extension
+FOCUS_PREFIX_RE = re.compile(".+?(" + FOCUS_KEYWORD + ")", re.IGNORECASE)
+EXTENSION_RE = re.compile(r"(\.).+")
+
+
+@lru_cache(maxsize=4096)
+def filename_focal_point(filename: str) -> Optional[Tuple[str, ...]]:
+    """
+    Focal point named in a filename like image_focus-FXxFY.png, if any.
+    """
     # if FOCUS_KEYWORD is present in filename, do smart crop
-    if filename.find(FOCUS_KEYWORD) >= 0:  # smart crop
-        # match everything before and including the keyword
-        pre_keyword_pattern = ".+?(" + FOCUS_KEYWORD + ")"
-        # match the file type and period in the filename
-        file_ext_patten = r"(\.).+"
-        # Match and remove the non-argument filename parts using the patterns defined above
-        filename = re.sub(pre_keyword_pattern, "", filename, flags=re.IGNORECASE)
-        filename = re.sub(file_ext_patten, "", filename, flags=re.IGNORECASE)
-        return re.split(DELIMITERS_RE, filename)
+    if filename.find(FOCUS_KEYWORD) < 0:
+        return None
+    # Match and remove the non-argument filename parts using the patterns defined above
+    filename = FOCUS_PREFIX_RE.sub("", filename)
+    filename = EXTENSION_RE.sub("", filename)
+    return tuple(DELIMITERS.split(filename))
+
+
+def _known_focal_point(
+    namespace: str, filename: str, query_parameters: Sequence[Union[str, int]]
+) -> Optional[Sequence[Union[str, int]]]:
+    """
+    Focal point of a crop, or None if it has to be found in the pixels of
+    the source (auto crops).
+    """
+    # focal points set by editors in the index win over the filename convention
+    focal_point = indexed_focal_point(
+        namespace, filename
+    )  # type: Optional[Sequence[Union[str, int]]]
+    if focal_point is None:
+        focal_point = filename_focal_point(filename)
+    if focal_point is not None:
+        return focal_point
 
     if not query_parameters:
         # default crop, focal point is the center so 50% on the x & y axes
         return [50, 50]
 
+    if str(query_parameters[0]).lower() == "auto":
+        return None
+
     return query_parameters
 
 
+def _derive_focal_point(
+    img: Image.Image, query_parameters: Sequence[Union[str, int]]
+) -> Sequence[Union[str, int]]:
+    filename = img.info["filename"]
+    namespace = img.info.get("namespace", "")
+
+    focal_point = _known_focal_point(namespace, filename, query_parameters)
+    if focal_point is None:
+        key = "{ns}/{fn}".format(ns=namespace, fn=filename)
+        return auto_focal_point(img, key)
+
+    return focal_point
+
+
+def fit_region(
+    size: Tuple[int, int],
+    parameters: Sequence[Union[str, int]],
+    namespace: str,
+    filename: str,
+) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Box of a source of `size` that a fit with `parameters` keeps, or None if
+    it depends on the pixels of the source or the parameters are invalid
+    (apply_transform reports them).
+    """
+    if len(parameters) < 2:
+        return None
+    focal_point = _known_focal_point(namespace, filename, parameters[2:])
+    if focal_point is None or len(focal_point) < 2:
+        return None
+    try:
+        width, height = int(parameters[0]), int(parameters[1])
+        focal_x, focal_y = int(focal_point[0]), int(focal_point[1])
+    except ValueError:
+        return None
+    if width <= 0 or height <= 0 or not (0 <= focal_x <= 100 and 0 <= focal_y <= 100):
+        return None
+    return _fit_box(size, (width, height), (focal_x / 100, focal_y / 100))
+
+
 class FitTransform(BaseTransform):
 
     slug = "fit"
 
     @staticmethod
     def derive_parameters(query: str) -> Sequence[str]:
-        return re.split(DELIMITERS_RE, query)
+        return DELIMITERS.split(query)
 
     @staticmethod
     def apply_transform(
-        img: Image.Image, parameters: Sequence[Union[str, int]]
+        img: Image.Image,
+        parameters: Sequence[Union[str, int]],
+        resampling: Resampling = Resampling(),
+        scale: float = 1.0,
     ) -> Image.Image:
         """
         Crops input img about a focal point.
@@ -65,7 +178,9 @@ class FitTransform(BaseTransform):
 
         crop : image.png?crop=WWxHH
         focal crop : image.png?crop=WWxHHxFXxFY
-        smart crop : image_focus-FXxFY.png?crop=WWxHH
+        smart crop : image_focus-FXxFY.png?crop=WWxHH, or a focal point in
+                     ITS_FOCAL_POINT_INDEX
+        auto crop : image.png?crop=WWxHH,auto
         """
         if len(parameters) < 2:
             raise ITSClientError(error="crop requires width and height")
@@ -98,7 +213,7 @@ class FitTransform(BaseTransform):
         if focal_x in range(0, 101) and focal_y in range(0, 101) and crop_height != 0:
             try:
                 fitted_image = _fit_image(
-                    img, crop_width, crop_height, focal_x, focal_y
+                    img, crop_width, crop_height, focal_x, focal_y, resampling
                 )
             except ITSTransformError as error:
                 error_string = (
@@ -4,38 +4,22 @@ from typing import Sequence
 
 from PIL import Image
 
-from ..errors import ConfigError, ITSClientError, ITSTransformError
-from ..loaders import BaseLoader
-from ..settings import NAMESPACES, OVERLAYS
+from ..cache import LRUCache, image_nbytes, source_tags
+from ..errors import ConfigError, ITSClientError
+from ..loader import NAMESPACE_LOADERS
+from ..resampling import Resampling
+from ..settings import OVERLAY_CACHE_BYTES, OVERLAYS
 from .base import BaseTransform
 
 LOGGER = logging.getLogger(__name__)
 
 OVERLAY_PROPORTION = 0.2
 
-
-def get_loader(overlay_loader):
-
-    loader_classes = BaseLoader.__subclasses__()
-
-    loader = [loader for loader in loader_classes if loader.slug == overlay_loader]
-
-    if not loader:
-        raise ITSTransformError(
-            "Not Found Error: Overlay Image Loader "
-            + "with slug '%s' not found." % overlay_loader
-        )
-    if len(loader) > 1:
-        raise ITSTransformError(
-            "Configuration Error: Two or more Image Loaders "
-            + "have slug '%s'." % overlay_loader
-        )
-
-    return loader
+# overlays are a handful of small logos shared by every request thread
+OVERLAY_CACHE = LRUCache("overlay", OVERLAY_CACHE_BYTES, sizeof=image_nbytes)
 
 
 class OverlayTransform(BaseTransform):
-
     """
     Pastes a specified image over the input.
 
@@ -49,7 +33,7 @@ class OverlayTransform(BaseTransform):
         # overlay transform does not take parameters, so we don't split this
         return [query]
 
-    def apply_transform(self, img, parameters):
+    def apply_transform(self, img, parameters, resampling=Resampling(), scale=1.0):
         if not parameters:
             raise ITSClientError("no overlay image supplied")
 
@@ -60,25 +44,32 @@ class OverlayTransform(BaseTransform):
         if not overlay:
             raise ITSClientError("no overlay image supplied")
 
-        if "overlay" in NAMESPACES:
-            loader = get_loader(NAMESPACES["overlay"]["loader"])
+        if "overlay" in NAMESPACE_LOADERS:
+            loader = NAMESPACE_LOADERS["overlay"]
         else:
             raise ConfigError("No Backend has been set up for overlays.")
 
         if overlay.lower() not in OVERLAYS:
             namespace, *filename = overlay.strip("/").split("/")
-            filename = Path("/".join(filename))
-            overlay_image = loader[0].load_image(namespace, filename)
         else:
             namespace, *filename = OVERLAYS[overlay.lower()].split("/")
-            filename = Path("/".join(filename))
-            overlay_image = loader[0].load_image(namespace, filename)
+        filename = Path("/".join(filename))
+
+        def load_overlay():
+            overlay_image = loader.load_image(namespace, filename)
+            # decode now so threads never race on the lazy loading of a shared image
+            overlay_image.load()
+            return overlay_image
+
+        overlay_image = OVERLAY_CACHE.get_or_set(
+            (namespace, str(filename)),
+            load_overlay,
+            tags=source_tags(namespace, str(filename)),
+        )
 
         height = img.height
         overlay_size = int(height * OVERLAY_PROPORTION)
-        resized_overlay = overlay_image.resize(
-            (overlay_size, overlay_size), Image.ANTIALIAS
-        )
+        resized_overlay = resampling.resize(overlay_image, (overlay_size, overlay_size))
 
         # Only the overlay has an alpha channel
         if img.mode != "RGBA":
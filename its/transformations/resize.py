@@ -1,11 +1,11 @@
-import re
 from math import floor
 from typing import Sequence
 
 from PIL import Image
 
 from ..errors import ITSClientError
-from ..settings import DELIMITERS_RE
+from ..resampling import Resampling
+from ..util import DELIMITERS
 from .base import BaseTransform
 
 
@@ -15,9 +15,9 @@ class ResizeTransform(BaseTransform):
 
     @staticmethod
     def derive_parameters(query: str) -> Sequence[str]:
-        return re.split(DELIMITERS_RE, query)
+        return DELIMITERS.split(query)
 
-    def apply_transform(self, img, parameters):
+    def apply_transform(self, img, parameters, resampling=Resampling(), scale=1.0):
         """
         Resizes input image while maintaining aspect ratio.
         """
@@ -79,7 +79,7 @@ class ResizeTransform(BaseTransform):
             tgt_height = img.height
             tgt_width = img.width
 
-        resized = img.resize([tgt_width, tgt_height], Image.ANTIALIAS)
+        resized = resampling.resize(img, (tgt_width, tgt_height))
 
         # make sure we don't lose format data
         resized.format = img.format
@@ -0,0 +1,22 @@
+"""
+Optional runtime type checks.
+
+enforce is slow to import and only useful while developing, so it is only
+imported when ITS_ENFORCE_TYPE_CHECKS is set.
+"""
+
+from typing import Any
+
+from .settings import ENFORCE_TYPE_CHECKS
+
+
+def runtime_validation(obj: Any) -> Any:
+    """
+    Same as enforce.runtime_validation(enabled=ENFORCE_TYPE_CHECKS).
+    """
+    if not ENFORCE_TYPE_CHECKS:
+        return obj
+
+    import enforce  # pylint: disable=import-outside-toplevel
+
+    return enforce.runtime_validation(obj)
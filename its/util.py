@@ -1,16 +1,25 @@
+import calendar
+import re
+import zlib
+from typing import Dict, Optional
+
 from flask import request
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
 
 from .errors import ITSInvalidImageFileError
-from .settings import MIME_TYPES, NAMESPACES
+from .settings import DELIMITERS_RE, MIME_TYPES, NAMESPACES
+
+# splits transform arguments, e.g. the width and height in resize=WWxHH
+DELIMITERS = re.compile(DELIMITERS_RE)
 
 
-def get_redirect_location(namespace, query, filename):
+def get_redirect_location(namespace, query, filename, scheme=None, host=None):
     config = NAMESPACES[namespace]
     redirect_url = "{url}?{query_param}={scheme}://{host}/{namespace}/{path}".format(
         url=config["url"],
         query_param=config["query-param"],
-        scheme=request.scheme,
-        host=request.host,
+        scheme=scheme or request.scheme,
+        host=host or request.host,
         namespace=namespace,
         path=filename,
     )
@@ -29,3 +38,43 @@ def validate_image_type(image):
         raise ITSInvalidImageFileError("invalid image file")
 
     return image
+
+
+def response_etag(validator: str, query: Dict[str, str]) -> str:
+    """
+    Entity tag of a transformed image, from the validator of its source
+    and the transforms applied to it.
+    """
+    canonical = "&".join(
+        "{key}={val}".format(key=key, val=val) for key, val in sorted(query.items())
+    )
+    return "{validator}-{crc:x}".format(
+        validator=validator, crc=zlib.crc32(canonical.encode())
+    )
+
+
+def validator_headers(etag: str, last_modified: float) -> Dict[str, str]:
+    return {"ETag": quote_etag(etag), "Last-Modified": http_date(last_modified)}
+
+
+def is_not_modified(
+    etag: str,
+    last_modified: float,
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> bool:
+    """
+    Evaluates the conditional headers of a GET request, If-None-Match wins
+    over If-Modified-Since as in RFC 7232.
+    """
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+
+    if if_modified_since:
+        since = parse_date(if_modified_since)
+        # http dates have a resolution of one second
+        return since is not None and int(last_modified) <= calendar.timegm(
+            since.utctimetuple()
+        )
+
+    return False
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Compares the memory-mapped FileSystemLoader with the previous
+`BytesIO(open(path, "rb").read())` copy path on a large source image:
+time to parse the header, time to decode and resize, and the Python memory
+allocated on the way (the decoded pixels live outside of tracemalloc's view).
+
+    pipenv run python scripts/benchmarks/file_system_benchmark.py --size 8000x6000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from its.loaders.file_system import (
+    MappedFile,
+)  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def copy_open(path):
+    return BytesIO(open(path, "rb").read())
+
+
+def mmap_open(path):
+    return MappedFile(path)
+
+
+def make_source(directory: str, width: int, height: int) -> str:
+    path = os.path.join(directory, "source.jpg")
+    # noise barely compresses, so the file is about as large as mezzanine sources
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(
+        path, quality=95
+    )
+    return path
+
+
+def measure(open_file, path, runs, decode):
+    times = []
+    peaks = []
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        image = Image.open(open_file(path))
+        if decode:
+            image.thumbnail((400, 400))
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del image
+    return statistics.median(times) * 1000, max(peaks) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="6000x4000")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    width, height = [int(value) for value in args.size.split("x")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_source(directory, width, height)
+        print(
+            "source: {}x{}, {:.1f} MB".format(
+                width, height, os.path.getsize(path) / 2 ** 20
+            )
+        )
+        print("{:<8}{:<10}{:>10}{:>14}".format("loader", "stage", "ms", "py alloc MB"))
+        for decode in (False, True):
+            stage = "decode" if decode else "header"
+            for name, open_file in (("copy", copy_open), ("mmap", mmap_open)):
+                elapsed, peak = measure(open_file, path, args.runs, decode)
+                print(
+                    "{:<8}{:<10}{:>10.1f}{:>14.1f}".format(name, stage, elapsed, peak)
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Compares throughput and memory of threaded vs multi-process ITS workers
+under a mix of I/O-bound (slow origin) and CPU-bound (large resize) requests.
+
+    pipenv run python scripts/benchmarks/request_benchmark.py --workers 4 --requests 200
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+# an origin that answers slowly, like the merlin CDN on a bad day
+os.environ.setdefault(
+    "ITS_BACKENDS",
+    """{
+        "tests": {"loader": "file_system", "folders": ["tests/images"]},
+        "slow": {"loader": "slow_origin", "folders": ["tests/images"]},
+        "overlay": {"loader": "file_system", "prefixes": ["test/overlay"]}
+    }""",
+)
+
+from its.loaders import BaseLoader, FileSystemLoader  # noqa: E402 pylint: disable=wrong-import-position
+
+ORIGIN_LATENCY = float(os.environ.get("BENCH_ORIGIN_LATENCY", "0.1"))
+
+
+class SlowOriginLoader(BaseLoader):
+    """
+    File system loader that waits like a remote origin before answering.
+    """
+
+    slug = "slow_origin"
+    parameter_name = "folders"
+
+    @staticmethod
+    def get_fileobj(namespace, filename):
+        time.sleep(ORIGIN_LATENCY)  # sleeping releases the GIL, like socket I/O
+        return FileSystemLoader.get_fileobj("tests", filename)
+
+    @staticmethod
+    def load_image(namespace, filename):
+        time.sleep(ORIGIN_LATENCY)
+        return FileSystemLoader.load_image("tests", filename)
+
+
+from its.application import APP  # noqa: E402 pylint: disable=wrong-import-position
+
+IO_BOUND = "/slow/images/abe.jpg?resize=100x&format=jpg"
+CPU_BOUND = "/tests/images/seagull.jpg?resize=800x&blur=2&format=jpg"
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run(urls):
+    client = APP.test_client()
+    failures = 0
+    for url in urls:
+        if client.get(url).status_code != 200:
+            failures += 1
+    return failures, _peak_rss_mb()
+
+
+def _split(urls, workers):
+    return [urls[i::workers] for i in range(workers)]
+
+
+def bench(mode: str, workers: int, urls) -> dict:
+    executor_class = ThreadPoolExecutor if mode == "threads" else ProcessPoolExecutor
+    start = time.monotonic()
+    with executor_class(max_workers=workers) as executor:
+        results = list(executor.map(_run, _split(urls, workers)))
+    elapsed = time.monotonic() - start
+
+    failures = sum(result[0] for result in results)
+    if mode == "threads":
+        memory = _peak_rss_mb()
+    else:
+        memory = sum(result[1] for result in results)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "requests": len(urls),
+        "failures": failures,
+        "seconds": elapsed,
+        "rps": len(urls) / elapsed,
+        "rss_mb": memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument(
+        "--io-ratio",
+        type=float,
+        default=0.7,
+        help="share of requests that wait on the slow origin",
+    )
+    args = parser.parse_args()
+
+    io_requests = int(args.requests * args.io_ratio)
+    urls = [IO_BOUND] * io_requests + [CPU_BOUND] * (args.requests - io_requests)
+
+    print(
+        "{:<10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            "mode", "workers", "requests", "failures", "seconds", "req/s", "rss MB"
+        )
+    )
+    for mode in ("processes", "threads"):
+        result = bench(mode, args.workers, urls)
+        print(
+            "{mode:<10}{workers:>8}{requests:>10}{failures:>10}"
+            "{seconds:>10.2f}{rps:>10.1f}{rss_mb:>10.1f}".format(**result)
+        )
+
+
+if __name__ == "__main__":
+    main()
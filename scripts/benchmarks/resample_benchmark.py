@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Compares the resampling filters a namespace can choose with "resample"
+(or a request with ?resample=): milliseconds per source megapixel, and the
+SSIM of each result to a plain Lanczos resize, the sharpest and slowest one.
+
+    pipenv run python scripts/benchmarks/resample_benchmark.py
+    pipenv run python scripts/benchmarks/resample_benchmark.py \
+        path/to/mezzanine/*.jpg --widths 320 --settings lanczos lanczos,3 bicubic,2
+
+An SSIM of 1 means identical to Lanczos, differences stop being visible
+somewhere above 0.98.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image, ImageMath
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from its.resampling import (  # noqa: E402 pylint: disable=wrong-import-position
+    FILTERS,
+    parse_resampling,
+)
+
+FIXTURES = Path(__file__).resolve().parents[2] / "its" / "tests" / "images"
+
+DEFAULT_SETTINGS = [
+    name + gap for name in reversed(list(FILTERS)) for gap in ("", ",3", ",2")
+]
+
+# SSIM is averaged over windows of this many pixels squared
+WINDOW = 8
+
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+
+
+def _window_means(image):
+    return list(
+        image.resize(
+            (image.width // WINDOW, image.height // WINDOW), Image.BOX
+        ).getdata()
+    )
+
+
+def ssim(first, second):
+    """
+    Mean structural similarity of the luma of two images of the same size.
+    """
+    width = first.width // WINDOW * WINDOW
+    height = first.height // WINDOW * WINDOW
+    if not width or not height:
+        return 1.0 if first.tobytes() == second.tobytes() else 0.0
+
+    x = first.convert("L").crop((0, 0, width, height)).convert("F")
+    y = second.convert("L").crop((0, 0, width, height)).convert("F")
+    mean_x = _window_means(x)
+    mean_y = _window_means(y)
+    mean_xx = _window_means(ImageMath.eval("a * a", a=x))
+    mean_yy = _window_means(ImageMath.eval("a * a", a=y))
+    mean_xy = _window_means(ImageMath.eval("a * b", a=x, b=y))
+
+    total = 0.0
+    for mx, my, mxx, myy, mxy in zip(mean_x, mean_y, mean_xx, mean_yy, mean_xy):
+        var_x = mxx - mx * mx
+        var_y = myy - my * my
+        covariance = mxy - mx * my
+        total += ((2 * mx * my + C1) * (2 * covariance + C2)) / (
+            (mx * mx + my * my + C1) * (var_x + var_y + C2)
+        )
+    return total / len(mean_x)
+
+
+def load_sources(paths):
+    sources = []
+    for path in paths:
+        try:
+            image = Image.open(path)
+            image.load()
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            continue
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        sources.append((path.name, image))
+    return sources
+
+
+def time_resize(resampling, image, size, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        resampling.resize(image, size)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "images", nargs="*", type=Path, help="sources, defaults to the test fixtures"
+    )
+    parser.add_argument("--widths", type=int, nargs="+", default=[160, 320, 640])
+    parser.add_argument("--settings", nargs="+", default=DEFAULT_SETTINGS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    settings = [(setting, parse_resampling(setting)) for setting in args.settings]
+    reference = parse_resampling("lanczos")
+    sources = load_sources(args.images or sorted(FIXTURES.glob("*.*")))
+
+    results = {setting: ([], []) for setting, _ in settings}
+    for _, image in sources:
+        megapixels = image.width * image.height / 10 ** 6
+        for width in args.widths:
+            if width >= image.width:
+                continue
+            size = (width, max(round(image.height * width / image.width), 1))
+            expected = reference.resize(image, size)
+            for setting, resampling in settings:
+                elapsed = time_resize(resampling, image, size, args.runs)
+                times, similarities = results[setting]
+                times.append(elapsed * 1000 / megapixels)
+                similarities.append(ssim(resampling.resize(image, size), expected))
+
+    print(
+        "{} sources, {} widths, {} runs each".format(
+            len(sources), len(args.widths), args.runs
+        )
+    )
+    print(
+        "{:<16}{:>12}{:>12}{:>12}".format("resample", "ms/MP", "mean SSIM", "min SSIM")
+    )
+    for setting, (times, similarities) in results.items():
+        if not times:
+            continue
+        print(
+            "{:<16}{:>12.2f}{:>12.4f}{:>12.4f}".format(
+                setting,
+                statistics.median(times),
+                statistics.mean(similarities),
+                min(similarities),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
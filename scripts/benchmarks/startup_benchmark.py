@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Measures how long a fresh worker takes to boot: the import time of ITS and
+its heavy dependencies, and the time from interpreter start to the first
+served response. Every measurement runs in a new interpreter, like a uwsgi
+worker with lazy-apps.
+
+    pipenv run python scripts/benchmarks/startup_benchmark.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+MODULES = [
+    "PIL.Image",
+    "requests",
+    "flask",
+    "flask_cors",
+    "newrelic.agent",
+    "sentry_sdk",
+    "boto3",
+    "enforce",
+    "its.settings",
+    "its.loaders",
+    "its.application",
+]
+
+# dependencies that a worker should not import until a request needs them
+LAZY_MODULES = ["boto3", "botocore", "sentry_sdk", "enforce", "aiohttp", "aiobotocore"]
+
+FIRST_REQUEST = "/tests/images/test.png?resize=50x"
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+BOOT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from its.wsgi import application
+imported = time.perf_counter()
+response = application.test_client().get({url!r})
+served = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "first_response": served - start,
+    "status": response.status_code,
+    "loaded": [name for name in {lazy!r} if name in sys.modules],
+}}))
+"""
+
+
+def probe(code: str) -> dict:
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=str(ROOT), env=dict(os.environ)
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:<20}{:>12}".format("module", "import ms"))
+    for module in MODULES:
+        try:
+            times = [
+                probe(IMPORT_PROBE.format(module=module))["seconds"]
+                for _ in range(args.runs)
+            ]
+        except subprocess.CalledProcessError:
+            print("{:<20}{:>12}".format(module, "missing"))
+            continue
+        print("{:<20}{:>12.1f}".format(module, statistics.median(times) * 1000))
+
+    boots = [
+        probe(BOOT_PROBE.format(url=FIRST_REQUEST, lazy=LAZY_MODULES))
+        for _ in range(args.runs)
+    ]
+    print()
+    print(
+        "import its.wsgi: {:.1f} ms, first response: {:.1f} ms (status {})".format(
+            statistics.median(boot["import"] for boot in boots) * 1000,
+            statistics.median(boot["first_response"] for boot in boots) * 1000,
+            boots[-1]["status"],
+        )
+    )
+    print(
+        "lazy dependencies loaded at boot: {}".format(
+            ", ".join(boots[-1]["loaded"]) or "none"
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,6 @@ setup(
     packages=find_packages(),
     description="image transformation service",
     platforms=["any"],
-    install_requires=["flask", "pillow"],
+    install_requires=["flask", "pillow", 'importlib-metadata; python_version < "3.10"'],
     extras_require={"dev": ["flake8", "pytest"]},
 )